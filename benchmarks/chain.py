@@ -0,0 +1,210 @@
+import asyncio
+import contextlib
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any
+
+from aiohttp import WSMsgType, web
+from eth_tester import EthereumTester, PyEVMBackend
+from eth_tester.backends.pyevm.main import get_default_account_keys
+from web3 import EthereumTesterProvider, Web3
+from web3.middleware import combine_middleware
+
+# eth-tester mines each tx on arrival, so a nonce ahead of the sender's is rejected
+NONCE_TOO_HIGH = re.compile(r"Expected (\d+), but got (\d+)")
+# How long a tx with a nonce gap is held back, like a node's pending queue would
+NONCE_GAP_TIMEOUT = 5.0
+# Calls that mine a block, eth-tester mines one per tx
+MINING_METHODS = frozenset({"eth_sendRawTransaction", "eth_sendTransaction"})
+
+
+def _to_json(value: object) -> object:
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    msg = f"Cannot encode {type(value).__name__}"
+    raise TypeError(msg)
+
+
+class LocalChain:
+    """In-process EVM served over JSON-RPC, counting calls and round trips per client.
+
+    Each client uses its own path (e.g. `/tee` or `/load`) so the RPC cost of
+    the TEE can be told apart from the load generator's. `/ws/{client}` stands
+    in for a node's WebSocket endpoint, with `eth_subscribe` to new heads, and
+    `drop_subscriptions` cuts it off to exercise the fallback to polling.
+    """
+
+    def __init__(self, latency: float = 0.0, block_time: float = 0.0) -> None:
+        # Added to every round trip, to mimic a remote provider
+        self.latency = latency
+        # Seconds between empty blocks mined besides those of txs, 0 for none
+        self.block_time = block_time
+        self.tester = EthereumTester(PyEVMBackend())
+        provider = EthereumTesterProvider(self.tester)
+        self._make_request = combine_middleware(
+            middleware=provider._middleware,  # noqa: SLF001  # pyright: ignore [reportPrivateUsage]
+            w3=Web3(provider),
+            provider_request_fn=provider.make_request,
+        )
+        # HTTP requests, a JSON-RPC batch is one round trip for several calls
+        self.round_trips: Counter[str] = Counter()
+        self.method_calls: Counter[tuple[str, str]] = Counter()
+        # The EVM is not thread safe, requests run one at a time off the loop
+        self._lock = threading.Lock()
+        self._called = asyncio.Condition()
+        self._runner: web.AppRunner | None = None
+        # Open WebSockets with their newHeads subscription ids
+        self._sockets: dict[web.WebSocketResponse, set[str]] = {}
+        self._head = 0
+        self._block_producer: asyncio.Task[None] | None = None
+
+    @property
+    def account_keys(self) -> list[str]:
+        """Private keys of the prefunded accounts."""
+        return [key.to_hex() for key in get_default_account_keys()]  # pyright: ignore [reportAttributeAccessIssue]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve JSON-RPC and return the base URL, append the client name to it."""
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/{client}", self._handle)
+        app.router.add_get("/ws/{client}", self._handle_websocket)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        _, bound_port = self._runner.addresses[0][:2]
+        if self.block_time:
+            self._block_producer = asyncio.create_task(self._produce_blocks())
+        return f"http://{host}:{bound_port}"
+
+    async def drop_subscriptions(self) -> None:
+        """Close every WebSocket, as a node restart or network blip would."""
+        for socket in list(self._sockets):
+            await socket.close()
+
+    def calls_by_method(self, client: str) -> Counter[str]:
+        return Counter({m: n for (c, m), n in self.method_calls.items() if c == client})
+
+    async def stop(self) -> None:
+        if self._block_producer:
+            self._block_producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._block_producer
+        await self.drop_subscriptions()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        client = request.match_info["client"]
+        self.round_trips[client] += 1
+        await asyncio.sleep(self.latency)
+        body = await request.json()
+        if isinstance(body, list):
+            result: Any = await asyncio.gather(
+                *(self._dispatch(client, call) for call in body)
+            )
+        else:
+            result = await self._dispatch(client, body)
+        return web.Response(
+            text=json.dumps(result, default=_to_json), content_type="application/json"
+        )
+
+    async def _handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        client = request.match_info["client"]
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        subscriptions = self._sockets[socket] = set()
+        try:
+            async for message in socket:
+                # web3 sends its requests as binary frames
+                if message.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    continue
+                call = json.loads(message.data)
+                self.round_trips[client] += 1
+                await asyncio.sleep(self.latency)
+                if call["method"] == "eth_subscribe":
+                    self.method_calls[client, call["method"]] += 1
+                    response = self._subscribe(subscriptions, call.get("params", []))
+                    response.update(jsonrpc="2.0", id=call.get("id"))
+                else:
+                    response = await self._dispatch(client, call)
+                await socket.send_str(json.dumps(response, default=_to_json))
+        finally:
+            del self._sockets[socket]
+        return socket
+
+    def _subscribe(self, subscriptions: set[str], params: list[Any]) -> dict[str, Any]:
+        if params != ["newHeads"]:
+            return {"error": {"code": -32602, "message": f"Unsupported {params}"}}
+        subscription = f"0x{len(subscriptions) + 1:x}"
+        subscriptions.add(subscription)
+        return {"result": subscription}
+
+    async def _produce_blocks(self) -> None:
+        """Keep the chain moving like a live one, even while no txs are sent."""
+        while True:
+            await asyncio.sleep(self.block_time)
+            await asyncio.to_thread(self._mine_block)
+            await self._announce_head()
+
+    def _mine_block(self) -> None:
+        with self._lock:
+            self.tester.mine_blocks()
+
+    async def _announce_head(self) -> None:
+        """Push the latest block to newHeads subscribers once it changes."""
+        response = await asyncio.to_thread(
+            self._request, "eth_getBlockByNumber", ["latest", False]
+        )
+        head = response["result"]
+        if head["number"] <= self._head:
+            return
+        self._head = head["number"]
+        head = {k: v for k, v in head.items() if k != "transactions"}
+        for socket, subscriptions in list(self._sockets.items()):
+            for subscription in subscriptions:
+                notification = {
+                    "jsonrpc": "2.0",
+                    "method": "eth_subscription",
+                    "params": {"subscription": subscription, "result": head},
+                }
+                with contextlib.suppress(ConnectionError):
+                    await socket.send_str(json.dumps(notification, default=_to_json))
+
+    async def _dispatch(self, client: str, call: dict[str, Any]) -> dict[str, Any]:
+        method, params = call["method"], call.get("params", [])
+        self.method_calls[client, method] += 1
+        response = await self._request_async(method, params)
+        if method == "eth_sendRawTransaction":
+            deadline = asyncio.get_running_loop().time() + NONCE_GAP_TIMEOUT
+            while self._nonce_too_high(response):
+                # Retry once another call, e.g. the missing tx, went through
+                async with self._called:
+                    with contextlib.suppress(TimeoutError):
+                        async with asyncio.timeout_at(deadline):
+                            await self._called.wait()
+                if asyncio.get_running_loop().time() >= deadline:
+                    break
+                response = await self._request_async(method, params)
+        if method in MINING_METHODS and self._sockets:
+            await self._announce_head()
+        return {**response, "jsonrpc": "2.0", "id": call.get("id")}
+
+    @staticmethod
+    def _nonce_too_high(response: dict[str, Any]) -> bool:
+        match = NONCE_TOO_HIGH.search(response.get("error", {}).get("message", ""))
+        return bool(match) and int(match[2]) > int(match[1])
+
+    async def _request_async(self, method: str, params: list[Any]) -> dict[str, Any]:
+        try:
+            response = await asyncio.to_thread(self._request, method, params)
+        except Exception as e:  # noqa: BLE001
+            response = {"error": {"code": -32000, "message": str(e)}}
+        async with self._called:
+            self._called.notify_all()
+        return response
+
+    def _request(self, method: str, params: list[Any]) -> dict[str, Any]:
+        with self._lock:
+            return dict(self._make_request(method, params))
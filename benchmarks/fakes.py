@@ -0,0 +1,129 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import override
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+
+from tee_gemini.tpm_backend import TPMBackend
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """Log-normal latency with a median and a p99, plus a failure rate."""
+
+    median: float
+    p99: float
+    error_rate: float = 0.0
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        # 2.326 is the z-score of the 99th percentile
+        sigma = math.log(max(self.p99, self.median) / self.median) / 2.326
+        return random.lognormvariate(math.log(self.median), sigma)
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate  # noqa: S311
+
+
+@dataclass
+class FakeUsage:
+    prompt_token_count: int
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class FakeGeminiResult:
+    text: str
+    usage_metadata: FakeUsage
+
+
+class FakeGenerativeModel:
+    """Stand-in for `genai.GenerativeModel` answering after a sampled latency.
+
+    Failures are raised as the quota and availability errors Gemini returns.
+    It replaces the models of `GeminiAPI`, so no call reaches the SDK's HTTP
+    client.
+    """
+
+    def __init__(self, latency: LatencyModel, response_tokens: int = 64) -> None:
+        self.latency = latency
+        self.response_tokens = response_tokens
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: str) -> FakeGeminiResult:
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        if self.latency.fails():
+            error = random.choice((TooManyRequests, ServiceUnavailable))  # noqa: S311
+            msg = "Injected failure"
+            raise error(msg)
+        prompt_tokens = max(1, len(prompt) // 4)
+        return FakeGeminiResult(
+            text="lorem ipsum " * (self.response_tokens // 2),
+            usage_metadata=FakeUsage(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=self.response_tokens,
+                total_token_count=prompt_tokens + self.response_tokens,
+            ),
+        )
+
+
+class FakeTPMBackend(TPMBackend):
+    """TPM stand-in minting unsigned tokens that expire after `token_lifetime`."""
+
+    def __init__(self, latency: LatencyModel, token_lifetime: float = 3600) -> None:
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.calls = 0
+        self._ek = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._signing_key = os.urandom(32)
+
+    async def _wait(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+
+    @override
+    async def check_connection(self) -> str:
+        return "Fake TPM"
+
+    @override
+    async def ek_pubkey_pem(self) -> str:
+        await self._wait()
+        return (
+            self._ek.public_key()
+            .public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            .decode()
+        )
+
+    @override
+    async def oidc_token(
+        self, audience: str | None = None, nonces: Sequence[str] = ()
+    ) -> str:
+        await self._wait()
+        now = int(time.time())
+        claims = {
+            "iss": "https://confidentialcomputing.googleapis.com",
+            "aud": audience or "https://sts.googleapis.com",
+            "iat": now,
+            "exp": now + int(self.token_lifetime),
+            "eat_nonce": list(nonces),
+        }
+        return jwt.encode(claims, self._signing_key, algorithm="HS256")
+
+    @override
+    async def random_hex(self, num_bytes: int) -> str:
+        await self._wait()
+        return os.urandom(num_bytes).hex()
@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from eth_account import Account
+from eth_typing import ABI
+from eth_utils import event_abi_to_log_topic, function_abi_to_4byte_selector
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3.contract.async_contract import AsyncContract
+
+from benchmarks.chain import LocalChain
+from benchmarks.fakes import FakeGenerativeModel, FakeTPMBackend, LatencyModel
+from tee_gemini.config import Config, load_config
+from tee_gemini.main import async_loop, create_gemini_api
+from tee_gemini.tpm_interface import TPMInterface
+
+logger = logging.getLogger(__name__)
+
+CONTRACTS_FOLDER = Path(__file__).resolve().parent.parent / "src" / "contracts"
+# Functions the load generator and the TEE call per request kind
+PROMPT_FUNCTIONS = {"makeRequest", "fulfillRequest"}
+OIDC_FUNCTIONS = {"requestOIDCToken", "fulfillOIDCToken"}
+# solc dispatches on function selectors pushed with PUSH4
+PUSH4 = b"\x63"
+FULFILLED_EVENTS = {
+    "RequestFullfilled": "prompt",
+    "RequestFullfilledCompact": "prompt",
+    "OIDCRequestFullfilled": "oidc",
+}
+
+
+@dataclass
+class BenchArgs:
+    requests: int
+    rate: float
+    oidc_fraction: float
+    senders: int
+    gemini_median: float
+    gemini_p99: float
+    gemini_error_rate: float
+    tpm_median: float
+    tpm_p99: float
+    poll_interval: float
+    rpc_latency: float
+    block_time: float
+    ws: bool
+    ws_drop_every: float
+    timeout: float
+    solc_version: str
+    bytecode: str | None
+    json: bool
+    verbose: bool
+
+
+@dataclass
+class Report:
+    submitted: int = 0
+    fulfilled: int = 0
+    duration: float = 0.0
+    requests_per_second: float = 0.0
+    latency_p50: float = 0.0
+    latency_p99: float = 0.0
+    rpc_calls_per_request: float = 0.0
+    round_trips_per_request: float = 0.0
+    rpc_calls_by_method: dict[str, int] = field(default_factory=dict)
+    gemini_calls: int = 0
+    tpm_calls: int = 0
+    # Seconds from starting the TEE loop to its first poll
+    startup: float = 0.0
+
+
+def parse_bench_args() -> BenchArgs:
+    """Parse command line arguments for the benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Run the TEE loop against a local EVM, fake Gemini and fake TPM"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="(default: 200)")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="requests submitted per second, 0 submits all at once (default: 0)",
+    )
+    parser.add_argument(
+        "--oidc-fraction",
+        type=float,
+        default=0.5,
+        help="share of OIDC requests, the rest are prompts (default: 0.5)",
+    )
+    parser.add_argument(
+        "--senders", type=int, default=4, help="accounts submitting (default: 4)"
+    )
+    parser.add_argument("--gemini-median", type=float, default=0.5)
+    parser.add_argument("--gemini-p99", type=float, default=2.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--tpm-median", type=float, default=0.05)
+    parser.add_argument("--tpm-p99", type=float, default=0.2)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.2,
+        help="SECONDS_BW_ITERATIONS of the TEE (default: 0.2)",
+    )
+    parser.add_argument(
+        "--rpc-latency",
+        type=float,
+        default=0.0,
+        help="seconds added to every RPC round trip (default: 0)",
+    )
+    parser.add_argument(
+        "--block-time",
+        type=float,
+        default=0,
+        help="also mine an empty block every this many seconds, as a live chain "
+        "would, 0 only mines blocks for txs (default: 0)",
+    )
+    parser.add_argument(
+        "--ws",
+        action="store_true",
+        help="wake the TEE on newHeads over the chain's WebSocket (WS_RPC_URL)",
+    )
+    parser.add_argument(
+        "--ws-drop-every",
+        type=float,
+        default=0,
+        help="with --ws, close the WebSocket every this many seconds to test "
+        "the handoff to polling and back, 0 never closes it (default: 0)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="give up waiting for fulfillments after this many seconds",
+    )
+    parser.add_argument(
+        "--solc-version",
+        type=str,
+        default="0.8.19",
+        help="solc used to compile Interactor.sol with py-solc-x (default: 0.8.19)",
+    )
+    parser.add_argument(
+        "--bytecode",
+        type=str,
+        default=None,
+        help="deploy this hex bytecode with Interactor.abi instead of compiling",
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show TEE logs")
+    return BenchArgs(**vars(parser.parse_args()))
+
+
+def check_contract(abi: ABI, bytecode: str, oidc_fraction: float) -> None:
+    """Fail unless the contract has the functions the mix of requests needs."""
+    needed = (PROMPT_FUNCTIONS if oidc_fraction < 1 else set()) | (
+        OIDC_FUNCTIONS if oidc_fraction > 0 else set()
+    )
+    code = HexBytes(bytecode)
+    selectors = {
+        entry["name"]: function_abi_to_4byte_selector(entry)
+        for entry in abi
+        if entry["type"] == "function"
+    }
+    if missing := sorted(
+        name
+        for name in needed
+        if name not in selectors or PUSH4 + selectors[name] not in code
+    ):
+        msg = (
+            f"Contract lacks {', '.join(missing)} needed for an OIDC fraction of "
+            f"{oidc_fraction}, deploy one matching `Interactor.abi`"
+        )
+        raise SystemExit(msg)
+
+
+def load_contract(args: BenchArgs) -> tuple[ABI, str]:
+    """Return the ABI and bytecode of the contract to deploy."""
+    abi: ABI = json.loads((CONTRACTS_FOLDER / "output" / "Interactor.abi").read_text())
+    if args.bytecode:
+        return abi, Path(args.bytecode).read_text().strip()
+
+    import solcx
+
+    compiled = solcx.compile_files(
+        [CONTRACTS_FOLDER / "Interactor.sol"],
+        output_values=["abi", "bin"],
+        solc_version=args.solc_version,
+    )
+    (contract,) = compiled.values()
+    # The TEE runs on `Interactor.abi`, so benchmark the contract it describes
+    if _sorted_abi(contract["abi"]) != _sorted_abi(abi):
+        msg = "`Interactor.abi` is out of date, regenerate it from `Interactor.sol`"
+        raise SystemExit(msg)
+    return abi, contract["bin"]
+
+
+def _sorted_abi(abi: ABI) -> list[str]:
+    return sorted(json.dumps(entry, sort_keys=True) for entry in abi)
+
+
+async def deploy(w3: AsyncWeb3, abi: ABI, bytecode: str, owner: str) -> AsyncContract:
+    factory = w3.eth.contract(abi=abi, bytecode=bytecode)
+    tx_hash = await factory.constructor(b"").transact({"from": owner})
+    receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
+    return w3.eth.contract(address=receipt["contractAddress"], abi=abi)  # pyright: ignore [reportReturnType]
+
+
+class LoadGenerator:
+    """Submit requests from several senders and time their fulfillment."""
+
+    def __init__(
+        self, contract: AsyncContract, senders: list[str], oidc_fraction: float
+    ) -> None:
+        self.contract = contract
+        self.senders = senders
+        self.oidc_fraction = oidc_fraction
+        self.submitted_at: dict[tuple[str, int], float] = {}
+        self.fulfilled_at: dict[tuple[str, int], float] = {}
+        # Set once `expected` requests are fulfilled
+        self.expected: int | None = None
+        self.all_fulfilled = asyncio.Event()
+
+    async def submit(self, index: int) -> None:
+        sender = self.senders[index % len(self.senders)]
+        if random.random() < self.oidc_fraction:  # noqa: S311
+            kind, call = "oidc", self.contract.functions.requestOIDCToken()
+            event = self.contract.events.OIDCRequestSubmitted()
+        else:
+            kind, call = (
+                "prompt",
+                self.contract.functions.makeRequest(f"Benchmark prompt {index}"),
+            )
+            event = self.contract.events.RequestSubmitted()
+        tx_hash = await call.transact({"from": sender})
+        receipt = await self.contract.w3.eth.wait_for_transaction_receipt(tx_hash)
+        (log,) = event.process_receipt(receipt)
+        self.submitted_at[kind, log["args"]["uid"]] = time.perf_counter()
+
+    async def run(self, requests: int, rate: float) -> None:
+        started_at = time.perf_counter()
+        tasks: list[asyncio.Task[None]] = []
+        for index in range(requests):
+            if rate:
+                await asyncio.sleep(
+                    max(0, started_at + index / rate - time.perf_counter())
+                )
+            tasks.append(asyncio.create_task(self.submit(index)))
+        await asyncio.gather(*tasks)
+
+    async def watch(self, interval: float = 0.05) -> None:
+        """Record when each fulfillment lands onchain."""
+        w3 = self.contract.w3
+        events = {
+            HexBytes(event_abi_to_log_topic(event.abi)): (
+                event,
+                FULFILLED_EVENTS[event.event_name],
+            )
+            for event in (
+                self.contract.events[name]()
+                for name in FULFILLED_EVENTS
+                if name in {e.get("name") for e in self.contract.abi}
+            )
+        }
+        next_block = await w3.eth.block_number
+        while True:
+            latest = await w3.eth.block_number
+            if latest >= next_block:
+                logs = await w3.eth.get_logs(
+                    {
+                        "address": self.contract.address,
+                        "fromBlock": next_block,
+                        "toBlock": latest,
+                        "topics": [list(events)],
+                    }
+                )
+                now = time.perf_counter()
+                for log in logs:
+                    event, kind = events[log["topics"][0]]
+                    uid = event.process_log(log)["args"]["uid"]
+                    self.fulfilled_at.setdefault((kind, uid), now)
+                next_block = latest + 1
+            if self.expected is not None and len(self.fulfilled_at) >= self.expected:
+                self.all_fulfilled.set()
+            await asyncio.sleep(interval)
+
+
+def tee_config(  # noqa: PLR0913
+    base_url: str,
+    contract_address: str,
+    key: str,
+    folder: str,
+    poll_interval: float,
+    *,
+    ws: bool,
+) -> Config:
+    """Point the TEE config at the local chain, other settings come from env."""
+    ws_url = base_url.replace("http://", "ws://", 1) + "/ws/tee"
+    return load_config(
+        {
+            **os.environ,
+            "GEMINI_ENDPOINT_ADDRESS": contract_address,
+            "RPC_URL": f"{base_url}/tee",
+            "WS_RPC_URL": ws_url if ws else "",
+            "SECONDS_BW_ITERATIONS": str(poll_interval),
+            "TEE_ADDRESS": Account.from_key(key).address,
+            "TEE_PRIVATE_KEY": key,
+            "GEMINI_API_KEY": "benchmark",
+            "STATE_DB_PATH": str(Path(folder) / "state.sqlite3"),
+            "RESPONSE_CACHE_PATH": "",
+            "METRICS_PORT": "0",
+        }
+    )
+
+
+async def drop_subscriptions(chain: LocalChain, interval: float) -> None:
+    """Close the chain's WebSockets every `interval` seconds, if set."""
+    if not interval:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        logger.warning("Dropping WebSocket subscriptions")
+        await chain.drop_subscriptions()
+
+
+async def run(args: BenchArgs) -> Report:
+    abi, bytecode = load_contract(args)
+    check_contract(abi, bytecode, args.oidc_fraction)
+    chain = LocalChain(latency=args.rpc_latency, block_time=args.block_time)
+    base_url = await chain.start()
+    tee_key, *sender_keys = chain.account_keys[: args.senders + 1]
+    w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(f"{base_url}/load"))
+    contract = await deploy(w3, abi, bytecode, Account.from_key(tee_key).address)
+
+    with tempfile.TemporaryDirectory() as folder:
+        config = tee_config(
+            base_url,
+            contract.address,
+            tee_key,
+            folder,
+            args.poll_interval,
+            ws=args.ws,
+        )
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+        gemini_model = FakeGenerativeModel(
+            LatencyModel(args.gemini_median, args.gemini_p99, args.gemini_error_rate)
+        )
+        gemini_api = create_gemini_api(config)
+        gemini_api.models = dict.fromkeys(gemini_api.models, gemini_model)  # pyright: ignore [reportAttributeAccessIssue]
+        tpm_backend = FakeTPMBackend(LatencyModel(args.tpm_median, args.tpm_p99))
+
+        ready = asyncio.Event()
+        tee_started_at = time.perf_counter()
+        tee = asyncio.create_task(
+            async_loop(config, gemini_api, TPMInterface(tpm_backend), ready=ready)
+        )
+        first_poll = asyncio.create_task(ready.wait())
+        await asyncio.wait({first_poll, tee}, return_when=asyncio.FIRST_COMPLETED)
+        if tee.done():
+            tee.result()
+        startup = time.perf_counter() - tee_started_at
+        calls_before = chain.calls_by_method("tee")
+        round_trips_before = chain.round_trips["tee"]
+
+        load = LoadGenerator(
+            w3.eth.contract(address=contract.address, abi=abi),
+            [Account.from_key(key).address for key in sender_keys],
+            args.oidc_fraction,
+        )
+        watcher = asyncio.create_task(load.watch())
+        dropper = asyncio.create_task(drop_subscriptions(chain, args.ws_drop_every))
+        started_at = time.perf_counter()
+        await load.run(args.requests, args.rate)
+        load.expected = len(load.submitted_at)
+        all_fulfilled = asyncio.create_task(load.all_fulfilled.wait())
+        await asyncio.wait(
+            {all_fulfilled, tee},
+            timeout=args.timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+
+        for task in (first_poll, all_fulfilled, watcher, dropper, tee):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    await chain.stop()
+
+    calls = chain.calls_by_method("tee")
+    calls.subtract(calls_before)
+    latencies = [
+        load.fulfilled_at[key] - load.submitted_at[key]
+        for key in load.fulfilled_at
+        if key in load.submitted_at
+    ]
+    report = Report(
+        submitted=len(load.submitted_at),
+        fulfilled=len(latencies),
+        rpc_calls_by_method={m: n for m, n in calls.most_common() if n},
+        gemini_calls=gemini_model.calls,
+        tpm_calls=tpm_backend.calls,
+        startup=startup,
+    )
+    if latencies:
+        report.duration = max(load.fulfilled_at.values()) - started_at
+        report.requests_per_second = report.fulfilled / report.duration
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        report.latency_p50, report.latency_p99 = quantiles[49], quantiles[98]
+        report.rpc_calls_per_request = calls.total() / report.fulfilled
+        report.round_trips_per_request = (
+            chain.round_trips["tee"] - round_trips_before
+        ) / report.fulfilled
+    return report
+
+
+def print_report(report: Report) -> None:
+    lines = [
+        f"Fulfilled       {report.fulfilled}/{report.submitted} requests "
+        f"in {report.duration:.2f}s",
+        f"Throughput      {report.requests_per_second:.1f} requests/s",
+        f"Latency         p50 {report.latency_p50 * 1000:.0f}ms, "
+        f"p99 {report.latency_p99 * 1000:.0f}ms",
+        f"RPC calls       {report.rpc_calls_per_request:.1f} per request, "
+        f"in {report.round_trips_per_request:.1f} round trips",
+        *(f"  {method:<28}{n}" for method, n in report.rpc_calls_by_method.items()),
+        f"Gemini calls    {report.gemini_calls}",
+        f"TPM calls       {report.tpm_calls}",
+        f"Startup         {report.startup:.2f}s to the first poll",
+    ]
+    print("\n".join(lines))  # noqa: T201
+
+
+def start() -> None:
+    args = parse_bench_args()
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(asdict(report)))  # noqa: T201
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    start()
@@ -6,38 +6,60 @@ contract Interactor {
     struct OIDCRequest {
         address sender;
         uint256 uid;
-        string token;
+        string data;
     }
 
-    struct PromptRequest {
+    struct Request {
         address sender;
         uint256 uid;
-        string prompt; // TODO: This should be bytes, but keep it as string for simplicity
+        string data; // TODO: This should be bytes, but keep it as string for simplicity
     }
 
-    struct PromptResponse {
+    struct Response {
         uint256 uid; // Response uid
-        string response;
+        string text;
+        uint256 promptTokenCount;
+        uint256 candidateTokenCount;
+        uint256 totalTokenCount;
+    }
+
+    // Response encoded by `tee_gemini.encoding`, a version byte followed by
+    // the UTF-8 text, deflated when that makes it shorter
+    struct CompactResponse {
+        uint256 uid;
+        bytes response;
         uint256 promptTokenCount;
         uint256 candidateTokenCount;
         uint256 totalTokenCount;
     }
 
     event OIDCRequestSubmitted(uint256 uid, address sender);
-    event OIDCRequestFullfilled(uint256 uid, string token);
+    event OIDCRequestFullfilled(uint256 uid, string data);
 
-    event PromptRequestSubmitted(uint256 uid, address sender, string prompt);
-    event PromptRequestFullfilled(
+    event RequestSubmitted(uint256 uid, address sender, string data);
+    event RequestFullfilled(
+        uint256 uid,
+        string text,
+        uint256 promptTokenCount,
+        uint256 candidateTokenCount,
+        uint256 totalTokenCount
+    );
+    event RequestFullfilledCompact(
         uint256 uid,
-        string response,
+        bytes response,
         uint256 promptTokenCount,
         uint256 candidateTokenCount,
         uint256 totalTokenCount
     );
 
-    PromptRequest[] public promptRequests;
+    Request[] public requests;
     OIDCRequest[] public oidcRequests;
-    mapping(uint256 => PromptResponse) public promptResponses;
+    mapping(uint256 => Response) public responses;
+    mapping(uint256 => CompactResponse) public compactResponses;
+    // Hashes of compact responses that were only emitted, not stored
+    mapping(uint256 => bytes32) public responseHashes;
+    // OIDC tokens are only emitted, this keeps them from being fulfilled twice
+    mapping(uint256 => bool) public oidcFulfilled;
     bytes public ekPublicKey;
     string public modelName;
 
@@ -73,7 +95,7 @@ contract Interactor {
         OIDCRequest memory req = OIDCRequest({
             sender: msg.sender,
             uid: uid,
-            token: ""
+            data: ""
         });
         oidcRequests.push(req);
         emit OIDCRequestSubmitted(uid, msg.sender);
@@ -83,37 +105,140 @@ contract Interactor {
     // Fulfill an OIDC request
     function fulfillOIDCToken(
         uint256 _uid,
-        string memory _token
+        string memory _data
+    ) external onlyOwner {
+        require(!oidcFulfilled[_uid], "Response already exists");
+        _storeOIDCToken(_uid, _data);
+    }
+
+    // Fulfill a batch of OIDC requests in a single transaction, skipping any
+    // that are already fulfilled
+    function fulfillOIDCTokenBatch(
+        uint256[] memory _uids,
+        string[] memory _data
     ) external onlyOwner {
-        // This would be limited to the address of eligible fulfillers
-        emit OIDCRequestFullfilled(_uid, _token);
+        require(_uids.length == _data.length, "Batch length mismatch");
+        for (uint256 i = 0; i < _uids.length; i++) {
+            if (oidcFulfilled[_uids[i]]) {
+                continue;
+            }
+            _storeOIDCToken(_uids[i], _data[i]);
+        }
+    }
+
+    function _storeOIDCToken(uint256 _uid, string memory _data) internal {
+        oidcFulfilled[_uid] = true;
+        emit OIDCRequestFullfilled(_uid, _data);
     }
 
     // Submit a prompt request
-    function makePromptRequest(string memory _prompt) external {
+    function makeRequest(string memory _data) external {
         require(
-            bytes(_prompt).length == 0,
+            bytes(_data).length > 0,
             "Request should have a non-zero length"
         );
-        uint256 uid = promptRequests.length + 1;
-        PromptRequest memory req = PromptRequest({
+        uint256 uid = requests.length + 1;
+        Request memory req = Request({
             sender: msg.sender,
             uid: uid,
-            prompt: _prompt
+            data: _data
         });
-        promptRequests.push(req);
-        emit PromptRequestSubmitted(uid, msg.sender, _prompt);
+        requests.push(req);
+        emit RequestSubmitted(uid, msg.sender, _data);
     }
 
     // Fulfill a prompt request
-    function fulfillPromptRequest(
+    function fulfillRequest(
         uint256 _uid,
-        PromptResponse memory _res
+        Response memory _response
+    ) external onlyOwner {
+        require(!_hasResponse(_uid), "Response already exists");
+        _storeResponse(_uid, _response);
+    }
+
+    // Fulfill a batch of prompt requests in a single transaction, skipping
+    // any that already have a response so one duplicate cannot revert the batch
+    function fulfillRequestBatch(
+        uint256[] memory _uids,
+        Response[] memory _responses
     ) external onlyOwner {
-        require(promptResponses[_uid].uid == 0, "Response already exists");
-        promptResponses[_uid] = _res;
+        require(_uids.length == _responses.length, "Batch length mismatch");
+        for (uint256 i = 0; i < _uids.length; i++) {
+            if (_hasResponse(_uids[i])) {
+                continue;
+            }
+            _storeResponse(_uids[i], _responses[i]);
+        }
+    }
 
-        emit PromptRequestFullfilled(
+    // Fulfill a prompt request with a compact response. With `_hashOnly` only
+    // its hash is stored, readers take the response from the event
+    function fulfillRequestCompact(
+        uint256 _uid,
+        CompactResponse memory _res,
+        bool _hashOnly
+    ) external onlyOwner {
+        require(!_hasResponse(_uid), "Response already exists");
+        _storeCompactResponse(_uid, _res, _hashOnly);
+    }
+
+    // Fulfill a batch of prompt requests with compact responses, skipping any
+    // that already have a response
+    function fulfillRequestCompactBatch(
+        uint256[] memory _uids,
+        CompactResponse[] memory _res,
+        bool _hashOnly
+    ) external onlyOwner {
+        require(_uids.length == _res.length, "Batch length mismatch");
+        for (uint256 i = 0; i < _uids.length; i++) {
+            if (_hasResponse(_uids[i])) {
+                continue;
+            }
+            _storeCompactResponse(_uids[i], _res[i], _hashOnly);
+        }
+    }
+
+    // Whether a prompt request has a response, in whichever encoding
+    function hasResponse(uint256 _uid) external view returns (bool) {
+        return _hasResponse(_uid);
+    }
+
+    // Covers every store a fulfillment writes, plain, compact or hash only,
+    // so a request fulfilled one way cannot be fulfilled again another way
+    function _hasResponse(uint256 _uid) internal view returns (bool) {
+        return
+            responses[_uid].uid != 0 ||
+            compactResponses[_uid].uid != 0 ||
+            responseHashes[_uid] != 0;
+    }
+
+    function _storeResponse(uint256 _uid, Response memory _response) internal {
+        // `_hasResponse` relies on the stored uid, so never trust the caller's
+        _response.uid = _uid;
+        responses[_uid] = _response;
+
+        emit RequestFullfilled(
+            _uid,
+            _response.text,
+            _response.promptTokenCount,
+            _response.candidateTokenCount,
+            _response.totalTokenCount
+        );
+    }
+
+    function _storeCompactResponse(
+        uint256 _uid,
+        CompactResponse memory _res,
+        bool _hashOnly
+    ) internal {
+        if (_hashOnly) {
+            responseHashes[_uid] = keccak256(_res.response);
+        } else {
+            _res.uid = _uid;
+            compactResponses[_uid] = _res;
+        }
+
+        emit RequestFullfilledCompact(
             _uid,
             _res.response,
             _res.promptTokenCount,
@@ -123,30 +248,64 @@ contract Interactor {
     }
 
     // Getter for the number of prompt requests
-    function getPromptRequestsCount() external view returns (uint256) {
-        return promptRequests.length;
+    function getRequestsCount() external view returns (uint256) {
+        return requests.length;
     }
 
     // Getter for prompt requests
-    function getPromptRequests()
-        external
-        view
-        returns (PromptRequest[] memory)
-    {
-        return promptRequests;
-    }
-
-    // Getter for all prompt responses
-    function getPromptResponses()
-        public
-        view
-        returns (PromptResponse[] memory)
-    {
-        PromptResponse[] memory result = new PromptResponse[](
-            promptRequests.length
+    function getRequests() external view returns (Request[] memory) {
+        return requests;
+    }
+
+    // Getter for up to `_limit` prompt requests from index `_offset` on
+    function getRequestsRange(
+        uint256 _offset,
+        uint256 _limit
+    ) external view returns (Request[] memory) {
+        uint256 end = _rangeEnd(_offset, _limit, requests.length);
+        Request[] memory result = new Request[](end - _offset);
+        for (uint256 i = _offset; i < end; i++) {
+            result[i - _offset] = requests[i];
+        }
+        return result;
+    }
+
+    // Getter for all prompt responses, use `getResponsesRange` once
+    // there are too many to return in one call
+    function getResponses() external view returns (Response[] memory) {
+        return getResponsesRange(1, requests.length);
+    }
+
+    // Getter for the responses to up to `_limit` requests from uid `_fromUid`
+    // on, with a zero uid for requests that are not fulfilled yet
+    function getResponsesRange(
+        uint256 _fromUid,
+        uint256 _limit
+    ) public view returns (Response[] memory) {
+        require(_fromUid > 0, "Uids start at 1");
+        uint256 offset = _fromUid - 1;
+        uint256 end = _rangeEnd(offset, _limit, requests.length);
+        Response[] memory result = new Response[](end - offset);
+        for (uint256 i = offset; i < end; i++) {
+            result[i - offset] = responses[i + 1];
+        }
+        return result;
+    }
+
+    // Getter for the compact responses to up to `_limit` requests from uid
+    // `_fromUid` on, with a zero uid for requests without a stored one
+    function getCompactResponsesRange(
+        uint256 _fromUid,
+        uint256 _limit
+    ) external view returns (CompactResponse[] memory) {
+        require(_fromUid > 0, "Uids start at 1");
+        uint256 offset = _fromUid - 1;
+        uint256 end = _rangeEnd(offset, _limit, requests.length);
+        CompactResponse[] memory result = new CompactResponse[](
+            end - offset
         );
-        for (uint256 i = 0; i < promptRequests.length; i++) {
-            result[i] = promptResponses[i];
+        for (uint256 i = offset; i < end; i++) {
+            result[i - offset] = compactResponses[i + 1];
         }
         return result;
     }
@@ -161,13 +320,34 @@ contract Interactor {
         return oidcRequests;
     }
 
+    // Getter for up to `_limit` OIDC requests from index `_offset` on
+    function getOIDCRequestsRange(
+        uint256 _offset,
+        uint256 _limit
+    ) external view returns (OIDCRequest[] memory) {
+        uint256 end = _rangeEnd(_offset, _limit, oidcRequests.length);
+        OIDCRequest[] memory result = new OIDCRequest[](end - _offset);
+        for (uint256 i = _offset; i < end; i++) {
+            result[i - _offset] = oidcRequests[i];
+        }
+        return result;
+    }
+
+    // End of the range of `_limit` items from `_offset`, clamped to `_length`
+    function _rangeEnd(
+        uint256 _offset,
+        uint256 _limit,
+        uint256 _length
+    ) internal pure returns (uint256) {
+        if (_offset >= _length) {
+            return _offset;
+        }
+        return _length - _offset < _limit ? _length : _offset + _limit;
+    }
+
     // Retrieve the latest prompt response
-    function getLatestPromptResponse()
-        public
-        view
-        returns (PromptResponse memory)
-    {
-        require(promptRequests.length > 0, "No prompt requests available");
-        return promptResponses[promptRequests.length];
+    function getLatestResponse() external view returns (Response memory) {
+        require(requests.length > 0, "No prompt requests available");
+        return responses[requests.length];
     }
 }
@@ -1,6 +1,28 @@
-from tee_gemini.gemini_api import GeminiAPI
-from tee_gemini.gemini_endpoint import GeminiEndpoint
-from tee_gemini.main import start
-from tee_gemini.tpm_interface import TPMInterface
+import importlib
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["GeminiAPI", "GeminiEndpoint", "TPMInterface", "start"]
+if TYPE_CHECKING:
+    from tee_gemini.encoding import decode_response  # noqa: TCH004
+    from tee_gemini.gemini_api import GeminiAPI  # noqa: TCH004
+    from tee_gemini.gemini_endpoint import GeminiEndpoint  # noqa: TCH004
+    from tee_gemini.main import start  # noqa: TCH004
+    from tee_gemini.tpm_interface import TPMInterface  # noqa: TCH004
+
+__all__ = ["GeminiAPI", "GeminiEndpoint", "TPMInterface", "decode_response", "start"]
+
+# Imported on first access, so importing a submodule does not load web3, the
+# Gemini SDK and the config from the environment
+_EXPORTS = {
+    "GeminiAPI": "tee_gemini.gemini_api",
+    "GeminiEndpoint": "tee_gemini.gemini_endpoint",
+    "TPMInterface": "tee_gemini.tpm_interface",
+    "decode_response": "tee_gemini.encoding",
+    "start": "tee_gemini.main",
+}
+
+
+def __getattr__(name: str) -> Any:  # noqa: ANN401
+    if name not in _EXPORTS:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
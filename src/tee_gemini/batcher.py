@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    max_size: int = 1
+    max_bytes: int = 64_000
+    max_delay: float = 2.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 1
+
+
+class Batcher(Generic[T]):
+    """Collect items and flush them together on a size, byte or time threshold."""
+
+    def __init__(
+        self,
+        flush: Callable[[list[T]], Awaitable[None]],
+        size_of: Callable[[T], int],
+        config: BatchConfig,
+    ) -> None:
+        self.flush = flush
+        self.size_of = size_of
+        self.config = config
+        self._items: list[tuple[T, asyncio.Future[None]]] = []
+        self._bytes = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushing: set[asyncio.Task[None]] = set()
+
+    async def add(self, item: T) -> None:
+        """Queue an item and wait until the batch containing it has been flushed."""
+        size = self.size_of(item)
+        if self._items and self._bytes + size > self.config.max_bytes:
+            self._flush_pending()
+
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((item, future))
+        self._bytes += size
+
+        if (
+            len(self._items) >= self.config.max_size
+            or self._bytes >= self.config.max_bytes
+        ):
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.config.max_delay, self._flush_pending
+            )
+        await future
+
+    def _flush_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._items, self._bytes = self._items, [], 0
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _send(self, batch: list[tuple[T, asyncio.Future[None]]]) -> None:
+        logger.info("Flushing batch of %i items", len(batch))
+        try:
+            await self.flush([item for item, _ in batch])
+        except Exception as e:  # noqa: BLE001
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
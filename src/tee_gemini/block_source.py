@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+
+from web3 import AsyncWeb3, WebSocketProvider
+from web3.exceptions import Web3Exception
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger(__name__)
+
+
+async def poll_ticks(interval: float) -> AsyncIterator[None]:
+    """Tick immediately and then every `interval` seconds."""
+    while True:
+        yield
+        await asyncio.sleep(interval)
+
+
+class NewHeadSubscriber:
+    """Tick on every new block announced over an `eth_subscribe` WebSocket.
+
+    Each tick only signals that the chain has moved; the consumer fetches logs
+    from its last processed block, so ticks lost while disconnected are caught
+    up on the next one. While the WebSocket is down, ticks fall back to polling.
+    """
+
+    def __init__(
+        self, ws_url: str, poll_interval: float, reconnect_delay: float = 30.0
+    ) -> None:
+        self.ws_url = ws_url
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+
+    async def ticks(self) -> AsyncIterator[None]:
+        """Yield once per new block, reconnecting after a dropped subscription."""
+        while True:
+            try:
+                # Fail fast on connect so polling takes over without a gap
+                provider = WebSocketProvider(self.ws_url, max_connection_retries=1)
+                async with AsyncWeb3(provider) as w3:
+                    await w3.eth.subscribe("newHeads")
+                    logger.info("Subscribed to new heads on `%s`", self.ws_url)
+                    # Backfill anything missed before the subscription started
+                    yield
+                    async for _ in w3.socket.process_subscriptions():
+                        yield
+            # Web3Exception covers failed connects and RPC errors, e.g. a node
+            # that does not support `eth_subscribe`
+            except (ConnectionClosed, Web3Exception, OSError, TimeoutError) as e:
+                logger.warning("Subscription to `%s` lost: %s", self.ws_url, e)
+
+            logger.info(
+                "Polling every %.1fs for %.0fs before reconnecting",
+                self.poll_interval,
+                self.reconnect_delay,
+            )
+            deadline = time.monotonic() + self.reconnect_delay
+            while time.monotonic() < deadline:
+                yield
+                await asyncio.sleep(self.poll_interval)
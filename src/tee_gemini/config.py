@@ -1,32 +1,206 @@
 import json
 import os
+from collections.abc import Mapping
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
+from typing import Any
 
 from dotenv import load_dotenv
 
-load_dotenv(".env")
+from tee_gemini.batcher import BatchConfig
+from tee_gemini.encoding import ResponseEncoding
+from tee_gemini.fee_oracle import FeeOracleConfig, FeeStrategy
+from tee_gemini.gemini_api import ModelConfig, ModelRoute
+from tee_gemini.rate_limiter import RateLimitConfig
+from tee_gemini.receipt_tracker import ReceiptTrackerConfig
+from tee_gemini.rpc_batching import RpcBatchConfig
+from tee_gemini.rpc_pool import RpcPoolConfig
+from tee_gemini.scheduler import SchedulerConfig
+from tee_gemini.sharding import ShardConfig
+
+ROOT_FOLDER = Path(__file__).resolve().parent.parent
 
 
-def load_env_var(var_name: str) -> str:
+def load_env_var(var_name: str, env: Mapping[str, str] = os.environ) -> str:
     """Load variables from environment."""
-    env_var = os.getenv(var_name, default="")
+    env_var = env.get(var_name, "")
     if not env_var:
         msg = f"'{var_name}' not found in env"
         raise ValueError(msg)
     return env_var
 
 
-# Contracts
-GEMINI_ENDPOINT_ADDRESS = load_env_var("GEMINI_ENDPOINT_ADDRESS")
-ROOT_FOLDER = Path(__file__).resolve().parent.parent
-with (ROOT_FOLDER / "contracts" / "output" / "Interactor.abi").open() as f:
-    GEMINI_ENDPOINT_ABI = json.load(f)
+def load_optional_env_var(
+    var_name: str, default: str, env: Mapping[str, str] = os.environ
+) -> str:
+    """Load optional variables from environment, falling back to a default."""
+    return env.get(var_name, "") or default
+
+
+@dataclass(frozen=True)
+class Config:
+    """Settings of the TEE, see `.env.example` for what each one does."""
+
+    # Contracts
+    gemini_endpoint_address: str
+    gemini_endpoint_abi: Any
+    # Network
+    rpc_urls: list[str]
+    rpc_pool_config: RpcPoolConfig
+    rpc_batch_config: RpcBatchConfig
+    ws_rpc_url: str
+    seconds_bw_iterations: float
+    max_log_chunk_size: int
+    # State
+    state_db_path: str
+    # Metrics
+    metrics_port: int
+    metrics_host: str
+    # Gemini
+    gemini_model_config: ModelConfig
+    gemini_rate_limit: RateLimitConfig
+    response_cache_enabled: bool
+    response_cache_size: int
+    response_cache_ttl: float
+    response_cache_path: str
+    # Workers
+    num_workers: int
+    worker_queue_size: int
+    request_retry_after: float
+    scheduler_config: SchedulerConfig
+    max_in_flight_txs: int
+    batch_config: BatchConfig
+    response_encoding: ResponseEncoding
+    shard_config: ShardConfig
+    # Fees and receipts
+    fee_config: FeeOracleConfig
+    receipt_tracker_config: ReceiptTrackerConfig
+    # TEE
+    tee_address: str
+    tee_private_key: str
+    gemini_api_key: str
+    tpm_backend: str
+    tpm_device: str
+    oidc_token_safety_margin: float
+
+
+def load_config(env: Mapping[str, str] | None = None) -> Config:
+    """Load the config from `env`, by default the environment and `.env`."""
+    if env is None:
+        load_dotenv(".env")
+        env = os.environ
+    required = partial(load_env_var, env=env)
+    optional = partial(load_optional_env_var, env=env)
 
-# Network
-RPC_URL = load_env_var("RPC_URL")
-SECONDS_BW_ITERATIONS = float(load_env_var("SECONDS_BW_ITERATIONS"))
+    with (ROOT_FOLDER / "contracts" / "output" / "Interactor.abi").open() as f:
+        gemini_endpoint_abi = json.load(f)
+    max_fee_cap = optional("MAX_FEE_PER_GAS", "")
 
-# TEE
-TEE_ADDRESS = load_env_var("TEE_ADDRESS")
-TEE_PRIVATE_KEY = load_env_var("TEE_PRIVATE_KEY")
-GEMINI_API_KEY = load_env_var("GEMINI_API_KEY")
+    return Config(
+        # Contracts
+        gemini_endpoint_address=required("GEMINI_ENDPOINT_ADDRESS"),
+        gemini_endpoint_abi=gemini_endpoint_abi,
+        # Network (comma separate several RPC URLs to pool them)
+        rpc_urls=required("RPC_URL").split(","),
+        rpc_pool_config=RpcPoolConfig(
+            broadcast=int(optional("RPC_BROADCAST", "2")),
+            failure_threshold=int(optional("RPC_FAILURE_THRESHOLD", "3")),
+            cooldown=float(optional("RPC_COOLDOWN", "30")),
+            health_check_interval=float(optional("RPC_HEALTH_CHECK_INTERVAL", "10")),
+            max_block_lag=int(optional("RPC_MAX_BLOCK_LAG", "2")),
+        ),
+        # Calls within RPC_BATCH_WINDOW seconds share one JSON-RPC batch
+        rpc_batch_config=RpcBatchConfig(
+            window=float(optional("RPC_BATCH_WINDOW", "0.005")),
+            max_size=int(optional("RPC_BATCH_MAX_SIZE", "1")),
+        ),
+        ws_rpc_url=optional("WS_RPC_URL", ""),
+        seconds_bw_iterations=float(required("SECONDS_BW_ITERATIONS")),
+        max_log_chunk_size=int(optional("MAX_LOG_CHUNK_SIZE", "1000")),
+        # State
+        state_db_path=optional("STATE_DB_PATH", "tee_gemini.sqlite3"),
+        # Metrics (served on /metrics when METRICS_PORT is set)
+        metrics_port=int(optional("METRICS_PORT", "0")),
+        metrics_host=optional("METRICS_HOST", "127.0.0.1"),
+        # Gemini models (the contract's modelName replaces GEMINI_MODEL when set,
+        # and GEMINI_MODEL_ROUTES sends prompts of up to N tokens to other models,
+        # given as comma separated model:N pairs by increasing N)
+        gemini_model_config=ModelConfig(
+            default_model=optional("GEMINI_MODEL", "gemini-1.5-flash-001"),
+            routes=tuple(
+                ModelRoute(model, int(max_prompt_tokens))
+                for model, _, max_prompt_tokens in (
+                    route.rpartition(":")
+                    for route in optional("GEMINI_MODEL_ROUTES", "").split(",")
+                    if route
+                )
+            ),
+            max_prompt_tokens=int(optional("GEMINI_MAX_PROMPT_TOKENS", "1000000")),
+            max_output_tokens=int(optional("GEMINI_MAX_OUTPUT_TOKENS", "2048")),
+        ),
+        # Gemini quotas
+        gemini_rate_limit=RateLimitConfig(
+            requests_per_minute=int(optional("GEMINI_RPM", "1000")),
+            tokens_per_minute=int(optional("GEMINI_TPM", "4000000")),
+            max_concurrency=int(optional("GEMINI_MAX_CONCURRENCY", "16")),
+            max_retries=int(optional("GEMINI_MAX_RETRIES", "5")),
+        ),
+        # Gemini response cache, off as identical prompts then get identical answers
+        response_cache_enabled=optional("RESPONSE_CACHE_ENABLED", "false").lower()
+        in {"1", "true", "yes"},
+        response_cache_size=int(optional("RESPONSE_CACHE_SIZE", "1024")),
+        response_cache_ttl=float(optional("RESPONSE_CACHE_TTL", "3600")),
+        response_cache_path=optional("RESPONSE_CACHE_PATH", ""),
+        # Workers
+        num_workers=int(optional("NUM_WORKERS", "8")),
+        worker_queue_size=int(optional("WORKER_QUEUE_SIZE", "1024")),
+        # Seconds before a request whose job ended unfulfilled is tried again
+        request_retry_after=float(optional("REQUEST_RETRY_AFTER", "60")),
+        scheduler_config=SchedulerConfig(
+            oidc_weight=int(optional("SCHEDULER_OIDC_WEIGHT", "4")),
+            prompt_weight=int(optional("SCHEDULER_PROMPT_WEIGHT", "1")),
+            sender_queue_size=int(optional("SENDER_QUEUE_SIZE", "64")),
+            sender_concurrency=int(optional("SENDER_MAX_CONCURRENCY", "4")),
+            sender_tokens_per_minute=int(optional("SENDER_TOKENS_PER_MINUTE", "0")),
+        ),
+        max_in_flight_txs=int(optional("MAX_IN_FLIGHT_TXS", "16")),
+        batch_config=BatchConfig(
+            max_size=int(optional("BATCH_MAX_SIZE", "1")),
+            max_bytes=int(optional("BATCH_MAX_BYTES", "64000")),
+            max_delay=float(optional("BATCH_MAX_DELAY", "2.0")),
+        ),
+        # Fulfill with deflated responses, stored or only hashed, to save calldata
+        # and gas
+        response_encoding=ResponseEncoding(optional("RESPONSE_ENCODING", "plain")),
+        # Sharding (each of SHARD_COUNT instances handles uids equal to SHARD_INDEX
+        # mod count)
+        shard_config=ShardConfig(
+            index=int(optional("SHARD_INDEX", "0")),
+            count=int(optional("SHARD_COUNT", "1")),
+            takeover_after=float(optional("SHARD_TAKEOVER_AFTER", "300")),
+        ),
+        # Fees
+        fee_config=FeeOracleConfig(
+            strategy=FeeStrategy(optional("FEE_STRATEGY", "rpc")),
+            ttl=float(optional("FEE_CACHE_TTL", "5.0")),
+            max_fee_cap=int(max_fee_cap) if max_fee_cap else None,
+            priority_fee=int(optional("PRIORITY_FEE_PER_GAS", "0")),
+            fee_history_percentile=float(optional("FEE_HISTORY_PERCENTILE", "50.0")),
+        ),
+        # Receipts (a tx unconfirmed after FEE_BUMP_AFTER_BLOCKS is resent with
+        # higher fees)
+        receipt_tracker_config=ReceiptTrackerConfig(
+            poll_interval=float(optional("RECEIPT_POLL_INTERVAL", "1.0")),
+            bump_after_blocks=int(optional("FEE_BUMP_AFTER_BLOCKS", "5")),
+            bump_percent=int(optional("FEE_BUMP_PERCENT", "20")),
+        ),
+        # TEE
+        tee_address=required("TEE_ADDRESS"),
+        tee_private_key=required("TEE_PRIVATE_KEY"),
+        gemini_api_key=required("GEMINI_API_KEY"),
+        # `subprocess` shells out to gotpm/tpm2-tools, `device` talks to TPM_DEVICE
+        tpm_backend=optional("TPM_BACKEND", "subprocess"),
+        tpm_device=optional("TPM_DEVICE", "/dev/tpmrm0"),
+        oidc_token_safety_margin=float(optional("OIDC_TOKEN_SAFETY_MARGIN", "60")),
+    )
@@ -0,0 +1,53 @@
+import zlib
+from enum import IntEnum, StrEnum
+
+# Decoded responses larger than this are rejected instead of inflated
+MAX_DECODED_SIZE = 1 << 20
+
+
+class ResponseEncoding(StrEnum):
+    # UTF-8 text in `responses`
+    PLAIN = "plain"
+    # Compact bytes in `compactResponses`
+    COMPACT = "compact"
+    # Compact bytes only in the fulfillment event, their hash in storage
+    HASH = "hash"
+
+
+class EncodingVersion(IntEnum):
+    RAW = 0
+    DEFLATE = 1
+
+
+def encode_response(text: str) -> bytes:
+    """Encode a response as a version byte followed by its payload.
+
+    The UTF-8 text is deflated, without zlib header and checksum, unless that
+    does not make it shorter as is common for short answers.
+    """
+    raw = text.encode()
+    compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, -15)
+    deflated = compressor.compress(raw) + compressor.flush()
+    if len(deflated) < len(raw):
+        return bytes([EncodingVersion.DEFLATE]) + deflated
+    return bytes([EncodingVersion.RAW]) + raw
+
+
+def decode_response(data: bytes, max_size: int = MAX_DECODED_SIZE) -> str:
+    """Decode a response encoded by `encode_response`."""
+    if not data:
+        msg = "Empty response encoding"
+        raise ValueError(msg)
+    version, payload = data[0], data[1:]
+    if version == EncodingVersion.RAW:
+        return payload.decode()
+    if version == EncodingVersion.DEFLATE:
+        # One byte more than allowed, as inflating may consume all of the
+        # payload with output still pending, leaving no unconsumed tail
+        raw = zlib.decompressobj(-15).decompress(payload, max_size + 1)
+        if len(raw) > max_size:
+            msg = f"Response inflates to more than {max_size} bytes"
+            raise ValueError(msg)
+        return raw.decode()
+    msg = f"Unknown response encoding version {version}"
+    raise ValueError(msg)
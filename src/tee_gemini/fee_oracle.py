@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import statistics
+import time
+from dataclasses import dataclass
+from enum import StrEnum
+
+from web3 import AsyncWeb3
+from web3.types import Wei
+
+logger = logging.getLogger(__name__)
+
+
+class FeeStrategy(StrEnum):
+    RPC = "rpc"
+    FIXED = "fixed"
+    FEE_HISTORY = "fee_history"
+
+
+@dataclass(frozen=True)
+class Fees:
+    max_fee_per_gas: Wei
+    max_priority_fee_per_gas: Wei
+
+
+@dataclass(frozen=True)
+class FeeOracleConfig:
+    strategy: FeeStrategy = FeeStrategy.RPC
+    ttl: float = 5.0
+    max_fee_cap: int | None = None
+    priority_fee: int = 0
+    fee_history_blocks: int = 10
+    fee_history_percentile: float = 50.0
+
+
+class FeeOracle:
+    """Cache EIP-1559 fees, refreshing once per new block or after a TTL."""
+
+    def __init__(self, w3: AsyncWeb3, config: FeeOracleConfig) -> None:
+        if config.strategy == FeeStrategy.FIXED and config.max_fee_cap is None:
+            msg = "Fixed fee strategy requires a max fee cap"
+            raise ValueError(msg)
+        self.w3 = w3
+        self.config = config
+        self.hits = 0
+        self.misses = 0
+        self._fees: Fees | None = None
+        self._fetched_at = 0.0
+        self._block_number = -1
+        self._lock = asyncio.Lock()
+
+    def notify_block(self, block_number: int) -> None:
+        """Invalidate cached fees when a new block has been seen."""
+        if block_number > self._block_number:
+            self._block_number = block_number
+            self._fees = None
+
+    async def get_fees(self) -> Fees:
+        """Return current fees, only hitting the RPC when the cache is stale."""
+        async with self._lock:
+            if self._fees and time.monotonic() - self._fetched_at < self.config.ttl:
+                self.hits += 1
+                return self._fees
+            self.misses += 1
+            self._fees = self._apply_cap(await self._fetch_fees())
+            self._fetched_at = time.monotonic()
+            logger.debug(
+                "Refreshed fees %s (hits=%i, misses=%i)",
+                self._fees,
+                self.hits,
+                self.misses,
+            )
+            return self._fees
+
+    async def _fetch_fees(self) -> Fees:
+        match self.config.strategy:
+            case FeeStrategy.RPC:
+                # Concurrently, so both go out in one batch when batching is on
+                max_fee, priority_fee = await asyncio.gather(
+                    self.w3.eth.gas_price, self.w3.eth.max_priority_fee
+                )
+                return Fees(
+                    max_fee_per_gas=max_fee, max_priority_fee_per_gas=priority_fee
+                )
+            case FeeStrategy.FIXED:
+                return Fees(
+                    max_fee_per_gas=Wei(self.config.max_fee_cap or 0),
+                    max_priority_fee_per_gas=Wei(self.config.priority_fee),
+                )
+            case FeeStrategy.FEE_HISTORY:
+                return await self._fetch_fee_history_fees()
+
+    async def _fetch_fee_history_fees(self) -> Fees:
+        """Derive fees from a percentile of recent priority fees."""
+        history = await self.w3.eth.fee_history(
+            self.config.fee_history_blocks,
+            "latest",
+            [self.config.fee_history_percentile],
+        )
+        # The last entry is the base fee of the next (pending) block
+        next_base_fee = history["baseFeePerGas"][-1]
+        rewards = [reward[0] for reward in history.get("reward", []) if reward]
+        priority_fee = max(
+            int(statistics.median(rewards)) if rewards else 0,
+            self.config.priority_fee,
+        )
+        # Leave room for the base fee to double before the tx is included
+        return Fees(
+            max_fee_per_gas=Wei(2 * next_base_fee + priority_fee),
+            max_priority_fee_per_gas=Wei(priority_fee),
+        )
+
+    def _apply_cap(self, fees: Fees) -> Fees:
+        if self.config.max_fee_cap is None:
+            return fees
+        max_fee = min(fees.max_fee_per_gas, self.config.max_fee_cap)
+        return Fees(
+            max_fee_per_gas=Wei(max_fee),
+            max_priority_fee_per_gas=Wei(min(fees.max_priority_fee_per_gas, max_fee)),
+        )
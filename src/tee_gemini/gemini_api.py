@@ -1,34 +1,167 @@
 import logging
-
-import google.generativeai as genai
+import math
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
 
 from tee_gemini.gemini_endpoint import GeminiResponse
+from tee_gemini.metrics import GEMINI_QUERIES, GEMINI_TOKENS, STAGE_SECONDS
+from tee_gemini.rate_limiter import QuotaLimiter
+from tee_gemini.response_cache import ResponseCache
+
+if TYPE_CHECKING:
+    from google.generativeai import GenerativeModel
+    from google.generativeai.types import GenerationConfigDict
 
 logger = logging.getLogger(__name__)
 
+# Rough ratio used to estimate prompt tokens before a call, in UTF-8 bytes so
+# that scripts using several bytes per character are not underestimated
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the tokens of a text locally, without a `count_tokens` call."""
+    return math.ceil(len(text.encode()) / BYTES_PER_TOKEN)
+
+
+class PromptTooLongError(ValueError):
+    """A prompt is over the token limit, so it was not sent to Gemini."""
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    model: str
+    max_prompt_tokens: int
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    """Models to query, picked per prompt by its estimated tokens.
+
+    A prompt goes to the first route it fits in, otherwise to `default_model`,
+    which the contract's `modelName` replaces when set. Prompts over
+    `max_prompt_tokens` are rejected without a query, and responses are capped
+    at `max_output_tokens` to keep the fulfillment calldata bounded.
+    """
+
+    default_model: str = "gemini-1.5-flash-001"
+    routes: tuple[ModelRoute, ...] = ()
+    max_prompt_tokens: int = 1_000_000
+    max_output_tokens: int = 2048
+
+    def __post_init__(self) -> None:
+        limits = [route.max_prompt_tokens for route in self.routes]
+        if limits != sorted(limits):
+            msg = f"Model routes must be ordered by max prompt tokens, got {limits}"
+            raise ValueError(msg)
+
 
 class GeminiAPI:
     """Class to interface with the Google Gemini Generative AI API."""
 
-    def __init__(self, model: str, api_key: str) -> None:
-        """Initialize the Gemini API with a model and API key."""
+    def __init__(
+        self,
+        config: ModelConfig,
+        api_key: str,
+        response_cache: ResponseCache | None = None,
+        rate_limiter: QuotaLimiter | None = None,
+    ) -> None:
+        """Initialize the Gemini API with its models and API key."""
+        # Imported here as it takes about a second, see `async_loop`
+        import google.generativeai as genai
+
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model)
-        logger.info("Successfully connected to Gemini API with model `%s`", model)
+        self.config = config
+        self.default_model = config.default_model
+        self.generation_config: GenerationConfigDict = {}
+        if config.max_output_tokens:
+            self.generation_config["max_output_tokens"] = config.max_output_tokens
+        self.models: dict[str, GenerativeModel] = {}
+        for model in (config.default_model, *(r.model for r in config.routes)):
+            self._add_model(model)
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        logger.info(
+            "Successfully connected to Gemini API with models %s", list(self.models)
+        )
+
+    def set_default_model(self, model: str) -> None:
+        """Send the prompts that fit no route to `model`.
+
+        An empty name, as read from a contract where it was never set, keeps
+        the configured default.
+        """
+        if not model:
+            return
+        self._add_model(model)
+        if model != self.default_model:
+            logger.info("Using model `%s` by default", model)
+        self.default_model = model
+
+    def route(self, prompt_tokens: int) -> str:
+        """Return the model to query for a prompt of `prompt_tokens` tokens."""
+        for route in self.config.routes:
+            if prompt_tokens <= route.max_prompt_tokens:
+                return route.model
+        return self.default_model
 
     async def make_query(self, uid: int, data: str) -> GeminiResponse:
         """Make an asynchronous query to the Gemini API and return a GeminiResponse."""
-        res = await self.model.generate_content_async(data)
+        prompt_tokens = estimate_tokens(data)
+        if prompt_tokens > self.config.max_prompt_tokens:
+            msg = (
+                f"Prompt of UID {uid} has about {prompt_tokens} tokens, "
+                f"over the limit of {self.config.max_prompt_tokens}"
+            )
+            raise PromptTooLongError(msg)
+
+        model = self.route(prompt_tokens)
+        with STAGE_SECONDS.time("gemini_query"):
+            if self.response_cache is None:
+                return await self._query(uid, data, model, prompt_tokens)
+
+            key = ResponseCache.key(model, data, self.generation_config)
+            response = await self.response_cache.get_or_query(
+                key, lambda: self._query(uid, data, model, prompt_tokens)
+            )
+            return replace(response, uid=uid)
+
+    def _add_model(self, model: str) -> None:
+        if model in self.models:
+            return
+        import google.generativeai as genai
+
+        self.models[model] = genai.GenerativeModel(
+            model, generation_config=self.generation_config
+        )
+
+    async def _query(
+        self, uid: int, data: str, model: str, prompt_tokens: int
+    ) -> GeminiResponse:
+        GEMINI_QUERIES.inc(model)
+        generative_model = self.models[model]
+        if self.rate_limiter is None:
+            res = await generative_model.generate_content_async(data)
+        else:
+            res = await self.rate_limiter.run(
+                lambda: generative_model.generate_content_async(data),
+                estimated_tokens=prompt_tokens,
+                tokens_used=lambda res: res.usage_metadata.total_token_count,
+            )
 
         # Check for the expected response attributes
         if not hasattr(res, "text") or not hasattr(res, "usage_metadata"):
             msg = f"Invalid response from Gemini API for UID {uid}"
             raise ValueError(msg)
 
+        GEMINI_TOKENS.inc("prompt", amount=res.usage_metadata.prompt_token_count)
+        GEMINI_TOKENS.inc(
+            "candidates", amount=res.usage_metadata.candidates_token_count
+        )
         return GeminiResponse(
             uid=uid,
             text=res.text,
             prompt_token_count=res.usage_metadata.prompt_token_count,
-            candidates_token_count=res.usage_metadata.prompt_token_count,
+            candidates_token_count=res.usage_metadata.candidates_token_count,
             total_token_count=res.usage_metadata.total_token_count,
         )
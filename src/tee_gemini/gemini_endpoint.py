@@ -1,13 +1,37 @@
+import asyncio
 import logging
+import time
+from collections.abc import AsyncIterator, Callable, Sequence
 from dataclasses import dataclass
+from functools import partial
+from typing import Any
 
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
 from web3 import AsyncWeb3
+from web3.contract.async_contract import AsyncContractFunction
+from web3.exceptions import TimeExhausted, Web3RPCError
 from web3.types import EventData, TxParams, TxReceipt
 
-from tee_gemini.rpc_api import RpcAPI
+from tee_gemini.batcher import BatchConfig, Batcher
+from tee_gemini.encoding import ResponseEncoding, decode_response, encode_response
+from tee_gemini.fee_oracle import FeeOracle, FeeOracleConfig
+from tee_gemini.metrics import ERRORS, STAGE_SECONDS
+from tee_gemini.nonce_manager import NonceManager, is_nonce_error
+from tee_gemini.receipt_tracker import ReceiptTracker, ReceiptTrackerConfig
+from tee_gemini.rpc_api import RpcAPI, is_range_limit_error
+from tee_gemini.rpc_batching import RpcBatchConfig
+from tee_gemini.rpc_pool import RpcPoolConfig
 
 logger = logging.getLogger(__name__)
 
+# Grow the log query window while fewer logs than this are returned per window
+SPARSE_LOG_COUNT = 100
+# Seconds a rejected log query window caps the window, before it may grow back
+LOG_CEILING_TTL = 300
+# Items per range getter call, small enough to stay within eth_call limits
+READ_PAGE_SIZE = 100
+
 
 @dataclass
 class GeminiResponse:
@@ -24,24 +48,123 @@ class OIDCResponse:
     token: str
 
 
+@dataclass
+class PromptRequest:
+    sender: str
+    uid: int
+    prompt: str
+
+
+@dataclass
+class OIDCRequest:
+    sender: str
+    uid: int
+
+
+class TransactionRevertedError(Exception):
+    """A tx was mined but reverted, so none of its calls took effect."""
+
+    def __init__(self, receipt: TxReceipt) -> None:
+        self.receipt = receipt
+        super().__init__(f"Tx {receipt['transactionHash'].to_0x_hex()} reverted")
+
+
+# Called with each response as soon as the tx fulfilling it has been broadcast
+TxSentListener = Callable[[GeminiResponse | OIDCResponse, HexBytes], None]
+
+
+def _response_to_tuple(
+    response: GeminiResponse,
+) -> tuple[int, str, int, int, int]:
+    return (
+        response.uid,
+        response.text,
+        response.prompt_token_count,
+        response.candidates_token_count,
+        response.total_token_count,
+    )
+
+
+def _compact_response_to_tuple(
+    response: GeminiResponse,
+) -> tuple[int, bytes, int, int, int]:
+    return (
+        response.uid,
+        encode_response(response.text),
+        response.prompt_token_count,
+        response.candidates_token_count,
+        response.total_token_count,
+    )
+
+
+def _calldata_size(
+    response: GeminiResponse | OIDCResponse,
+    response_encoding: ResponseEncoding = ResponseEncoding.PLAIN,
+) -> int:
+    """Approximate ABI-encoded size of a response in a batch."""
+    if isinstance(response, OIDCResponse):
+        return len(response.token.encode()) + 4 * 32
+    if response_encoding == ResponseEncoding.PLAIN:
+        return len(response.text.encode()) + 7 * 32
+    return len(encode_response(response.text)) + 7 * 32
+
+
 class GeminiEndpoint(RpcAPI):
     """Asynchronous methods to interact with the event emitting contract."""
 
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
-        rpc_url: str,
+        rpc_url: str | Sequence[str],
         contract_address: str,
         contract_abi: dict,
         tee_address: str,
         tee_private_key: str,
+        max_in_flight_txs: int = 16,
+        receipt_timeout: float = 120,
+        fee_config: FeeOracleConfig | None = None,
+        batch_config: BatchConfig | None = None,
+        max_log_chunk_size: int = 1000,
+        rpc_pool_config: RpcPoolConfig | None = None,
+        rpc_batch_config: RpcBatchConfig | None = None,
+        receipt_tracker_config: ReceiptTrackerConfig | None = None,
+        response_encoding: ResponseEncoding = ResponseEncoding.PLAIN,
     ) -> None:
-        super().__init__(rpc_url)
+        super().__init__(rpc_url, rpc_pool_config, rpc_batch_config)
         self.tee_address = self.w3.to_checksum_address(tee_address)
         self.tee_private_key = tee_private_key
         self.contract = self.w3.eth.contract(
             address=AsyncWeb3.to_checksum_address(contract_address),
             abi=contract_abi,
         )
+        self.max_log_chunk_size = max_log_chunk_size
+        self._log_chunk_size = self._log_chunk_ceiling = max_log_chunk_size
+        self._log_ceiling_expiry = 0.0
+        self.nonce_manager = NonceManager(self.w3, self.tee_address)
+        self.fee_oracle = FeeOracle(self.w3, fee_config or FeeOracleConfig())
+        self.receipt_tracker = ReceiptTracker(
+            self.w3,
+            self._sign_and_broadcast,
+            receipt_tracker_config or ReceiptTrackerConfig(),
+            receipt_timeout=receipt_timeout,
+            max_fee_cap=self.fee_oracle.config.max_fee_cap,
+        )
+        self._in_flight_txs = asyncio.Semaphore(max_in_flight_txs)
+        self.in_flight_txs = 0
+        self.tx_sent_listeners: list[TxSentListener] = []
+        self.response_encoding = response_encoding
+
+        # Batch fulfillments when enabled, otherwise send one tx per response
+        self.gemini_batcher: Batcher[GeminiResponse] | None = None
+        self.oidc_batcher: Batcher[OIDCResponse] | None = None
+        if batch_config and batch_config.enabled:
+            self.gemini_batcher = Batcher(
+                self.fulfill_gemini_requests,
+                partial(_calldata_size, response_encoding=response_encoding),
+                batch_config,
+            )
+            self.oidc_batcher = Batcher(
+                self.fulfill_oidc_requests, _calldata_size, batch_config
+            )
 
     async def get_event_logs(
         self, from_block: int, to_block: int, event_name: str
@@ -51,63 +174,311 @@ class GeminiEndpoint(RpcAPI):
             from_block=from_block, to_block=to_block
         )
 
-    async def sign_and_send_transaction(self, tx: TxParams) -> TxReceipt:
-        """Sign and send a transaction, then wait for receipt."""
+    async def iter_event_logs(
+        self, from_block: int, to_block: int, event_names: Sequence[str]
+    ) -> AsyncIterator[EventData]:
+        """Stream contract event logs in block and log index order.
+
+        All events are fetched with a single filter per block window. The window
+        shrinks when the provider rejects a query and grows while logs are sparse.
+        It stays below a rejected window for `LOG_CEILING_TTL` seconds, then may
+        grow back to `max_log_chunk_size`, so a burst of dense blocks does not
+        keep windows small for good.
+        """
+        events = {
+            HexBytes(event_abi_to_log_topic(event.abi)): event
+            for event in (self.contract.events[name]() for name in event_names)
+        }
+        start = from_block
+        while start <= to_block:
+            if time.monotonic() > self._log_ceiling_expiry:
+                self._log_chunk_ceiling = self.max_log_chunk_size
+            end = min(start + self._log_chunk_size - 1, to_block)
+            try:
+                with STAGE_SECONDS.time("get_logs"):
+                    logs = await self.w3.eth.get_logs(
+                        {
+                            "address": self.contract.address,
+                            "fromBlock": start,
+                            "toBlock": end,
+                            "topics": [list(events)],
+                        }
+                    )
+            except (Web3RPCError, ValueError) as e:
+                if not is_range_limit_error(e) or start == end:
+                    raise
+                # Remember the limit for a while so later windows do not hit it
+                self._log_chunk_size = (end - start + 1) // 2
+                self._log_chunk_ceiling = self._log_chunk_size
+                self._log_ceiling_expiry = time.monotonic() + LOG_CEILING_TTL
+                logger.info(
+                    "Log query %i-%i rejected, shrinking window to %i blocks",
+                    start,
+                    end,
+                    self._log_chunk_size,
+                )
+                continue
+
+            for log in sorted(
+                logs, key=lambda log: (log["blockNumber"], log["logIndex"])
+            ):
+                yield events[HexBytes(log["topics"][0])].process_log(log)
+
+            if len(logs) < SPARSE_LOG_COUNT:
+                self._log_chunk_size = min(
+                    self._log_chunk_size * 2, self._log_chunk_ceiling
+                )
+            start = end + 1
+
+    async def iter_responses(
+        self,
+        from_uid: int = 1,
+        page_size: int = READ_PAGE_SIZE,
+        concurrency: int = 4,
+        *,
+        compact: bool = False,
+    ) -> AsyncIterator[GeminiResponse]:
+        """Stream the prompt responses from `from_uid` on, in uid order.
+
+        These are read from `responses`, where `fulfillRequest` stores them.
+        With `compact`, the responses stored in compact form are read and
+        decoded instead. Those fulfilled in hash mode are only in the
+        `RequestFullfilledCompact` events. Requests that are not
+        fulfilled yet are skipped.
+        """
+        getter = (
+            self.contract.functions.getCompactResponsesRange
+            if compact
+            else self.contract.functions.getResponsesRange
+        )
+        async for uid, response, *token_counts in self._read_pages(
+            getter, from_uid, page_size, concurrency
+        ):
+            if uid:
+                text = decode_response(response) if compact else response
+                yield GeminiResponse(uid, text, *token_counts)
+
+    async def iter_prompt_requests(
+        self, offset: int = 0, page_size: int = READ_PAGE_SIZE, concurrency: int = 4
+    ) -> AsyncIterator[PromptRequest]:
+        """Stream the prompt requests from index `offset` on, in uid order."""
+        getter = self.contract.functions.getRequestsRange
+        async for sender, uid, prompt in self._read_pages(
+            getter, offset, page_size, concurrency
+        ):
+            yield PromptRequest(sender, uid, prompt)
+
+    async def iter_oidc_requests(
+        self, offset: int = 0, page_size: int = READ_PAGE_SIZE, concurrency: int = 4
+    ) -> AsyncIterator[OIDCRequest]:
+        """Stream the OIDC requests from index `offset` on, in uid order."""
+        getter = self.contract.functions.getOIDCRequestsRange
+        async for sender, uid, _ in self._read_pages(
+            getter, offset, page_size, concurrency
+        ):
+            yield OIDCRequest(sender, uid)
+
+    async def _read_pages(
+        self,
+        getter: Callable[[int, int], AsyncContractFunction],
+        start: int,
+        page_size: int,
+        concurrency: int,
+    ) -> AsyncIterator[Any]:
+        """Yield the items of a range getter until it returns a short page.
+
+        `concurrency` pages are read at once, which a batching provider sends
+        in a single round trip.
+        """
+        while True:
+            pages = await asyncio.gather(
+                *(
+                    getter(start + i * page_size, page_size).call()
+                    for i in range(concurrency)
+                ),
+                return_exceptions=True,
+            )
+            for page in pages:
+                if isinstance(page, BaseException):
+                    raise page
+                for item in page:
+                    yield item
+                if len(page) < page_size:
+                    return
+            start += concurrency * page_size
+
+    async def _tx_params(self) -> TxParams:
+        """Common params for transactions sent by the TEE."""
+        fees, chain_id = await asyncio.gather(
+            self.fee_oracle.get_fees(), self.get_chain_id()
+        )
+        return {
+            "from": self.tee_address,
+            "chainId": chain_id,
+            "maxFeePerGas": fees.max_fee_per_gas,
+            "maxPriorityFeePerGas": fees.max_priority_fee_per_gas,
+        }
+
+    async def _build_transaction(self, function: AsyncContractFunction) -> TxParams:
+        """Build a tx calling a contract function with the common TEE params."""
+        with STAGE_SECONDS.time("build_tx"):
+            return await function.build_transaction(await self._tx_params())
+
+    async def send_transaction(
+        self, tx: TxParams, *, retry_stale_nonce: bool = True
+    ) -> HexBytes:
+        """Assign a local nonce, sign and broadcast a transaction."""
+        tx["nonce"] = await self.nonce_manager.next_nonce()
+        try:
+            return await self._sign_and_broadcast(tx)
+        except Web3RPCError as e:
+            ERRORS.inc("send_tx", type(e).__name__)
+            # Resync so the failed nonce does not leave a gap behind it
+            await self.nonce_manager.resync()
+            if not (retry_stale_nonce and is_nonce_error(e)):
+                raise
+            logger.warning("Stale nonce %i, retrying: %s", tx["nonce"], e)
+        return await self.send_transaction(tx, retry_stale_nonce=False)
+
+    async def _sign_and_broadcast(self, tx: TxParams) -> HexBytes:
         signed_tx = self.w3.eth.account.sign_transaction(
             tx, private_key=self.tee_private_key
         )
-        tx_hash = await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        tx_receipt = await self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        return await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+
+    async def wait_for_receipt(
+        self,
+        tx_hash: HexBytes,
+        tx: TxParams | None = None,
+        on_replaced: Callable[[HexBytes], None] | None = None,
+    ) -> TxReceipt:
+        """Wait for a tx receipt, resyncing the nonce if the tx never lands.
+
+        With the unsigned `tx`, a stuck tx is replaced by one with higher fees.
+        """
+        try:
+            return await self.receipt_tracker.wait(
+                tx_hash, tx=tx, on_replaced=on_replaced
+            )
+        except TimeExhausted:
+            ERRORS.inc("wait_receipt", "TimeExhausted")
+            logger.warning("Tx %s dropped or stuck, resyncing nonce", tx_hash.hex())
+            await self.nonce_manager.resync()
+            raise
+
+    async def sign_and_send_transaction(
+        self,
+        tx: TxParams,
+        responses: Sequence[GeminiResponse | OIDCResponse] = (),
+    ) -> TxReceipt:
+        """Sign and send a transaction, then wait for receipt.
+
+        Raises `TransactionRevertedError` if the tx was mined but reverted.
+        """
+        async with self._in_flight_txs:
+            self.in_flight_txs += 1
+            try:
+                with STAGE_SECONDS.time("send_tx"):
+                    tx_hash = await self.send_transaction(tx)
+
+                def notify_listeners(tx_hash: HexBytes) -> None:
+                    for response in responses:
+                        for listener in self.tx_sent_listeners:
+                            listener(response, tx_hash)
+
+                notify_listeners(tx_hash)
+                with STAGE_SECONDS.time("wait_receipt"):
+                    tx_receipt = await self.wait_for_receipt(
+                        tx_hash, tx=tx, on_replaced=notify_listeners
+                    )
+            finally:
+                self.in_flight_txs -= 1
         logger.debug("Tx Receipt: %s", tx_receipt)
+        if tx_receipt["status"] != 1:
+            ERRORS.inc("send_tx", TransactionRevertedError.__name__)
+            raise TransactionRevertedError(tx_receipt)
         return tx_receipt
 
     async def fulfill_gemini_request(self, response: GeminiResponse) -> None:
         """Fulfills a Gemini request by sending a transaction to the contract."""
-        tx = await self.contract.functions.fulfillRequest(
-            response.uid,
-            (
+        if self.gemini_batcher:
+            await self.gemini_batcher.add(response)
+            return
+        if self.response_encoding == ResponseEncoding.PLAIN:
+            function = self.contract.functions.fulfillRequest(
+                response.uid, _response_to_tuple(response)
+            )
+        else:
+            function = self.contract.functions.fulfillRequestCompact(
                 response.uid,
-                response.text,
-                response.prompt_token_count,
-                response.candidates_token_count,
-                response.total_token_count,
-            ),
-        ).build_transaction(
-            {
-                "from": self.tee_address,
-                "nonce": await self.w3.eth.get_transaction_count(self.tee_address),
-                "maxFeePerGas": await self.w3.eth.gas_price,
-                "maxPriorityFeePerGas": await self.w3.eth.max_priority_fee,
-            }
-        )
-        await self.sign_and_send_transaction(tx)
+                _compact_response_to_tuple(response),
+                self.response_encoding == ResponseEncoding.HASH,
+            )
+        tx = await self._build_transaction(function)
+        await self.sign_and_send_transaction(tx, [response])
+
+    async def fulfill_gemini_requests(self, responses: list[GeminiResponse]) -> None:
+        """Fulfills several Gemini requests in a single transaction."""
+        uids = [response.uid for response in responses]
+        if self.response_encoding == ResponseEncoding.PLAIN:
+            function = self.contract.functions.fulfillRequestBatch(
+                uids, [_response_to_tuple(response) for response in responses]
+            )
+        else:
+            function = self.contract.functions.fulfillRequestCompactBatch(
+                uids,
+                [_compact_response_to_tuple(response) for response in responses],
+                self.response_encoding == ResponseEncoding.HASH,
+            )
+        tx = await self._build_transaction(function)
+        await self.sign_and_send_transaction(tx, responses)
 
     async def fulfill_oidc_request(self, response: OIDCResponse) -> None:
         """Fulfills an OIDC request by sending a transaction to the contract."""
-        tx = await self.contract.functions.fulfillOIDCToken(
-            response.uid,
-            response.token,
-        ).build_transaction(
-            {
-                "from": self.tee_address,
-                "nonce": await self.w3.eth.get_transaction_count(self.tee_address),
-                "maxFeePerGas": await self.w3.eth.gas_price,
-                "maxPriorityFeePerGas": await self.w3.eth.max_priority_fee,
-            }
+        if self.oidc_batcher:
+            await self.oidc_batcher.add(response)
+            return
+        tx = await self._build_transaction(
+            self.contract.functions.fulfillOIDCToken(
+                response.uid,
+                response.token,
+            )
         )
-        await self.sign_and_send_transaction(tx)
+        await self.sign_and_send_transaction(tx, [response])
+
+    async def fulfill_oidc_requests(self, responses: list[OIDCResponse]) -> None:
+        """Fulfills several OIDC requests in a single transaction."""
+        tx = await self._build_transaction(
+            self.contract.functions.fulfillOIDCTokenBatch(
+                [response.uid for response in responses],
+                [response.token for response in responses],
+            )
+        )
+        await self.sign_and_send_transaction(tx, responses)
+
+    async def is_prompt_fulfilled(self, uid: int) -> bool:
+        """Whether the contract has a response to a prompt request."""
+        return await self.contract.functions.hasResponse(uid).call()
+
+    async def is_oidc_fulfilled(self, uid: int) -> bool:
+        """Whether the contract has fulfilled an OIDC request."""
+        return await self.contract.functions.oidcFulfilled(uid).call()
+
+    async def get_ek_pubkey(self) -> str:
+        """Gets the EK public key set on the contract."""
+        pubkey: bytes = await self.contract.functions.ekPublicKey().call()
+        return pubkey.decode()
+
+    async def get_model_name(self) -> str:
+        """Gets the Gemini model name set on the contract, empty if unset."""
+        return await self.contract.functions.modelName().call()
 
     async def set_ek_pubkey(self, pubkey: str) -> None:
         """Sets the EK public key on the contract."""
-        tx = await self.contract.functions.setEkPublicKey(
-            pubkey.encode(),
-        ).build_transaction(
-            {
-                "from": self.tee_address,
-                "nonce": await self.w3.eth.get_transaction_count(self.tee_address),
-                "maxFeePerGas": await self.w3.eth.gas_price,
-                "maxPriorityFeePerGas": await self.w3.eth.max_priority_fee,
-            }
+        tx = await self._build_transaction(
+            self.contract.functions.setEkPublicKey(
+                pubkey.encode(),
+            )
         )
         await self.sign_and_send_transaction(tx)
         logger.info("Set EK pubkey on %s", self.contract.address)
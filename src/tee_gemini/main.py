@@ -1,71 +1,250 @@
 import asyncio
 import logging
+import time
+from collections.abc import AsyncIterator
+from functools import partial
 
 from eth_account import Account
-from web3.exceptions import ContractLogicError
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
 from web3.types import EventData
 
-from tee_gemini.config import (
-    GEMINI_API_KEY,
-    GEMINI_ENDPOINT_ABI,
-    GEMINI_ENDPOINT_ADDRESS,
-    RPC_URL,
-    SECONDS_BW_ITERATIONS,
-    TEE_ADDRESS,
-    TEE_PRIVATE_KEY,
+from tee_gemini.block_source import NewHeadSubscriber, poll_ticks
+from tee_gemini.config import Config, load_config
+from tee_gemini.gemini_api import GeminiAPI, estimate_tokens
+from tee_gemini.gemini_endpoint import GeminiEndpoint, TransactionRevertedError
+from tee_gemini.metrics import (
+    BLOCK_LAG,
+    ERRORS,
+    IN_FLIGHT_TXS,
+    QUEUE_DEPTH,
+    STAGE_SECONDS,
+    STARTUP_SECONDS,
+    TAKEOVERS,
+    start_metrics_server,
 )
-from tee_gemini.gemini_api import GeminiAPI
-from tee_gemini.gemini_endpoint import GeminiEndpoint
+from tee_gemini.rate_limiter import QuotaLimiter
+from tee_gemini.request_handler import RequestHandler
+from tee_gemini.response_cache import ResponseCache
+from tee_gemini.sharding import ShardConfig
+from tee_gemini.state_store import (
+    RequestKind,
+    RequestRecord,
+    RequestState,
+    StateStore,
+)
+from tee_gemini.tpm_backend import DeviceBackend, SubprocessBackend, TPMBackend
 from tee_gemini.tpm_interface import TPMCommunicationError, TPMInterface
+from tee_gemini.worker_pool import Job, WorkerPool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EVENT_NAMES = ("RequestSubmitted", "OIDCRequestSubmitted")
+# Watched when sharded, so requests of other shards are only taken over if needed
+FULFILLED_EVENTS = {
+    "RequestFullfilled": RequestKind.PROMPT,
+    "RequestFullfilledCompact": RequestKind.PROMPT,
+    "OIDCRequestFullfilled": RequestKind.OIDC,
+}
+
 
-async def process_logs(
-    logs: list[EventData],
-    event_name: str,
-    gemini_api: GeminiAPI,
-    gemini_endpoint: GeminiEndpoint,
-    tpm_interface: TPMInterface,
+def process_log(
+    log: EventData,
+    request_handler: RequestHandler,
+    worker_pool: WorkerPool,
+    shard_config: ShardConfig,
 ) -> None:
-    """Process event logs based on the event name."""
-    for log in logs:
-        if event_name == "RequestSubmitted":
-            if not {"uid", "sender", "data"} <= log["args"].keys():
-                logger.warning("%s log does not contain valid args", event_name)
-                continue
-            uid, data = log["args"]["uid"], log["args"]["data"]
-            logger.info("New %s request uid=%d, data=%s", event_name, uid, data)
-            try:
-                response = await gemini_api.make_query(uid=uid, data=data)
-                logger.info(response)
-                await gemini_endpoint.fulfill_gemini_request(response)
-            except ContractLogicError:
-                logger.exception("Error fulfilling %s request", event_name)
-        elif event_name == "OIDCRequestSubmitted":
-            if not {"uid", "sender"} <= log["args"].keys():
-                logger.warning("%s log does not contain valid args", event_name)
-                continue
-            uid = log["args"]["uid"]
-            logger.info("New %s request uid=%d", event_name, uid)
-            try:
-                response = await tpm_interface.query_oidc_token(uid=uid)
-                logger.info(response)
-                await gemini_endpoint.fulfill_oidc_request(response)
-            except ContractLogicError:
-                logger.exception("Error fulfilling %s request", event_name)
+    """Submit an event log to the worker pool based on the event name."""
+    state_store = request_handler.state_store
+    event_name = log["event"]
+    if event_name == "RequestSubmitted":
+        if not {"uid", "sender", "data"} <= log["args"].keys():
+            logger.warning("%s log does not contain valid args", event_name)
+            return
+        uid, data = log["args"]["uid"], log["args"]["data"]
+        sender = log["args"]["sender"]
+        if not state_store.mark_seen(
+            RequestKind.PROMPT,
+            uid,
+            data,
+            state=_initial_state(shard_config, uid),
+            sender=sender,
+            block=log["blockNumber"],
+        ):
+            logger.debug("Skipping already seen %s uid=%d", event_name, uid)
+            return
+        if not shard_config.owns(uid):
+            logger.debug("Deferring %s uid=%d to its shard", event_name, uid)
+            return
+        logger.info("New %s request uid=%d, data=%s", event_name, uid, data)
+        _submit_or_leave(
+            worker_pool,
+            Job(
+                name=f"{event_name} uid={uid}",
+                run=partial(request_handler.handle_prompt_request, uid, data),
+                kind=RequestKind.PROMPT,
+                uid=uid,
+                sender=sender,
+                tokens=estimate_tokens(data),
+            ),
+        )
+    elif event_name == "OIDCRequestSubmitted":
+        if not {"uid", "sender"} <= log["args"].keys():
+            logger.warning("%s log does not contain valid args", event_name)
+            return
+        uid, sender = log["args"]["uid"], log["args"]["sender"]
+        if not state_store.mark_seen(
+            RequestKind.OIDC,
+            uid,
+            state=_initial_state(shard_config, uid),
+            sender=sender,
+            block=log["blockNumber"],
+        ):
+            logger.debug("Skipping already seen %s uid=%d", event_name, uid)
+            return
+        if not shard_config.owns(uid):
+            logger.debug("Deferring %s uid=%d to its shard", event_name, uid)
+            return
+        logger.info("New %s request uid=%d", event_name, uid)
+        _submit_or_leave(
+            worker_pool,
+            Job(
+                name=f"{event_name} uid={uid}",
+                run=partial(request_handler.handle_oidc_request, uid),
+                kind=RequestKind.OIDC,
+                uid=uid,
+                sender=sender,
+            ),
+        )
+    elif event_name in FULFILLED_EVENTS:
+        # Fulfilled by whichever shard, so it is never taken over
+        state_store.mark_confirmed(FULFILLED_EVENTS[event_name], log["args"]["uid"])
+
+
+def _submit_or_leave(worker_pool: WorkerPool, job: Job) -> None:
+    # Left seen in the state store when there is no room, and enqueued by
+    # `requeue_pending_requests` once there is, so ingestion never waits
+    if not worker_pool.try_submit(job):
+        logger.debug("No room for %s, enqueuing it later", job.name)
+
+
+def _initial_state(shard_config: ShardConfig, uid: int) -> RequestState:
+    return RequestState.SEEN if shard_config.owns(uid) else RequestState.DEFERRED
+
+
+async def take_over_requests(
+    request_handler: RequestHandler, worker_pool: WorkerPool, shard_config: ShardConfig
+) -> None:
+    """Handle requests of other shards that stayed unfulfilled for too long.
+
+    The contract is asked first, as the fulfillment event of a request may not
+    have been seen yet, e.g. when it landed in a block not polled so far.
+    """
+    state_store = request_handler.state_store
+    now = time.time()
+    records = [
+        record
+        for record in state_store.deferred(before=now - shard_config.takeover_after)
+        if record.updated_at <= now - shard_config.takeover_delay(record.uid)
+    ]
+    fulfilled = await asyncio.gather(
+        *(_is_fulfilled_on_chain(request_handler.gemini_endpoint, r) for r in records)
+    )
+    for record, is_fulfilled in zip(records, fulfilled, strict=True):
+        if is_fulfilled:
+            logger.info(
+                "%s request uid=%d already fulfilled by shard %i",
+                record.kind,
+                record.uid,
+                shard_config.owner(record.uid),
+            )
+            state_store.mark_confirmed(record.kind, record.uid)
+            continue
+        logger.warning(
+            "Taking over %s request uid=%d from shard %i",
+            record.kind,
+            record.uid,
+            shard_config.owner(record.uid),
+        )
+        TAKEOVERS.inc(record.kind)
+        state_store.mark_taken_over(record.kind, record.uid)
+        _submit_or_leave(
+            worker_pool,
+            Job(
+                name=f"takeover {record.kind} uid={record.uid}",
+                run=partial(request_handler.resume, record),
+                kind=record.kind,
+                uid=record.uid,
+                sender=record.sender or "",
+            ),
+        )
+
+
+async def _is_fulfilled_on_chain(
+    gemini_endpoint: GeminiEndpoint, record: RequestRecord
+) -> bool | None:
+    """Whether the contract has fulfilled a request, None if it cannot tell.
+
+    Contracts deployed before `hasResponse` and `oidcFulfilled` were added
+    cannot, their requests are taken over unchecked.
+    """
+    try:
+        match record.kind:
+            case RequestKind.PROMPT:
+                return await gemini_endpoint.is_prompt_fulfilled(record.uid)
+            case RequestKind.OIDC:
+                return await gemini_endpoint.is_oidc_fulfilled(record.uid)
+    except (ContractLogicError, BadFunctionCallOutput) as e:
+        logger.warning(
+            "Unable to check %s request uid=%d on contract: %s",
+            record.kind,
+            record.uid,
+            e,
+        )
+        return None
+
+
+def requeue_pending_requests(
+    request_handler: RequestHandler, worker_pool: WorkerPool
+) -> None:
+    """Enqueue requests that are not fulfilled yet but that no job is handling.
+
+    These are requests left over from before a restart, those there was no
+    room for when they were seen, and those whose job ended without
+    fulfilling them, e.g. when the tx was not mined in time or an RPC call
+    failed. The latter are retried `retry_after` seconds later.
+    """
+    per_sender = worker_pool.queue.config.sender_queue_size
+    for record in request_handler.state_store.pending(per_sender=per_sender):
+        if worker_pool.queue.full():
+            return
+        if worker_pool.has_job(record.kind, record.uid):
+            continue
+        worker_pool.try_submit(
+            Job(
+                name=f"resume {record.kind} uid={record.uid}",
+                run=partial(request_handler.resume, record),
+                kind=record.kind,
+                uid=record.uid,
+                sender=record.sender or "",
+            )
+        )
 
 
 async def fetch_and_process_events(
-    gemini_api: GeminiAPI,
-    gemini_endpoint: GeminiEndpoint,
-    tpm_interface: TPMInterface,
+    request_handler: RequestHandler,
+    worker_pool: WorkerPool,
     latest_block_num: int,
+    shard_config: ShardConfig,
 ) -> int:
     """Poll event emitting contract."""
-    new_block_num = await gemini_endpoint.get_latest_block_number()
+    gemini_endpoint = request_handler.gemini_endpoint
+    with STAGE_SECONDS.time("get_block_number"):
+        new_block_num = await gemini_endpoint.get_latest_block_number()
+    gemini_endpoint.fee_oracle.notify_block(new_block_num)
+    gemini_endpoint.receipt_tracker.notify_block(new_block_num)
+    BLOCK_LAG.set(new_block_num - latest_block_num)
 
     if new_block_num > latest_block_num + 1:
         logger.info(
@@ -75,86 +254,215 @@ async def fetch_and_process_events(
             new_block_num - 1,
         )
 
-        # Fetch event logs
-        event_logs = {
-            "RequestSubmitted": await gemini_endpoint.get_event_logs(
-                from_block=latest_block_num,
-                to_block=new_block_num - 1,
-                event_name="RequestSubmitted",
-            ),
-            "OIDCRequestSubmitted": await gemini_endpoint.get_event_logs(
+        event_names = EVENT_NAMES
+        if shard_config.enabled:
+            event_names += tuple(FULFILLED_EVENTS)
+
+        # Stream event logs in chain order, one filter per block window
+        with STAGE_SECONDS.time("ingest_events"):
+            async for log in gemini_endpoint.iter_event_logs(
                 from_block=latest_block_num,
                 to_block=new_block_num - 1,
-                event_name="OIDCRequestSubmitted",
-            ),
-        }
-
-        # Process logs
-        for event_name, logs in event_logs.items():
-            if logs:
-                logger.debug("Found `%s` in logs, processing...", event_name)
-                await process_logs(
-                    logs, event_name, gemini_api, gemini_endpoint, tpm_interface
-                )
+                event_names=event_names,
+            ):
+                process_log(log, request_handler, worker_pool, shard_config)
 
+        # Every request in the range is now recorded, so never fetch it again
+        state_store = request_handler.state_store
+        state_store.set_checkpoint(new_block_num)
+        # Ranges before this one are behind the checkpoint even if it is retried
+        if pruned := state_store.prune(before_block=latest_block_num):
+            logger.debug("Pruned %i finished requests", pruned)
         return new_block_num
 
     return latest_block_num
 
 
-async def async_loop() -> None:
-    """Main event loop."""
+def create_gemini_api(config: Config) -> GeminiAPI:
+    """Create the Gemini API client with its response cache and rate limiter."""
+    response_cache = None
+    if config.response_cache_enabled:
+        response_cache = ResponseCache(
+            max_entries=config.response_cache_size,
+            ttl=config.response_cache_ttl,
+            path=config.response_cache_path or None,
+        )
+    return GeminiAPI(
+        config=config.gemini_model_config,
+        api_key=config.gemini_api_key,
+        response_cache=response_cache,
+        rate_limiter=QuotaLimiter(config.gemini_rate_limit),
+    )
+
+
+def create_tpm_interface(config: Config) -> TPMInterface:
+    """Create the TPM interface on the configured backend."""
+    tpm_backend: TPMBackend = SubprocessBackend()
+    if config.tpm_backend == "device":
+        tpm_backend = DeviceBackend(config.tpm_device, fallback=tpm_backend)
+    return TPMInterface(
+        tpm_backend, token_safety_margin=config.oidc_token_safety_margin
+    )
+
+
+def create_block_ticks(config: Config) -> AsyncIterator[None]:
+    """Wake on new heads over a WebSocket when configured, otherwise poll."""
+    if config.ws_rpc_url:
+        return NewHeadSubscriber(
+            config.ws_rpc_url, config.seconds_bw_iterations
+        ).ticks()
+    return poll_ticks(config.seconds_bw_iterations)
+
+
+async def register_ek_pubkey(
+    tpm_interface: TPMInterface, gemini_endpoint: GeminiEndpoint
+) -> None:
+    """Publish the EK pubkey of the TPM on the contract, unless already there."""
+    ek_pubkey, registered = await asyncio.gather(
+        tpm_interface.query_ek_pubkey(),
+        gemini_endpoint.get_ek_pubkey(),
+        return_exceptions=True,
+    )
+    if isinstance(ek_pubkey, TPMCommunicationError):
+        logger.error("Unable to query EK pubkey from TPM", exc_info=ek_pubkey)
+        return
+    if isinstance(ek_pubkey, BaseException):
+        raise ek_pubkey
+    if registered == ek_pubkey:
+        logger.info("EK pubkey already set on %s", gemini_endpoint.contract.address)
+        return
+    if isinstance(registered, BaseException):
+        logger.warning("Unable to get EK pubkey from contract: %s", registered)
+
+    try:
+        await gemini_endpoint.set_ek_pubkey(ek_pubkey)
+    except (ContractLogicError, TransactionRevertedError):
+        logger.exception("Unable to set EK pubkey on contract")
+
+
+async def get_model_name(gemini_endpoint: GeminiEndpoint) -> str:
+    """Return the model set on the contract with `setModelName`, if any."""
+    try:
+        return await gemini_endpoint.get_model_name()
+    except (ContractLogicError, BadFunctionCallOutput) as e:
+        logger.warning("Unable to get model name from contract: %s", e)
+        return ""
+
+
+async def async_loop(
+    config: Config,
+    gemini_api: GeminiAPI | None = None,
+    tpm_interface: TPMInterface | None = None,
+    ready: asyncio.Event | None = None,
+) -> None:
+    """Main event loop, on the configured Gemini API and TPM unless given others.
+
+    `ready` is set once startup is done, right before the first poll.
+    """
+    started_at = time.monotonic()
     # Connect to Gemini Endpoint contract
     gemini_endpoint = GeminiEndpoint(
-        RPC_URL,
-        GEMINI_ENDPOINT_ADDRESS,
-        GEMINI_ENDPOINT_ABI,
-        TEE_ADDRESS,
-        TEE_PRIVATE_KEY,
+        config.rpc_urls,
+        config.gemini_endpoint_address,
+        config.gemini_endpoint_abi,
+        config.tee_address,
+        config.tee_private_key,
+        max_in_flight_txs=config.max_in_flight_txs,
+        fee_config=config.fee_config,
+        batch_config=config.batch_config,
+        max_log_chunk_size=config.max_log_chunk_size,
+        rpc_pool_config=config.rpc_pool_config,
+        rpc_batch_config=config.rpc_batch_config,
+        receipt_tracker_config=config.receipt_tracker_config,
+        response_encoding=config.response_encoding,
     )
-    await gemini_endpoint.check_connection()
-
-    # Connect to Gemini API
-    gemini_api = GeminiAPI(model="gemini-1.5-flash-001", api_key=GEMINI_API_KEY)
+    IN_FLIGHT_TXS.set_function(lambda: gemini_endpoint.in_flight_txs)
+    if config.metrics_port:
+        await start_metrics_server(config.metrics_host, config.metrics_port)
 
     # Connect to /dev/tpm0
-    tpm_interface = TPMInterface()
-    ek_pubkey = None
-    try:
-        ek_pubkey = await tpm_interface.query_ek_pubkey()
-    except TPMCommunicationError:
-        logger.exception("Unable to query EK pubkey from TPM")
+    tpm_interface = tpm_interface or create_tpm_interface(config)
 
-    if ek_pubkey:
-        try:
-            await gemini_endpoint.set_ek_pubkey(ek_pubkey)
-        except ContractLogicError:
-            logger.exception("Unable to set EK pubkey on contract")
+    # Independent steps run at once, the RPC check and the TPM and contract
+    # round trips of the EK registration overlap with loading the Gemini SDK
+    startup = asyncio.gather(
+        tpm_interface.get_random_hex_bytes(32),
+        gemini_endpoint.check_connection(),
+        register_ek_pubkey(tpm_interface, gemini_endpoint),
+        get_model_name(gemini_endpoint),
+        gemini_endpoint.get_chain_id(),
+    )
+
+    # Connect to Gemini API, importing its SDK off the loop
+    if gemini_api is None:
+        gemini_api = await asyncio.to_thread(create_gemini_api, config)
 
-    account = Account.from_key(await tpm_interface.get_random_hex_bytes(32))
+    random_hex_bytes, _, _, model_name, chain_id = await startup
+    gemini_api.set_default_model(model_name)
+    account = Account.from_key(random_hex_bytes)
     logger.info("Address:%s", account.address)
     logger.info("Private Key:%s", account.key.hex())
 
+    # Open the checkpoint and per-request state from previous runs
+    state_store = StateStore(
+        config.state_db_path, chain_id, gemini_endpoint.contract.address
+    )
+    request_handler = RequestHandler(
+        gemini_api, gemini_endpoint, tpm_interface, state_store
+    )
+
+    # Start workers to fulfill requests concurrently
+    worker_pool = WorkerPool(
+        num_workers=config.num_workers,
+        queue_size=config.worker_queue_size,
+        scheduler_config=config.scheduler_config,
+        retry_after=config.request_retry_after,
+    )
+    worker_pool.start()
+    QUEUE_DEPTH.set_function(worker_pool.queue.qsize)
+
+    # Finish requests left over from before a restart
+    requeue_pending_requests(request_handler, worker_pool)
+
+    shard_config = config.shard_config
+    if shard_config.enabled:
+        logger.info(
+            "Handling uids %i mod %i, taking over others after %.0fs",
+            shard_config.index,
+            shard_config.count,
+            shard_config.takeover_after,
+        )
     logger.info("Waiting for events on %s...", gemini_endpoint.contract.address)
-    latest_block_num = await gemini_endpoint.get_latest_block_number()
+    latest_block_num = state_store.get_checkpoint()
+    if latest_block_num is None:
+        latest_block_num = await gemini_endpoint.get_latest_block_number()
+    else:
+        logger.info("Resuming from checkpoint at block %i", latest_block_num)
+
+    startup_seconds = time.monotonic() - started_at
+    STARTUP_SECONDS.set(startup_seconds)
+    logger.info("Started in %.2fs", startup_seconds)
+    if ready:
+        ready.set()
 
     # Main loop
-    while True:
+    async for _ in create_block_ticks(config):
         try:
             latest_block_num = await fetch_and_process_events(
-                gemini_api, gemini_endpoint, tpm_interface, latest_block_num
+                request_handler, worker_pool, latest_block_num, shard_config
             )
-        except Exception:
+            if shard_config.enabled:
+                await take_over_requests(request_handler, worker_pool, shard_config)
+            requeue_pending_requests(request_handler, worker_pool)
+        except Exception as e:
+            ERRORS.inc("poll", type(e).__name__)
+            # Retry the same range, requests already seen are skipped
             logger.exception("Error during event processing")
-            latest_block_num = await gemini_endpoint.get_latest_block_number()
-            continue
-
-        await asyncio.sleep(SECONDS_BW_ITERATIONS)
 
 
 def start() -> None:
     try:
-        asyncio.run(async_loop())
+        asyncio.run(async_loop(load_config()))
     except KeyboardInterrupt:
         logger.info("Process interrupted by user")
 
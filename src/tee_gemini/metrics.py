@@ -0,0 +1,229 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from typing import override
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached lookup up to a slow receipt wait
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+    return f"{{{pairs}}}"
+
+
+class Metric(ABC):
+    """Base for metrics rendered in the Prometheus text format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """Yield one line per sample."""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    @override
+    def samples(self) -> Iterator[str]:
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or read from a callback when scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation, ())
+        self._value = 0.0
+        self._callback: Callable[[], float] | None = None
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def set_function(self, callback: Callable[[], float]) -> None:
+        self._callback = callback
+
+    @override
+    def samples(self) -> Iterator[str]:
+        value = self._callback() if self._callback else self._value
+        yield f"{self.name} {value}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # Per label set: one count per bucket plus +Inf, and the sum
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self._counts.get(label_values)
+        if counts is None:
+            counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+            self._sums[label_values] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[label_values] += value
+
+    def time(self, *label_values: str) -> "Timer":
+        """Observe how long the body of the `with` block takes."""
+        return Timer(self, label_values)
+
+    @override
+    def samples(self) -> Iterator[str]:
+        for label_values, counts in self._counts.items():
+            names = (*self.labels, "le")
+            cumulative = 0
+            for bound, count in zip(
+                (*map(str, self.buckets), "+Inf"), counts, strict=True
+            ):
+                cumulative += count
+                labels = _format_labels(names, (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {self._sums[label_values]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Timer:
+    """Context manager timing a block, cheaper than a generator based one."""
+
+    __slots__ = ("histogram", "label_values", "started_at")
+
+    def __init__(self, histogram: Histogram, label_values: tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.label_values = label_values
+        self.started_at = 0.0
+
+    def __enter__(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *_: object) -> None:
+        self.histogram.observe(
+            time.perf_counter() - self.started_at, *self.label_values
+        )
+
+
+REGISTRY: list[Metric] = []
+
+STAGE_SECONDS = Histogram(
+    "tee_gemini_stage_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+BLOCK_LAG = Gauge(
+    "tee_gemini_block_lag", "Blocks between the chain head and the checkpoint"
+)
+STARTUP_SECONDS = Gauge(
+    "tee_gemini_startup_seconds", "Seconds from starting the loop to the first poll"
+)
+QUEUE_DEPTH = Gauge("tee_gemini_queue_depth", "Jobs waiting for a worker")
+IN_FLIGHT_TXS = Gauge("tee_gemini_in_flight_txs", "Txs sent and awaiting a receipt")
+GEMINI_QUERIES = Counter(
+    "tee_gemini_gemini_queries_total", "Gemini queries by model", ("model",)
+)
+GEMINI_TOKENS = Counter(
+    "tee_gemini_gemini_tokens_total", "Gemini tokens consumed", ("type",)
+)
+RPC_BATCH_SIZE = Histogram(
+    "tee_gemini_rpc_batch_size",
+    "Requests per JSON-RPC batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "tee_gemini_response_cache_lookups_total",
+    "Gemini response cache lookups by result",
+    ("result",),
+)
+RESPONSE_CACHE_TOKENS_SAVED = Counter(
+    "tee_gemini_response_cache_tokens_saved_total",
+    "Gemini tokens not spent thanks to the response cache",
+)
+TX_REPLACEMENTS = Counter(
+    "tee_gemini_tx_replacements_total", "Stuck txs replaced with higher fees"
+)
+TAKEOVERS = Counter(
+    "tee_gemini_takeovers_total", "Requests taken over from another shard", ("kind",)
+)
+ERRORS = Counter(
+    "tee_gemini_errors_total", "Errors by stage and exception type", ("stage", "type")
+)
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+async def handle_metrics(_: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve `/metrics` in the background until the returned runner is cleaned up."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%i/metrics", host, port)
+    return runner
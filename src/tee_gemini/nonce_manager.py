@@ -0,0 +1,50 @@
+import asyncio
+import logging
+
+from eth_typing import ChecksumAddress
+from web3 import AsyncWeb3
+from web3.types import Nonce
+
+logger = logging.getLogger(__name__)
+
+
+class NonceManager:
+    """Allocate transaction nonces locally so several txs can be in flight."""
+
+    def __init__(self, w3: AsyncWeb3, address: ChecksumAddress) -> None:
+        self.w3 = w3
+        self.address = address
+        self._next_nonce: int | None = None
+        self._lock = asyncio.Lock()
+
+    async def next_nonce(self) -> Nonce:
+        """Return the next unused nonce, seeding from the chain when required."""
+        async with self._lock:
+            if self._next_nonce is None:
+                self._next_nonce = await self._fetch_pending_nonce()
+                logger.info("Seeded nonce for %s at %i", self.address, self._next_nonce)
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            return Nonce(nonce)
+
+    async def resync(self) -> None:
+        """Reset the local nonce from the chain, e.g. after a dropped tx."""
+        async with self._lock:
+            self._next_nonce = await self._fetch_pending_nonce()
+            logger.info("Resynced nonce for %s to %i", self.address, self._next_nonce)
+
+    async def _fetch_pending_nonce(self) -> int:
+        return await self.w3.eth.get_transaction_count(self.address, "pending")
+
+
+def is_nonce_error(error: Exception) -> bool:
+    """Check whether a node rejected a tx because its nonce is stale."""
+    message = str(error).lower()
+    return any(
+        reason in message
+        for reason in (
+            "nonce too low",
+            "invalid nonce",
+            "replacement transaction underpriced",
+        )
+    )
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TypeVar
+
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+
+from tee_gemini.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT_ERRORS = (
+    TooManyRequests,
+    ServiceUnavailable,
+    DeadlineExceeded,
+    InternalServerError,
+)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity."""
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.refill_per_second)
+                self._refill()
+            self._tokens -= amount
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available, 0 if they are now."""
+        self._refill()
+        missing = min(amount, self.capacity) - self._tokens
+        return max(0.0, missing / self.refill_per_second)
+
+    def adjust(self, amount: float) -> None:
+        """Correct an earlier estimate once the real cost is known."""
+        self._refill()
+        self._tokens = min(self._tokens - amount, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._tokens = min(
+            self.capacity, self._tokens + elapsed * self.refill_per_second
+        )
+        self._updated_at = now
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit with additive increase and multiplicative decrease."""
+
+    def __init__(self, max_limit: int, cooldown: float = 1.0) -> None:
+        self.max_limit = max_limit
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self._active = 0
+        self._decreased_at = -cooldown
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+
+    async def __aexit__(self, *_: object) -> None:
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        # Roughly +1 for every `limit` successful calls
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self) -> None:
+        # Calls already in flight fail together, so treat them as one signal
+        now = time.monotonic()
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        self.limit = max(1.0, self.limit / 2)
+        logger.warning("Rate limited, reducing concurrency to %i", int(self.limit))
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    requests_per_minute: int = 1000
+    tokens_per_minute: int = 4_000_000
+    max_concurrency: int = 16
+    max_retries: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+
+class QuotaLimiter:
+    """Keep calls under request and token quotas, retrying transient errors."""
+
+    def __init__(self, config: RateLimitConfig) -> None:
+        self.config = config
+        self.requests = TokenBucket(
+            config.requests_per_minute, config.requests_per_minute / 60
+        )
+        self.tokens = TokenBucket(
+            config.tokens_per_minute, config.tokens_per_minute / 60
+        )
+        self.concurrency = AdaptiveConcurrency(config.max_concurrency)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[T]],
+        estimated_tokens: int,
+        tokens_used: Callable[[T], int],
+    ) -> T:
+        """Run `call` within quota, settling the token estimate with real usage."""
+        attempt = 0
+        while True:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            try:
+                async with self.concurrency:
+                    result = await call()
+            except TRANSIENT_ERRORS as e:
+                # A failed call uses no tokens, and each retry charges its own
+                self.tokens.adjust(-estimated_tokens)
+                ERRORS.inc("gemini", type(e).__name__)
+                if isinstance(e, TooManyRequests):
+                    self.concurrency.on_overload()
+                if attempt == self.config.max_retries:
+                    raise
+                # Full jitter so retries from concurrent workers spread out
+                delay = random.uniform(  # noqa: S311
+                    0, min(self.config.max_delay, self.config.base_delay * 2**attempt)
+                )
+                logger.warning(
+                    "Transient error (%s), retrying in %.1fs", type(e).__name__, delay
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.concurrency.on_success()
+                self.tokens.adjust(tokens_used(result) - estimated_tokens)
+                return result
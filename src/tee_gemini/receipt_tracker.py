@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, cast
+
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3.exceptions import TimeExhausted, TransactionNotFound, Web3RPCError
+from web3.types import RPCEndpoint, RPCResponse, TxParams, TxReceipt, Wei
+
+from tee_gemini.metrics import ERRORS, TX_REPLACEMENTS
+from tee_gemini.rpc_batching import BatchingProvider, RpcBatchConfig
+from tee_gemini.rpc_pool import ENDPOINT_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Nodes only accept a replacement paying at least 10% more
+MIN_BUMP_PERCENT = 10
+
+
+@dataclass(frozen=True)
+class ReceiptTrackerConfig:
+    poll_interval: float = 1.0
+    bump_after_blocks: int = 5
+    bump_percent: int = 20
+
+    def __post_init__(self) -> None:
+        if self.bump_after_blocks and self.bump_percent < MIN_BUMP_PERCENT:
+            msg = f"Fee bump must be at least {MIN_BUMP_PERCENT}%"
+            raise ValueError(msg)
+
+
+@dataclass
+class PendingTx:
+    # Unsigned tx, None when only the hash is known and it cannot be replaced
+    tx: TxParams | None
+    future: asyncio.Future[TxReceipt]
+    # The original and every replacement, any of them may be mined
+    tx_hashes: list[HexBytes]
+    on_replaced: Callable[[HexBytes], None] | None = None
+    sent_at_block: int | None = None
+
+
+class ReceiptTracker:
+    """Wait for receipts of all in-flight txs with one batched check per block.
+
+    A tx still unconfirmed `bump_after_blocks` blocks after it was sent is
+    replaced by one with the same nonce and `bump_percent` higher fees, up to
+    `max_fee_cap`.
+    """
+
+    def __init__(
+        self,
+        w3: AsyncWeb3,
+        send: Callable[[TxParams], Awaitable[HexBytes]],
+        config: ReceiptTrackerConfig,
+        receipt_timeout: float = 120,
+        max_fee_cap: int | None = None,
+    ) -> None:
+        self.w3 = w3
+        self.send = send
+        self.config = config
+        self.receipt_timeout = receipt_timeout
+        self.max_fee_cap = max_fee_cap
+        self._pending: list[PendingTx] = []
+        self._block_number = -1
+        self._checked_block = -1
+        self._new_block = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._batches_supported = True
+        # web3 marks its provider as batching while a batch is open, so batch on
+        # an instance of its own to not capture the calls of other coroutines
+        self._batch_w3 = AsyncWeb3(BatchingProvider(w3.provider, RpcBatchConfig()))
+
+    def notify_block(self, block_number: int) -> None:
+        """Check receipts now that a new block has been seen."""
+        if block_number > self._block_number:
+            self._block_number = block_number
+            self._new_block.set()
+
+    async def wait(
+        self,
+        tx_hash: HexBytes,
+        tx: TxParams | None = None,
+        on_replaced: Callable[[HexBytes], None] | None = None,
+    ) -> TxReceipt:
+        """Wait for the receipt of a tx, or of the replacement that was mined."""
+        entry = PendingTx(
+            tx=tx,
+            future=asyncio.get_running_loop().create_future(),
+            tx_hashes=[tx_hash],
+            on_replaced=on_replaced,
+        )
+        self._pending.append(entry)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(entry.future, self.receipt_timeout)
+        except TimeoutError:
+            msg = (
+                f"Tx {tx_hash.to_0x_hex()} is not in the chain "
+                f"after {self.receipt_timeout}s"
+            )
+            raise TimeExhausted(msg) from None
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                # Waiters that timed out or were cancelled have their future done
+                self._pending = [
+                    entry for entry in self._pending if not entry.future.done()
+                ]
+                if not self._pending:
+                    return
+                await self._poll()
+        finally:
+            self._task = None
+
+    async def _poll(self) -> None:
+        try:
+            await asyncio.wait_for(self._new_block.wait(), self.config.poll_interval)
+        except TimeoutError:
+            # No new block announced, look for one ourselves
+            try:
+                self.notify_block(await self.w3.eth.block_number)
+            except Exception as e:  # noqa: BLE001
+                ERRORS.inc("receipts", type(e).__name__)
+                logger.warning("Unable to get block number: %s", e)
+        self._new_block.clear()
+        if self._block_number <= self._checked_block:
+            return
+        self._checked_block = self._block_number
+        try:
+            await self._check(self._checked_block)
+        except Exception as e:
+            ERRORS.inc("receipts", type(e).__name__)
+            logger.exception("Error checking receipts")
+
+    async def _check(self, block_number: int) -> None:
+        entries = [entry for entry in self._pending if not entry.future.done()]
+        receipts = await self._receipts(
+            [tx_hash for entry in entries for tx_hash in entry.tx_hashes]
+        )
+        for entry in entries:
+            receipt = next(
+                (receipts[h] for h in entry.tx_hashes if h in receipts), None
+            )
+            if receipt:
+                entry.future.set_result(receipt)
+            elif entry.sent_at_block is None:
+                entry.sent_at_block = block_number
+            elif (
+                self.config.bump_after_blocks
+                and block_number - entry.sent_at_block >= self.config.bump_after_blocks
+            ):
+                await self._replace(entry, block_number)
+
+    async def _receipts(self, tx_hashes: list[HexBytes]) -> dict[HexBytes, TxReceipt]:
+        """Return the receipts of the txs that were mined."""
+        # With several txs in flight, first find the mined ones in one batch
+        landed = await self._landed(tx_hashes) if len(tx_hashes) > 1 else tx_hashes
+        if self._batches_supported and len(landed) > 1:
+            # Fetch them formatted as web3 returns them, in a second batch
+            async with self._batch_w3.batch_requests() as batch:
+                for tx_hash in landed:
+                    batch.add(self._batch_w3.eth.get_transaction_receipt(tx_hash))
+                receipts = cast(list[TxReceipt], await batch.async_execute())
+            return dict(zip(landed, receipts, strict=True))
+
+        receipts_by_hash: dict[HexBytes, TxReceipt] = {}
+        for tx_hash in landed:
+            with contextlib.suppress(TransactionNotFound):
+                receipts_by_hash[tx_hash] = await self.w3.eth.get_transaction_receipt(
+                    tx_hash
+                )
+        return receipts_by_hash
+
+    async def _landed(self, tx_hashes: list[HexBytes]) -> list[HexBytes]:
+        """Return the hashes that have a receipt, in one batch request."""
+        requests: list[tuple[RPCEndpoint, Any]] = [
+            (RPCEndpoint("eth_getTransactionReceipt"), [tx_hash.to_0x_hex()])
+            for tx_hash in tx_hashes
+        ]
+        responses: list[RPCResponse] | None = None
+        if self._batches_supported and len(requests) > 1:
+            try:
+                responses = await self.w3.provider.make_batch_request(requests)
+            except ENDPOINT_ERRORS:
+                raise
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Batch request rejected, checking one by one: %r", e)
+                self._batches_supported = False
+        if responses is None or len(responses) != len(requests):
+            responses = [
+                await self.w3.provider.make_request(method, params)
+                for method, params in requests
+            ]
+        return [
+            tx_hash
+            for tx_hash, response in zip(tx_hashes, responses, strict=True)
+            if response.get("result")
+        ]
+
+    async def _replace(self, entry: PendingTx, block_number: int) -> None:
+        """Resend a stuck tx with the same nonce and higher fees."""
+        if entry.tx is None or "maxFeePerGas" not in entry.tx:
+            return
+        max_fee = int(entry.tx.get("maxFeePerGas", 0))
+        priority_fee = int(entry.tx.get("maxPriorityFeePerGas", 0))
+        new_max_fee = max_fee * (100 + self.config.bump_percent) // 100 + 1
+        if self.max_fee_cap is not None:
+            new_max_fee = min(new_max_fee, self.max_fee_cap)
+        if new_max_fee * 100 < max_fee * (100 + MIN_BUMP_PERCENT):
+            logger.debug("Tx %s stuck at the fee cap", entry.tx_hashes[-1].hex())
+            return
+        new_priority_fee = min(
+            priority_fee * (100 + self.config.bump_percent) // 100 + 1, new_max_fee
+        )
+
+        tx: TxParams = {
+            **entry.tx,
+            "maxFeePerGas": Wei(new_max_fee),
+            "maxPriorityFeePerGas": Wei(new_priority_fee),
+        }
+        entry.sent_at_block = block_number
+        try:
+            tx_hash = await self.send(tx)
+        except Web3RPCError as e:
+            # E.g. the original was mined meanwhile and the nonce is now too low
+            ERRORS.inc("replace_tx", type(e).__name__)
+            logger.warning("Unable to replace tx %s: %s", entry.tx_hashes[-1].hex(), e)
+            return
+        TX_REPLACEMENTS.inc()
+        entry.tx = tx
+        entry.tx_hashes.append(tx_hash)
+        logger.info(
+            "Replaced tx stuck for %i blocks with %s (max fee %i -> %i)",
+            self.config.bump_after_blocks,
+            tx_hash.hex(),
+            max_fee,
+            new_max_fee,
+        )
+        if entry.on_replaced:
+            entry.on_replaced(tx_hash)
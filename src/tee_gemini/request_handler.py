@@ -0,0 +1,141 @@
+import json
+import logging
+from collections.abc import Awaitable
+from dataclasses import asdict
+
+from hexbytes import HexBytes
+from web3.exceptions import ContractLogicError, TimeExhausted
+
+from tee_gemini.gemini_api import GeminiAPI, PromptTooLongError
+from tee_gemini.gemini_endpoint import (
+    GeminiEndpoint,
+    GeminiResponse,
+    OIDCResponse,
+    TransactionRevertedError,
+)
+from tee_gemini.metrics import ERRORS
+from tee_gemini.state_store import (
+    RequestKind,
+    RequestRecord,
+    RequestState,
+    StateStore,
+)
+from tee_gemini.tpm_interface import TPMInterface
+
+logger = logging.getLogger(__name__)
+
+
+class RequestHandler:
+    """Fulfill prompt and OIDC requests, recording progress in the state store."""
+
+    def __init__(
+        self,
+        gemini_api: GeminiAPI,
+        gemini_endpoint: GeminiEndpoint,
+        tpm_interface: TPMInterface,
+        state_store: StateStore,
+    ) -> None:
+        self.gemini_api = gemini_api
+        self.gemini_endpoint = gemini_endpoint
+        self.tpm_interface = tpm_interface
+        self.state_store = state_store
+        gemini_endpoint.tx_sent_listeners.append(self._on_tx_sent)
+
+    async def handle_prompt_request(self, uid: int, data: str) -> None:
+        """Query Gemini for a prompt and fulfill the request onchain."""
+        record = self.state_store.get(RequestKind.PROMPT, uid)
+        if record and await self._is_fulfilled(record):
+            return
+
+        if record and record.response:
+            # Reuse the response from before a restart instead of paying twice
+            response = GeminiResponse(**json.loads(record.response))
+        else:
+            try:
+                response = await self.gemini_api.make_query(uid=uid, data=data)
+            except PromptTooLongError as e:
+                # Rejected before paying for a response, and never retried
+                ERRORS.inc("gemini_query", type(e).__name__)
+                logger.warning("Rejecting prompt request uid=%d: %s", uid, e)
+                self.state_store.mark_rejected(RequestKind.PROMPT, uid)
+                return
+            self.state_store.mark_queried(
+                RequestKind.PROMPT, uid, json.dumps(asdict(response))
+            )
+        logger.info(response)
+        await self._fulfill(
+            RequestKind.PROMPT,
+            uid,
+            self.gemini_endpoint.fulfill_gemini_request(response),
+        )
+
+    async def handle_oidc_request(self, uid: int) -> None:
+        """Fetch an OIDC token from the TPM and fulfill the request onchain."""
+        record = self.state_store.get(RequestKind.OIDC, uid)
+        if record and await self._is_fulfilled(record):
+            return
+
+        # Tokens expire, so always fetch a fresh one rather than reusing a stored one
+        response = await self.tpm_interface.query_oidc_token(uid=uid)
+        logger.info(response)
+        await self._fulfill(
+            RequestKind.OIDC, uid, self.gemini_endpoint.fulfill_oidc_request(response)
+        )
+
+    async def resume(self, record: RequestRecord) -> None:
+        """Continue a request left unfinished by a previous run."""
+        logger.info(
+            "Resuming %s request uid=%d (%s)", record.kind, record.uid, record.state
+        )
+        match record.kind:
+            case RequestKind.PROMPT:
+                await self.handle_prompt_request(record.uid, record.data or "")
+            case RequestKind.OIDC:
+                await self.handle_oidc_request(record.uid)
+
+    async def _fulfill(
+        self, kind: RequestKind, uid: int, fulfillment: Awaitable[None]
+    ) -> None:
+        try:
+            await fulfillment
+        except TransactionRevertedError as e:
+            # Left as sent, `requeue_pending_requests` resends it once the
+            # receipt check on resume sees the revert
+            logger.warning("Fulfilling %s request uid=%d failed: %s", kind, uid, e)
+            return
+        except ContractLogicError as e:
+            if "Response already exists" not in str(e):
+                logger.exception("Error fulfilling %s request uid=%d", kind, uid)
+                return
+            logger.info("%s request uid=%d already fulfilled", kind, uid)
+        self.state_store.mark_confirmed(kind, uid)
+
+    async def _is_fulfilled(self, record: RequestRecord) -> bool:
+        """Check whether a request was confirmed, or its tx landed, before now."""
+        if record.state == RequestState.CONFIRMED:
+            return True
+        if record.state != RequestState.TX_SENT or not record.tx_hash:
+            return False
+
+        try:
+            receipt = await self.gemini_endpoint.wait_for_receipt(
+                HexBytes(record.tx_hash)
+            )
+        except TimeExhausted:
+            logger.warning("Tx %s never landed, resending", record.tx_hash)
+            return False
+        if receipt["status"] != 1:
+            logger.warning("Tx %s reverted, resending", record.tx_hash)
+            return False
+        self.state_store.mark_confirmed(record.kind, record.uid)
+        return True
+
+    def _on_tx_sent(
+        self, response: GeminiResponse | OIDCResponse, tx_hash: HexBytes
+    ) -> None:
+        kind = (
+            RequestKind.PROMPT
+            if isinstance(response, GeminiResponse)
+            else RequestKind.OIDC
+        )
+        self.state_store.mark_tx_sent(kind, response.uid, tx_hash.to_0x_hex())
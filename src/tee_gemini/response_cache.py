@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import asdict
+
+from tee_gemini.gemini_endpoint import GeminiResponse
+from tee_gemini.metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_TOKENS_SAVED
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """LRU cache of Gemini responses with TTL, optional disk tier and single-flight.
+
+    Identical prompts that are in flight at the same time share one query.
+    """
+
+    def __init__(
+        self, max_entries: int = 1024, ttl: float = 3600, path: str | None = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._entries: OrderedDict[str, tuple[float, GeminiResponse]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future[GeminiResponse]] = {}
+        self._conn: sqlite3.Connection | None = None
+        if path:
+            self._conn = sqlite3.connect(path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def key(model: str, prompt: str, generation_config: Mapping[str, object]) -> str:
+        """Hash everything that determines a generation into a cache key."""
+        payload = json.dumps(
+            {"model": model, "prompt": prompt, "config": generation_config},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get_or_query(
+        self, key: str, query: Callable[[], Awaitable[GeminiResponse]]
+    ) -> GeminiResponse:
+        """Return a cached response, or run `query` once for all concurrent callers."""
+        cached = self._get(key)
+        if cached:
+            self._record_hit(cached)
+            return cached
+
+        if key in self._in_flight:
+            response = await asyncio.shield(self._in_flight[key])
+            self._record_hit(response)
+            return response
+
+        self.misses += 1
+        RESPONSE_CACHE_LOOKUPS.inc("miss")
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await query()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark as retrieved so a failure without waiters is not logged again
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            self._put(key, response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    def _get(self, key: str) -> GeminiResponse | None:
+        now = time.time()
+        if key in self._entries:
+            expires_at, response = self._entries[key]
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return response
+            del self._entries[key]
+
+        if self._conn:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                response = GeminiResponse(**json.loads(row[0]))
+                self._put_memory(key, row[1], response)
+                return response
+        return None
+
+    def _put(self, key: str, response: GeminiResponse) -> None:
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, expires_at, response)
+        if self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(asdict(response)), expires_at),
+            )
+
+    def _put_memory(
+        self, key: str, expires_at: float, response: GeminiResponse
+    ) -> None:
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _record_hit(self, response: GeminiResponse) -> None:
+        self.hits += 1
+        self.tokens_saved += response.total_token_count
+        RESPONSE_CACHE_LOOKUPS.inc("hit")
+        RESPONSE_CACHE_TOKENS_SAVED.inc(amount=response.total_token_count)
+        logger.debug(
+            "Response cache hit (hits=%i, misses=%i, tokens saved=%i)",
+            self.hits,
+            self.misses,
+            self.tokens_saved,
+        )
@@ -1,21 +1,68 @@
 import asyncio
 import logging
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
 
 from web3 import AsyncHTTPProvider, AsyncWeb3
 from web3.middleware import ExtraDataToPOAMiddleware
 from web3.types import BlockData
 
+from tee_gemini.rpc_batching import BatchingProvider, RpcBatchConfig
+from tee_gemini.rpc_pool import PooledProvider, RpcPoolConfig
+
+if TYPE_CHECKING:
+    from web3.providers.async_base import AsyncBaseProvider
+
 logger = logging.getLogger(__name__)
 
+# Messages providers reject `eth_getLogs` with when it covers too many blocks or
+# logs. Rate limits ("limit exceeded", "too many requests") are not among them
+RANGE_LIMIT_MARKERS = (
+    # geth and Infura, with the result limit
+    "query returned more than",
+    # Alchemy
+    "log response size exceeded",
+    # go-flare and Avalanche, with the block range
+    "requested too many blocks",
+    # BSC, Ankr and others, with the maximum block range
+    "exceed maximum block range",
+    "block range is too large",
+    "block range too large",
+    # QuickNode, as in eth_getLogs is limited to a 10,000 range
+    "is limited to a",
+)
+# Invalid params, which Alchemy and QuickNode answer oversized queries with
+RANGE_LIMIT_CODES = frozenset({-32602})
+
+
+def is_range_limit_error(error: Exception) -> bool:
+    """Check whether a `get_logs` call was rejected for covering too much."""
+    response = getattr(error, "rpc_response", None) or {}
+    rpc_error = response.get("error")
+    if isinstance(rpc_error, dict) and rpc_error.get("code") in RANGE_LIMIT_CODES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RANGE_LIMIT_MARKERS)
+
 
 class RpcAPI:
-    def __init__(self, rpc_url: str) -> None:
-        """Initialize the asynchronous Web3 instance."""
-        self.rpc_url = rpc_url
+    def __init__(
+        self,
+        rpc_url: str | Sequence[str],
+        pool_config: RpcPoolConfig | None = None,
+        batch_config: RpcBatchConfig | None = None,
+    ) -> None:
+        """Initialize the asynchronous Web3 instance, pooled over several URLs."""
+        rpc_urls = [rpc_url] if isinstance(rpc_url, str) else list(rpc_url)
+        self.rpc_url = ", ".join(rpc_urls)
 
-        self.w3 = AsyncWeb3(
-            AsyncHTTPProvider(self.rpc_url), middleware=[ExtraDataToPOAMiddleware]
-        )
+        provider: AsyncBaseProvider = AsyncHTTPProvider(rpc_urls[0])
+        if len(rpc_urls) > 1:
+            provider = PooledProvider(rpc_urls, pool_config)
+        if batch_config and batch_config.enabled:
+            provider = BatchingProvider(provider, batch_config)
+        self.w3 = AsyncWeb3(provider, middleware=[ExtraDataToPOAMiddleware])
+        self._chain_id: int | None = None
 
     async def wait_for_new_block(self, last_block_number: int, delay: float = 0) -> int:
         """Wait for a new block to be mined."""
@@ -29,6 +76,12 @@ class RpcAPI:
         """Get the current block number."""
         return await self.w3.eth.block_number
 
+    async def get_chain_id(self) -> int:
+        """Get the chain id, fetched once as it never changes."""
+        if self._chain_id is None:
+            self._chain_id = await self.w3.eth.chain_id
+        return self._chain_id
+
     async def get_latest_block(self) -> BlockData:
         """Get the current block."""
         return await self.w3.eth.get_block("latest")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, override
+
+from web3.providers.async_base import AsyncBaseProvider, AsyncJSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from tee_gemini.metrics import RPC_BATCH_SIZE
+from tee_gemini.rpc_pool import BROADCAST_METHODS, ENDPOINT_ERRORS
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+logger = logging.getLogger(__name__)
+
+PendingRequest = tuple[RPCEndpoint, Any, asyncio.Future[RPCResponse]]
+
+
+@dataclass(frozen=True)
+class RpcBatchConfig:
+    window: float = 0.005
+    max_size: int = 1
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 1
+
+
+class BatchingProvider(AsyncJSONBaseProvider):
+    """Coalesce requests made within `window` seconds into one JSON-RPC batch.
+
+    Txs are sent on their own, so a pooled provider still broadcasts them. If
+    the provider rejects batches, requests are sent one by one from then on.
+    """
+
+    def __init__(self, provider: AsyncBaseProvider, config: RpcBatchConfig) -> None:
+        super().__init__()
+        self.provider = provider
+        self.config = config
+        self._pending: list[PendingRequest] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushing: set[asyncio.Task[None]] = set()
+        self._batches_supported = True
+
+    @override
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if method in BROADCAST_METHODS or not self._batches_supported:
+            return await self.provider.make_request(method, params)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((method, params, future))
+        if len(self._pending) >= self.config.max_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.config.window, self._flush_pending
+            )
+        return await future
+
+    @override
+    async def make_batch_request(
+        self, requests: list[tuple[RPCEndpoint, Any]]
+    ) -> list[RPCResponse]:
+        return await self.provider.make_batch_request(requests)
+
+    @override
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return await self.provider.is_connected(show_traceback)
+
+    def _flush_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _send(self, batch: list[PendingRequest]) -> None:
+        RPC_BATCH_SIZE.observe(len(batch))
+        if len(batch) == 1:
+            ((method, params, future),) = batch
+            try:
+                _resolve(future, await self.provider.make_request(method, params))
+            except Exception as e:  # noqa: BLE001
+                _resolve(future, e)
+            return
+
+        responses: Sequence[RPCResponse | BaseException] | None = None
+        try:
+            responses = await self.provider.make_batch_request(
+                [(method, params) for method, params, _ in batch]
+            )
+        except ENDPOINT_ERRORS as e:
+            responses = [e] * len(batch)
+        except Exception as e:  # noqa: BLE001
+            # Some providers answer a batch with a single error object
+            logger.warning("Batch request rejected, sending one by one: %r", e)
+
+        if responses is None or len(responses) != len(batch):
+            self._batches_supported = False
+            responses = await asyncio.gather(
+                *(
+                    self.provider.make_request(method, params)
+                    for method, params, _ in batch
+                ),
+                return_exceptions=True,
+            )
+        for (_, _, future), response in zip(batch, responses, strict=True):
+            _resolve(future, response)
+
+
+def _resolve(
+    future: asyncio.Future[RPCResponse], response: RPCResponse | BaseException
+) -> None:
+    if future.done():
+        return
+    if isinstance(response, BaseException):
+        future.set_exception(response)
+    else:
+        future.set_result(response)
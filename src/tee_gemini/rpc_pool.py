@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any, TypeVar, override
+
+from aiohttp import ClientError
+from web3 import AsyncHTTPProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from tee_gemini.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Sent to several endpoints at once, so a tx is not lost to one bad provider
+BROADCAST_METHODS = frozenset({"eth_sendRawTransaction"})
+RATE_LIMIT_MARKERS = ("rate limit", "too many requests", "capacity exceeded")
+# Weight of the newest sample in the smoothed latency of an endpoint
+LATENCY_SMOOTHING = 0.3
+
+
+class RateLimitedError(Exception):
+    """An endpoint answered with a rate limit error instead of a result."""
+
+
+# Failures that are the endpoint's fault, as opposed to JSON-RPC errors
+ENDPOINT_ERRORS = (ClientError, TimeoutError, OSError, RateLimitedError)
+
+
+@dataclass(frozen=True)
+class RpcPoolConfig:
+    broadcast: int = 2
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+    health_check_interval: float = 10.0
+    max_block_lag: int = 2
+
+
+class Endpoint:
+    """One RPC URL with its measured latency, head and circuit breaker state."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        # Fail over to another endpoint rather than retrying this one
+        self.provider = AsyncHTTPProvider(url, exception_retry_configuration=None)
+        self.latency = 0.0
+        self.block_number = 0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def available(self, now: float) -> bool:
+        """Whether the circuit is closed, or half open after its cooldown."""
+        return self.open_until <= now
+
+    def record_success(self) -> None:
+        if self.open_until:
+            logger.info("RPC `%s` recovered", self.url)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, config: RpcPoolConfig) -> None:
+        self.failures += 1
+        if self.failures >= config.failure_threshold:
+            if self.available(time.monotonic()):
+                logger.warning(
+                    "RPC `%s` failed %i times, skipping it for %.0fs",
+                    self.url,
+                    self.failures,
+                    config.cooldown,
+                )
+            self.open_until = time.monotonic() + config.cooldown
+
+    def record_latency(self, latency: float) -> None:
+        if not self.latency:
+            self.latency = latency
+            return
+        self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+
+def _is_rate_limited(response: Mapping[str, Any]) -> bool:
+    error = response.get("error")
+    message = str(error.get("message", "") if isinstance(error, dict) else error)
+    return any(marker in message.lower() for marker in RATE_LIMIT_MARKERS)
+
+
+class PooledProvider(AsyncJSONBaseProvider):
+    """Spread requests over several HTTP endpoints.
+
+    Reads go to the fastest endpoint that is healthy and close to the highest
+    head seen, failing over to the next one on connection errors, timeouts and
+    rate limits. Txs are broadcast to the `broadcast` best endpoints. Endpoints
+    failing `failure_threshold` times in a row are skipped for `cooldown`
+    seconds, and all are probed in the background to rank them and bring them
+    back. Each endpoint keeps its own keep-alive session.
+    """
+
+    def __init__(
+        self, urls: Sequence[str], config: RpcPoolConfig | None = None
+    ) -> None:
+        if not urls:
+            msg = "At least one RPC URL is required"
+            raise ValueError(msg)
+        super().__init__()
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.config = config or RpcPoolConfig()
+        self._health_checks: asyncio.Task[None] | None = None
+        self._background: set[asyncio.Task[Any]] = set()
+
+    def ranked(self) -> list[Endpoint]:
+        """Endpoints best first, those failing or with an open circuit last."""
+        now = time.monotonic()
+        head = max(endpoint.block_number for endpoint in self.endpoints)
+        return sorted(
+            self.endpoints,
+            key=lambda endpoint: (
+                not endpoint.available(now),
+                head - endpoint.block_number > self.config.max_block_lag,
+                endpoint.failures > 0,
+                endpoint.latency,
+            ),
+        )
+
+    @override
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        self._start_health_checks()
+        if method in BROADCAST_METHODS:
+            return await self._broadcast(method, params)
+        return await self._with_failover(
+            lambda provider: provider.make_request(method, params)
+        )
+
+    @override
+    async def make_batch_request(
+        self, requests: list[tuple[RPCEndpoint, Any]]
+    ) -> list[RPCResponse]:
+        self._start_health_checks()
+        return await self._with_failover(
+            lambda provider: provider.make_batch_request(requests)
+        )
+
+    @override
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        await self.check_health()
+        for endpoint in self.endpoints:
+            logger.info(
+                "RPC `%s` %s, latency %.1fms, block %i",
+                endpoint.url,
+                "down" if endpoint.failures else "up",
+                endpoint.latency * 1000,
+                endpoint.block_number,
+            )
+        return any(not endpoint.failures for endpoint in self.endpoints)
+
+    async def check_health(self) -> None:
+        """Probe every endpoint for its latency and head."""
+        await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        started_at = time.monotonic()
+        try:
+            response = await self._call(
+                endpoint,
+                lambda provider: provider.make_request(
+                    RPCEndpoint("eth_blockNumber"), []
+                ),
+            )
+            block_number = int(response.get("result", ""), 16)
+        except (*ENDPOINT_ERRORS, ValueError, TypeError) as e:
+            logger.debug("Health check of `%s` failed: %s", endpoint.url, e)
+            return
+        endpoint.record_latency(time.monotonic() - started_at)
+        endpoint.block_number = block_number
+
+    async def _run_health_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.health_check_interval)
+            await self.check_health()
+
+    def _start_health_checks(self) -> None:
+        if self._health_checks is None and self.config.health_check_interval > 0:
+            self._health_checks = asyncio.create_task(self._run_health_checks())
+
+    async def _call(
+        self, endpoint: Endpoint, call: Callable[[AsyncHTTPProvider], Awaitable[T]]
+    ) -> T:
+        """Make a call on one endpoint, updating its circuit breaker."""
+        try:
+            result = await call(endpoint.provider)
+            if isinstance(result, dict) and _is_rate_limited(result):
+                raise RateLimitedError(result["error"])
+        except ENDPOINT_ERRORS as e:
+            ERRORS.inc("rpc", type(e).__name__)
+            endpoint.record_failure(self.config)
+            raise
+        endpoint.record_success()
+        return result
+
+    async def _with_failover(
+        self, call: Callable[[AsyncHTTPProvider], Awaitable[T]]
+    ) -> T:
+        last_error: Exception | None = None
+        for endpoint in self.ranked():
+            try:
+                return await self._call(endpoint, call)
+            except ENDPOINT_ERRORS as e:
+                logger.warning("RPC `%s` failed, trying the next: %s", endpoint.url, e)
+                last_error = e
+        raise last_error or ConnectionError("No RPC endpoint left")
+
+    async def _broadcast(self, method: RPCEndpoint, params: object) -> RPCResponse:
+        """Send to the best endpoints at once, returning the first success.
+
+        When every endpoint answers with an error, the first error is returned.
+        """
+        tasks = [
+            asyncio.create_task(
+                self._call(
+                    endpoint, lambda provider: provider.make_request(method, params)
+                )
+            )
+            for endpoint in self.ranked()[: max(1, self.config.broadcast)]
+        ]
+        error_response: RPCResponse | None = None
+        last_error: Exception | None = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    response = await next_done
+                except ENDPOINT_ERRORS as e:
+                    last_error = e
+                    continue
+                if "error" not in response:
+                    return response
+                error_response = error_response or response
+        finally:
+            # Let the slower sends finish, their results are not needed
+            for task in tasks:
+                if not task.done():
+                    self._background.add(task)
+                    task.add_done_callback(self._forget)
+        if error_response:
+            return error_response
+        raise last_error or ConnectionError("No RPC endpoint left")
+
+    def _forget(self, task: asyncio.Task[Any]) -> None:
+        self._background.discard(task)
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from tee_gemini.metrics import STAGE_SECONDS
+from tee_gemini.rate_limiter import TokenBucket
+from tee_gemini.state_store import RequestKind
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    """Share the workers between request kinds, and fairly between senders.
+
+    Queued OIDC and prompt jobs are started in the ratio of their weights.
+    Within a kind, senders take turns in proportion to the estimated tokens of
+    their requests, so a sender flooding the queue only delays its own. A
+    sender has at most `sender_queue_size` jobs queued and runs at most
+    `sender_concurrency` at once, and is held back once it goes over
+    `sender_tokens_per_minute`. 0 disables any of these limits.
+    """
+
+    oidc_weight: int = 4
+    prompt_weight: int = 1
+    sender_queue_size: int = 64
+    sender_concurrency: int = 4
+    sender_tokens_per_minute: int = 0
+
+    def __post_init__(self) -> None:
+        if self.oidc_weight < 1 or self.prompt_weight < 1:
+            msg = "Scheduler weights must be positive"
+            raise ValueError(msg)
+
+    def weight(self, kind: RequestKind) -> int:
+        return self.oidc_weight if kind == RequestKind.OIDC else self.prompt_weight
+
+
+@dataclass
+class Job:
+    name: str
+    run: Callable[[], Awaitable[None]]
+    kind: RequestKind = RequestKind.PROMPT
+    # Uid of the request the job handles, uids start at 1
+    uid: int = 0
+    # Address the request came from, empty if unknown
+    sender: str = ""
+    # Estimated Gemini tokens, the sender's share of the workers is weighed in
+    tokens: int = 0
+
+
+@dataclass
+class _Entry:
+    job: Job
+    # Virtual time at which the job would start were every sender backlogged
+    start: float
+    enqueued_at: float
+
+
+class _Lane:
+    """Start-time fair queue of the jobs of one kind, per sender."""
+
+    def __init__(self, weight: int) -> None:
+        self.weight = weight
+        self.queues: dict[str, deque[_Entry]] = {}
+        self.vtime = 0.0
+        # Virtual time of the lane among the others, advanced by 1/weight per job
+        self.pass_ = 0.0
+        self._finish: dict[str, float] = {}
+
+    def push(self, job: Job) -> None:
+        start = max(self.vtime, self._finish.get(job.sender, 0.0))
+        self._finish[job.sender] = start + max(1, job.tokens)
+        self.queues.setdefault(job.sender, deque()).append(
+            _Entry(job, start, time.monotonic())
+        )
+
+    def pop(self, can_start: Callable[[Job], bool]) -> _Entry | None:
+        """Take the earliest job whose sender is allowed to start one."""
+        candidates = [
+            (queue[0].start, sender)
+            for sender, queue in self.queues.items()
+            if can_start(queue[0].job)
+        ]
+        if not candidates:
+            return None
+        _, sender = min(candidates)
+        queue = self.queues[sender]
+        entry = queue.popleft()
+        self.vtime = entry.start
+        if not queue:
+            del self.queues[sender]
+            del self._finish[sender]
+        return entry
+
+
+class FairScheduler:
+    """Queue of jobs handed out by weighted fair queuing instead of arrival order.
+
+    Used like an `asyncio.Queue`, with `task_done` given the finished job.
+    """
+
+    def __init__(self, config: SchedulerConfig, maxsize: int = 0) -> None:
+        self.config = config
+        self.maxsize = maxsize
+        self._lanes = {kind: _Lane(config.weight(kind)) for kind in RequestKind}
+        self._pass = 0.0
+        self._size = 0
+        self._unfinished = 0
+        self._queued: dict[str, int] = {}
+        self._running: dict[str, int] = {}
+        self._budgets: dict[str, TokenBucket] = {}
+        self._changed = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    async def put(self, job: Job) -> None:
+        """Enqueue a job, waiting for room when the queue is full."""
+        while self.full():
+            self._changed.clear()
+            await self._changed.wait()
+        self._push(job)
+
+    def try_put(self, job: Job) -> bool:
+        """Enqueue a job unless the queue or the sender's share of it is full."""
+        if self.full() or self._at_queue_limit(job.sender):
+            return False
+        self._push(job)
+        return True
+
+    def _push(self, job: Job) -> None:
+        lane = self._lanes[job.kind]
+        if not lane.queues:
+            # An idle lane does not get to catch up on the turns it skipped
+            lane.pass_ = max(lane.pass_, self._pass)
+        lane.push(job)
+        if job.sender:
+            self._queued[job.sender] = self._queued.get(job.sender, 0) + 1
+        self._size += 1
+        self._unfinished += 1
+        self._finished.clear()
+        self._changed.set()
+
+    async def get(self) -> Job:
+        """Wait for the next job that is allowed to start."""
+        while (job := self._next()) is None:
+            self._changed.clear()
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(self._retry_after()):
+                    await self._changed.wait()
+        # Wake producers waiting for room
+        self._changed.set()
+        return job
+
+    def task_done(self, job: Job) -> None:
+        """Mark a job returned by `get` as finished."""
+        if job.sender:
+            self._running[job.sender] -= 1
+            if not self._running[job.sender]:
+                del self._running[job.sender]
+                budget = self._budgets.get(job.sender)
+                if budget and not budget.wait_time(budget.capacity):
+                    del self._budgets[job.sender]
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._finished.set()
+        self._changed.set()
+
+    async def join(self) -> None:
+        """Wait until every job put has been marked as done."""
+        await self._finished.wait()
+
+    def _next(self) -> Job | None:
+        # Ties, as when every lane starts out at 0, go to the heavier lane
+        lanes = sorted(
+            (lane for lane in self._lanes.values() if lane.queues),
+            key=lambda lane: (lane.pass_, -lane.weight),
+        )
+        for lane in lanes:
+            entry = lane.pop(self._can_start)
+            if entry is None:
+                continue
+            self._pass = lane.pass_
+            lane.pass_ += 1 / lane.weight
+            self._size -= 1
+            job = entry.job
+            if job.sender:
+                self._queued[job.sender] -= 1
+                if not self._queued[job.sender]:
+                    del self._queued[job.sender]
+                self._running[job.sender] = self._running.get(job.sender, 0) + 1
+                if budget := self._budget(job.sender):
+                    # Charged up front, like `TokenBucket.acquire`
+                    budget.adjust(min(job.tokens, budget.capacity))
+            STAGE_SECONDS.observe(
+                time.monotonic() - entry.enqueued_at, f"queue_{job.kind}"
+            )
+            return job
+        return None
+
+    def _can_start(self, job: Job) -> bool:
+        # Requests stored before senders were recorded are not limited
+        if not job.sender:
+            return True
+        if self._at_concurrency_limit(job.sender):
+            return False
+        budget = self._budget(job.sender)
+        return budget is None or not budget.wait_time(job.tokens)
+
+    def _at_queue_limit(self, sender: str) -> bool:
+        limit = self.config.sender_queue_size
+        return bool(sender) and 0 < limit <= self._queued.get(sender, 0)
+
+    def _at_concurrency_limit(self, sender: str) -> bool:
+        limit = self.config.sender_concurrency
+        return 0 < limit <= self._running.get(sender, 0)
+
+    def _budget(self, sender: str) -> TokenBucket | None:
+        tokens_per_minute = self.config.sender_tokens_per_minute
+        if not tokens_per_minute:
+            return None
+        if sender not in self._budgets:
+            self._budgets[sender] = TokenBucket(
+                tokens_per_minute, tokens_per_minute / 60
+            )
+        return self._budgets[sender]
+
+    def _retry_after(self) -> float | None:
+        """Seconds until a sender held back by its budget may start a job."""
+        if not self._budgets:
+            return None
+        waits = [
+            budget.wait_time(queue[0].job.tokens)
+            for lane in self._lanes.values()
+            for sender, queue in lane.queues.items()
+            if (budget := self._budgets.get(sender))
+            and not self._at_concurrency_limit(sender)
+        ]
+        return min(waits, default=None)
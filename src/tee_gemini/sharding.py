@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ShardConfig:
+    """Split requests across `count` TEE instances by `uid mod count`.
+
+    A request owned by another instance is taken over once it stays unfulfilled
+    for `takeover_after` seconds, the next instance after the owner first, the
+    one after that `takeover_after` later, and so on.
+    """
+
+    index: int = 0
+    count: int = 1
+    takeover_after: float = 300.0
+
+    def __post_init__(self) -> None:
+        if not 0 <= self.index < self.count:
+            msg = f"Shard index must be in [0, {self.count}), got {self.index}"
+            raise ValueError(msg)
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+    def owner(self, uid: int) -> int:
+        return uid % self.count
+
+    def owns(self, uid: int) -> bool:
+        return self.owner(uid) == self.index
+
+    def takeover_delay(self, uid: int) -> float:
+        """Seconds after which this instance takes over a request."""
+        return self.takeover_after * ((self.index - self.owner(uid)) % self.count)
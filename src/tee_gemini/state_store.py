@@ -0,0 +1,244 @@
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from enum import StrEnum
+
+logger = logging.getLogger(__name__)
+
+
+class RequestKind(StrEnum):
+    PROMPT = "prompt"
+    OIDC = "oidc"
+
+
+class RequestState(StrEnum):
+    SEEN = "seen"
+    QUERIED = "queried"
+    TX_SENT = "tx_sent"
+    CONFIRMED = "confirmed"
+    # Never fulfilled, e.g. a prompt over the token limit
+    REJECTED = "rejected"
+    # Owned by another shard, taken over if it stays unfulfilled
+    DEFERRED = "deferred"
+
+
+# Seen but not finished yet, and not deferred to another shard
+PENDING_STATES = (RequestState.SEEN, RequestState.QUERIED, RequestState.TX_SENT)
+
+
+@dataclass
+class RequestRecord:
+    kind: RequestKind
+    uid: int
+    state: RequestState
+    sender: str | None
+    data: str | None
+    response: str | None
+    tx_hash: str | None
+    updated_at: float
+
+
+class StateStore:
+    """Durable checkpoint and per-request state, backed by SQLite in WAL mode.
+
+    The state belongs to the contract at `contract_address` on `chain_id`. A
+    store last used for another contract or chain, e.g. before a redeploy, is
+    cleared rather than resumed, as its checkpoint and uids mean nothing for
+    this one.
+    """
+
+    def __init__(self, path: str, chain_id: int, contract_address: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), block INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            "kind TEXT NOT NULL, uid INTEGER NOT NULL, state TEXT NOT NULL, "
+            "data TEXT, response TEXT, tx_hash TEXT, updated_at REAL NOT NULL, "
+            "sender TEXT, block INTEGER, PRIMARY KEY (kind, uid))"
+        )
+        # Added after the first release, stores created before lack them
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(requests)")}
+        for column, column_type in (("sender", "TEXT"), ("block", "INTEGER")):
+            if column not in columns:
+                self.conn.execute(
+                    f"ALTER TABLE requests ADD COLUMN {column} {column_type}"
+                )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS requests_sender "
+            "ON requests (sender, updated_at)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS deployment ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), chain_id INTEGER NOT NULL, "
+            "contract TEXT NOT NULL)"
+        )
+        self._bind(chain_id, contract_address)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS requests_state ON requests (state, updated_at)"
+        )
+        logger.info("Opened state store at `%s`", path)
+
+    def _bind(self, chain_id: int, contract_address: str) -> None:
+        row = self.conn.execute(
+            "SELECT chain_id, contract FROM deployment WHERE id = 0"
+        ).fetchone()
+        # Stores from before deployments were recorded are kept as they are
+        if row and row != (chain_id, contract_address):
+            logger.warning(
+                "State store was for %s on chain %i, clearing it for %s on chain %i",
+                row[1],
+                row[0],
+                contract_address,
+                chain_id,
+            )
+            self.conn.execute("DELETE FROM checkpoint")
+            self.conn.execute("DELETE FROM requests")
+        # Recorded last, so a store cleared halfway is cleared again
+        self.conn.execute(
+            "INSERT INTO deployment (id, chain_id, contract) VALUES (0, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "chain_id = excluded.chain_id, contract = excluded.contract",
+            (chain_id, contract_address),
+        )
+
+    def get_checkpoint(self) -> int | None:
+        """Return the first block that has not been fully ingested yet."""
+        row = self.conn.execute("SELECT block FROM checkpoint WHERE id = 0").fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, block: int) -> None:
+        """Record that every block before `block` has been ingested."""
+        self.conn.execute(
+            "INSERT INTO checkpoint (id, block) VALUES (0, ?) "
+            "ON CONFLICT (id) DO UPDATE SET block = excluded.block",
+            (block,),
+        )
+
+    def mark_seen(  # noqa: PLR0913
+        self,
+        kind: RequestKind,
+        uid: int,
+        data: str | None = None,
+        state: RequestState = RequestState.SEEN,
+        sender: str | None = None,
+        block: int | None = None,
+    ) -> bool:
+        """Record a new request, returning False if it was already known.
+
+        `block` is that of the event submitting it, see `prune`.
+        """
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO requests "
+            "(kind, uid, state, sender, block, data, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, uid, state, sender, block, data, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def mark_taken_over(self, kind: RequestKind, uid: int) -> None:
+        """Start handling a request deferred to another shard."""
+        self._update(kind, uid, RequestState.SEEN)
+
+    def mark_queried(self, kind: RequestKind, uid: int, response: str) -> None:
+        """Store the response for a request so it is never queried twice."""
+        self._update(kind, uid, RequestState.QUERIED, response=response)
+
+    def mark_tx_sent(self, kind: RequestKind, uid: int, tx_hash: str) -> None:
+        """Store the hash of the tx fulfilling a request."""
+        self._update(kind, uid, RequestState.TX_SENT, tx_hash=tx_hash)
+
+    def mark_confirmed(self, kind: RequestKind, uid: int) -> None:
+        """Mark a request as fulfilled onchain."""
+        self._update(kind, uid, RequestState.CONFIRMED)
+
+    def mark_rejected(self, kind: RequestKind, uid: int) -> None:
+        """Mark a request that will not be fulfilled, so it is not resumed."""
+        self._update(kind, uid, RequestState.REJECTED)
+
+    def get(self, kind: RequestKind, uid: int) -> RequestRecord | None:
+        """Return the stored state of a request."""
+        row = self.conn.execute(
+            "SELECT kind, uid, state, sender, data, response, tx_hash, updated_at "
+            "FROM requests WHERE kind = ? AND uid = ?",
+            (kind, uid),
+        ).fetchone()
+        return _to_record(row) if row else None
+
+    def pending(self, per_sender: int = 0) -> list[RequestRecord]:
+        """Return the requests that are not confirmed yet, oldest first.
+
+        Requests deferred to another shard are left out, see `deferred`, as are
+        rejected ones. A positive `per_sender` returns only the oldest that many
+        of each sender.
+        """
+        rows = self.conn.execute(
+            "SELECT kind, uid, state, sender, data, response, tx_hash, updated_at "
+            "FROM (SELECT *, ROW_NUMBER() OVER "
+            "(PARTITION BY sender ORDER BY updated_at) AS position "
+            "FROM requests WHERE state IN (?, ?, ?)) "
+            "WHERE ? <= 0 OR position <= ? ORDER BY updated_at",
+            (*PENDING_STATES, per_sender, per_sender),
+        ).fetchall()
+        return [_to_record(row) for row in rows]
+
+    def deferred(self, before: float) -> list[RequestRecord]:
+        """Return requests deferred to another shard before `before`, oldest first."""
+        rows = self.conn.execute(
+            "SELECT kind, uid, state, sender, data, response, tx_hash, updated_at "
+            "FROM requests WHERE state = ? AND updated_at < ? ORDER BY updated_at",
+            (RequestState.DEFERRED, before),
+        ).fetchall()
+        return [_to_record(row) for row in rows]
+
+    def prune(self, before_block: int) -> int:
+        """Delete finished requests submitted before `before_block`.
+
+        Only safe for blocks that are never ingested again, as a pruned request
+        would be seen as new. Returns the number of requests deleted.
+        """
+        cursor = self.conn.execute(
+            "DELETE FROM requests WHERE state IN (?, ?) AND COALESCE(block, 0) < ?",
+            (RequestState.CONFIRMED, RequestState.REJECTED, before_block),
+        )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _update(
+        self,
+        kind: RequestKind,
+        uid: int,
+        state: RequestState,
+        response: str | None = None,
+        tx_hash: str | None = None,
+    ) -> None:
+        self.conn.execute(
+            "UPDATE requests SET state = ?, response = COALESCE(?, response), "
+            "tx_hash = COALESCE(?, tx_hash), updated_at = ? "
+            "WHERE kind = ? AND uid = ?",
+            (state, response, tx_hash, time.time(), kind, uid),
+        )
+
+
+def _to_record(
+    row: tuple[str, int, str, str | None, str | None, str | None, str | None, float],
+) -> RequestRecord:
+    kind, uid, state, sender, data, response, tx_hash, updated_at = row
+    return RequestRecord(
+        kind=RequestKind(kind),
+        uid=uid,
+        state=RequestState(state),
+        sender=sender,
+        data=data,
+        response=response,
+        tx_hash=tx_hash,
+        updated_at=updated_at,
+    )
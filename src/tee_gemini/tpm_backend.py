@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import shlex
+import socket
+import struct
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import override
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+logger = logging.getLogger(__name__)
+
+# TPM 2.0 constants (TCG TPM 2.0 Library, Part 2)
+TPM_ST_NO_SESSIONS = 0x8001
+TPM_CC_READ_PUBLIC = 0x00000173
+TPM_CC_GET_RANDOM = 0x0000017B
+TPM_ALG_RSA = 0x0001
+TPM_ALG_ECC = 0x0023
+TPM_ALG_NULL = 0x0010
+TPM_ECC_NIST_P256 = 0x0003
+# Persistent handle of the RSA EK (TCG EK Credential Profile)
+EK_RSA_HANDLE = 0x81010001
+DEFAULT_RSA_EXPONENT = 65537
+HEADER_SIZE = 10
+MAX_RESPONSE_SIZE = 4096
+MAX_RANDOM_BYTES_PER_CALL = 32
+
+
+class TPMCommunicationError(Exception):
+    """Custom exception for TPM communication errors."""
+
+
+class TPMBackend(ABC):
+    """Operations the TEE needs from the TPM."""
+
+    @abstractmethod
+    async def check_connection(self) -> str:
+        """Check the TPM can be reached."""
+
+    @abstractmethod
+    async def ek_pubkey_pem(self) -> str:
+        """Return the endorsement key public key as PEM."""
+
+    @abstractmethod
+    async def oidc_token(
+        self, audience: str | None = None, nonces: Sequence[str] = ()
+    ) -> str:
+        """Return an attestation token for the VM."""
+
+    @abstractmethod
+    async def random_hex(self, num_bytes: int) -> str:
+        """Return random bytes from the TPM as hex."""
+
+
+class SubprocessBackend(TPMBackend):
+    """Run `gotpm` and `tpm2-tools` commands through the shell."""
+
+    async def communicate(self, command: str) -> str:
+        """Execute a TPM-related command via the subprocess shell."""
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            error_msg = stderr.decode()
+            msg = f"Command `{command}` failed with error: `{error_msg}`"
+            raise TPMCommunicationError(msg)
+        return stdout.decode()
+
+    @override
+    async def check_connection(self) -> str:
+        return await self.communicate("gotpm --help")
+
+    @override
+    async def ek_pubkey_pem(self) -> str:
+        return await self.communicate("gotpm pubkey endorsement")
+
+    @override
+    async def oidc_token(
+        self, audience: str | None = None, nonces: Sequence[str] = ()
+    ) -> str:
+        command = "gotpm token"
+        if audience:
+            command += f" --audience {shlex.quote(audience)}"
+        for nonce in nonces:
+            command += f" --custom-nonce {shlex.quote(nonce)}"
+        return await self.communicate(command)
+
+    @override
+    async def random_hex(self, num_bytes: int) -> str:
+        return await self.communicate(f"tpm2_getrandom --hex {num_bytes}")
+
+
+class DeviceBackend(TPMBackend):
+    """Send TPM 2.0 commands directly over one long-lived connection.
+
+    `device` is a character device such as `/dev/tpmrm0`, or `tcp://host:port`
+    for the raw command port of a software TPM (e.g. `swtpm socket`). Commands
+    that need more than the TPM itself, such as minting attestation tokens, and
+    EK reads when the EK is not persisted, go to the `fallback` backend.
+    """
+
+    def __init__(self, device: str, fallback: TPMBackend) -> None:
+        self.device = device
+        self.fallback = fallback
+        self._fd: int | None = None
+        self._sock: socket.socket | None = None
+        self._lock = asyncio.Lock()
+
+    @override
+    async def check_connection(self) -> str:
+        await self.random_hex(1)
+        return f"Connected to TPM at `{self.device}`"
+
+    @override
+    async def ek_pubkey_pem(self) -> str:
+        try:
+            response = await self.transmit(
+                TPM_CC_READ_PUBLIC, struct.pack(">I", EK_RSA_HANDLE)
+            )
+        except TPMCommunicationError as e:
+            logger.info("EK not readable from `%s` (%s), falling back", self.device, e)
+            return await self.fallback.ek_pubkey_pem()
+        return _public_area_to_pem(response)
+
+    @override
+    async def oidc_token(
+        self, audience: str | None = None, nonces: Sequence[str] = ()
+    ) -> str:
+        return await self.fallback.oidc_token(audience, nonces)
+
+    @override
+    async def random_hex(self, num_bytes: int) -> str:
+        random_bytes = b""
+        while len(random_bytes) < num_bytes:
+            requested = min(num_bytes - len(random_bytes), MAX_RANDOM_BYTES_PER_CALL)
+            response = await self.transmit(
+                TPM_CC_GET_RANDOM, struct.pack(">H", requested)
+            )
+            (size,) = struct.unpack_from(">H", response)
+            random_bytes += response[2 : 2 + size]
+        return random_bytes.hex()
+
+    async def transmit(self, command_code: int, params: bytes) -> bytes:
+        """Send a session-less command and return the response parameters."""
+        command = (
+            struct.pack(
+                ">HII", TPM_ST_NO_SESSIONS, HEADER_SIZE + len(params), command_code
+            )
+            + params
+        )
+        async with self._lock:
+            try:
+                response = await asyncio.to_thread(self._exchange, command)
+            except OSError as e:
+                self.close()
+                msg = f"TPM at `{self.device}` unreachable: {e}"
+                raise TPMCommunicationError(msg) from e
+
+        if len(response) < HEADER_SIZE:
+            msg = f"Short response from TPM at `{self.device}`"
+            raise TPMCommunicationError(msg)
+        _, _, response_code = struct.unpack_from(">HII", response)
+        if response_code != 0:
+            msg = f"TPM command 0x{command_code:x} failed with 0x{response_code:x}"
+            raise TPMCommunicationError(msg)
+        return response[HEADER_SIZE:]
+
+    def close(self) -> None:
+        """Close the connection, it is reopened on the next command."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _exchange(self, command: bytes) -> bytes:
+        if self.device.startswith("tcp://"):
+            if self._sock is None:
+                host, port = self.device.removeprefix("tcp://").rsplit(":", 1)
+                self._sock = socket.create_connection((host, int(port)), timeout=10)
+            self._sock.sendall(command)
+            return self._recv_response(self._sock)
+
+        if self._fd is None:
+            self._fd = os.open(self.device, os.O_RDWR)
+        os.write(self._fd, command)
+        return os.read(self._fd, MAX_RESPONSE_SIZE)
+
+    @staticmethod
+    def _recv_response(sock: socket.socket) -> bytes:
+        response = b""
+        expected = HEADER_SIZE
+        while len(response) < expected:
+            chunk = sock.recv(expected - len(response))
+            if not chunk:
+                msg = "TPM closed the connection"
+                raise ConnectionError(msg)
+            response += chunk
+            if len(response) >= HEADER_SIZE:
+                (expected,) = struct.unpack_from(">I", response, 2)
+        return response
+
+
+def _public_area_to_pem(response: bytes) -> str:
+    """Convert the TPM2B_PUBLIC returned by TPM2_ReadPublic into a PEM key."""
+    offset = 2  # Skip the TPM2B size
+    key_type, _, _ = struct.unpack_from(">HHI", response, offset)
+    offset += 8
+    (policy_size,) = struct.unpack_from(">H", response, offset)
+    offset += 2 + policy_size
+
+    # TPMT_SYM_DEF_OBJECT, with key bits and mode unless the algorithm is null
+    (symmetric,) = struct.unpack_from(">H", response, offset)
+    offset += 2 if symmetric == TPM_ALG_NULL else 6
+    # Signing scheme, with a hash algorithm unless the scheme is null
+    (scheme,) = struct.unpack_from(">H", response, offset)
+    offset += 2 if scheme == TPM_ALG_NULL else 4
+
+    if key_type == TPM_ALG_RSA:
+        _, exponent = struct.unpack_from(">HI", response, offset)
+        offset += 6
+        (modulus_size,) = struct.unpack_from(">H", response, offset)
+        modulus = response[offset + 2 : offset + 2 + modulus_size]
+        public_key = rsa.RSAPublicNumbers(
+            exponent or DEFAULT_RSA_EXPONENT, int.from_bytes(modulus, "big")
+        ).public_key()
+    elif key_type == TPM_ALG_ECC:
+        curve, kdf = struct.unpack_from(">HH", response, offset)
+        if curve != TPM_ECC_NIST_P256:
+            msg = f"Unsupported EK curve 0x{curve:x}"
+            raise TPMCommunicationError(msg)
+        offset += 4 if kdf == TPM_ALG_NULL else 6
+        (x_size,) = struct.unpack_from(">H", response, offset)
+        x = response[offset + 2 : offset + 2 + x_size]
+        offset += 2 + x_size
+        (y_size,) = struct.unpack_from(">H", response, offset)
+        y = response[offset + 2 : offset + 2 + y_size]
+        public_key = ec.EllipticCurvePublicNumbers(
+            int.from_bytes(x, "big"), int.from_bytes(y, "big"), ec.SECP256R1()
+        ).public_key()
+    else:
+        msg = f"Unsupported EK type 0x{key_type:x}"
+        raise TPMCommunicationError(msg)
+
+    return public_key.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
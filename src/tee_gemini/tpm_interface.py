@@ -1,41 +1,42 @@
 import asyncio
 import logging
+import time
+from collections.abc import Sequence
+
+import jwt
 
 from tee_gemini.gemini_endpoint import OIDCResponse
+from tee_gemini.metrics import STAGE_SECONDS
+from tee_gemini.tpm_backend import (
+    SubprocessBackend,
+    TPMBackend,
+    TPMCommunicationError,
+)
 
 logger = logging.getLogger(__name__)
 
 
-class TPMCommunicationError(Exception):
-    """Custom exception for TPM communication errors."""
-
-
 class TPMInterface:
     """Interface for communicating with TPM (Trusted Platform Module)."""
 
-    def __init__(self) -> None:
-        pass
-
-    async def _communicate(self, command: str) -> str:
-        """Execute a TPM-related command via the subprocess shell."""
-        process = await asyncio.create_subprocess_shell(
-            command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-
-        if process.returncode != 0:
-            error_msg = stderr.decode()
-            msg = f"Command `{command}` failed with error: `{error_msg}`"
-            raise TPMCommunicationError(msg)
-        return stdout.decode()
+    def __init__(
+        self, backend: TPMBackend | None = None, token_safety_margin: float = 60.0
+    ) -> None:
+        self.backend = backend or SubprocessBackend()
+        # Cached OIDC tokens are reused until this many seconds before `exp`
+        self.token_safety_margin = token_safety_margin
+        self._token: str | None = None
+        self._token_expires_at = 0.0
+        self._token_refresh: asyncio.Task[str] | None = None
 
     async def check_connection(self) -> str:
         """Check TPM connection by running a simple command."""
-        return await self._communicate("gotpm --help")
+        return await self.backend.check_connection()
 
     async def query_ek_pubkey(self) -> str:
         """Query the endorsement key public key (EK pubkey) from the TPM."""
-        pubkey = await self._communicate("gotpm pubkey endorsement")
+        with STAGE_SECONDS.time("tpm_ek_pubkey"):
+            pubkey = await self.backend.ek_pubkey_pem()
         pubkey_cleaned = pubkey.replace("-----BEGIN PUBLIC KEY-----", "").replace(
             "-----END PUBLIC KEY-----", ""
         )
@@ -47,20 +48,63 @@ class TPMInterface:
         logger.info("Successfully retrieved EK pubkey: %s", pubkey_cleaned)
         return pubkey_cleaned
 
-    async def query_oidc_token(self, uid: int) -> OIDCResponse:
-        """Query the OIDC token from the TPM and return the response."""
-        res = await self._communicate("gotpm token")
+    async def query_oidc_token(
+        self,
+        uid: int,
+        audience: str | None = None,
+        nonces: Sequence[str] = (),
+        *,
+        force_fresh: bool = False,
+    ) -> OIDCResponse:
+        """Query the OIDC token from the TPM and return the response.
+
+        Tokens are cached until shortly before they expire, and concurrent callers
+        share one TPM call. A custom audience or nonce always gets a fresh token.
+        """
+        if force_fresh or audience or nonces:
+            res = await self._fetch_oidc_token(audience, nonces)
+        else:
+            res = await self._cached_oidc_token()
+
+        logger.info("Successfully retrieved OIDC token for UID: %s", uid)
+        return OIDCResponse(uid, res)
+
+    async def _cached_oidc_token(self) -> str:
+        if self._token and time.time() < self._token_expires_at:
+            logger.debug("Reusing cached OIDC token")
+            return self._token
+        if self._token_refresh is None:
+            self._token_refresh = asyncio.create_task(self._refresh_oidc_token())
+        return await asyncio.shield(self._token_refresh)
+
+    async def _refresh_oidc_token(self) -> str:
+        try:
+            token = await self._fetch_oidc_token()
+        finally:
+            self._token_refresh = None
+        try:
+            claims = jwt.decode(token.strip(), options={"verify_signature": False})
+            self._token_expires_at = float(claims["exp"]) - self.token_safety_margin
+            self._token = token
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            logger.warning("Unable to read `exp` from OIDC token, not caching it")
+        return token
+
+    async def _fetch_oidc_token(
+        self, audience: str | None = None, nonces: Sequence[str] = ()
+    ) -> str:
+        with STAGE_SECONDS.time("tpm_oidc_token"):
+            res = await self.backend.oidc_token(audience, nonces)
 
         if not res:
             msg = "Failed to retrieve OIDC token from TPM"
             raise TPMCommunicationError(msg)
-
-        logger.info("Successfully retrieved OIDC token for UID: %s", uid)
-        return OIDCResponse(uid, res)
+        return res
 
     async def get_random_hex_bytes(self, num_bytes: int) -> str:
         """Query random bytes from the TPM."""
-        rnd = await self._communicate(f"tpm2_getrandom --hex {num_bytes}")
+        with STAGE_SECONDS.time("tpm_random"):
+            rnd = await self.backend.random_hex(num_bytes)
 
         if not rnd:
             msg = "Failed to retrieve random bytes from TPM"
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+
+from tee_gemini.metrics import ERRORS, STAGE_SECONDS
+from tee_gemini.scheduler import FairScheduler, Job, SchedulerConfig
+from tee_gemini.state_store import RequestKind
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Bounded queue of jobs drained concurrently by a fixed number of workers.
+
+    Jobs are started in the order picked by a `FairScheduler`, not as submitted.
+    The requests of queued and running jobs are tracked, as are those of jobs
+    that ended in the last `retry_after` seconds, see `has_job`.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        queue_size: int,
+        scheduler_config: SchedulerConfig | None = None,
+        retry_after: float = 60,
+    ) -> None:
+        if num_workers < 1:
+            msg = f"Number of workers must be positive, got {num_workers}"
+            raise ValueError(msg)
+        self.num_workers = num_workers
+        self.queue = FairScheduler(scheduler_config or SchedulerConfig(), queue_size)
+        self.retry_after = retry_after
+        self._workers: list[asyncio.Task[None]] = []
+        self._active: set[tuple[RequestKind, int]] = set()
+        # When jobs ended, in that order
+        self._ended_at: dict[tuple[RequestKind, int], float] = {}
+
+    def start(self) -> None:
+        """Spawn the worker tasks."""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        logger.info("Started worker pool with %i workers", self.num_workers)
+
+    async def submit(self, job: Job) -> None:
+        """Enqueue a job, waiting for a free slot when the queue is full."""
+        if self.queue.full():
+            logger.info("Worker queue full, waiting to enqueue %s", job.name)
+        self._active.add((job.kind, job.uid))
+        await self.queue.put(job)
+
+    def try_submit(self, job: Job) -> bool:
+        """Enqueue a job unless there is no room for it, without waiting.
+
+        There is none when the queue is full or the job's sender already has
+        `sender_queue_size` jobs queued.
+        """
+        if not self.queue.try_put(job):
+            return False
+        self._active.add((job.kind, job.uid))
+        return True
+
+    def has_job(self, kind: RequestKind, uid: int) -> bool:
+        """Check whether a request is queued, running or was handled recently."""
+        key = (kind, uid)
+        if key in self._active:
+            return True
+        now = time.monotonic()
+        while self._ended_at:
+            oldest = next(iter(self._ended_at))
+            if self._ended_at[oldest] > now - self.retry_after:
+                break
+            del self._ended_at[oldest]
+        return key in self._ended_at
+
+    async def join(self) -> None:
+        """Wait until every submitted job has been processed."""
+        await self.queue.join()
+
+    async def stop(self) -> None:
+        """Cancel the workers, dropping any jobs still queued."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                with STAGE_SECONDS.time("job"):
+                    await job.run()
+            except Exception as e:
+                ERRORS.inc("job", type(e).__name__)
+                # Isolate failures so one bad request does not stall the others
+                logger.exception("Worker %i failed processing %s", index, job.name)
+            finally:
+                self.queue.task_done(job)
+                key = (job.kind, job.uid)
+                self._active.discard(key)
+                self._ended_at.pop(key, None)
+                self._ended_at[key] = time.monotonic()
@@ -1,3 +1,4 @@
 from verification.main import decode_and_validate_token, start
+from verification.verifier import AsyncVerifier
 
-__all__ = ["decode_and_validate_token", "start"]
+__all__ = ["AsyncVerifier", "decode_and_validate_token", "start"]
@@ -0,0 +1,147 @@
+import json
+import logging
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, TextIO
+
+from web3 import Web3
+
+from verification.helper import decode_and_validate_token, is_valid
+from verification.jwks_cache import JWKSCache
+
+logger = logging.getLogger(__name__)
+
+ABI_FILE = (
+    Path(__file__).resolve().parent.parent / "contracts" / "output" / "Interactor.abi"
+)
+# Claims copied into the report, enough to tell which VM produced a token
+REPORT_CLAIMS = ("iss", "sub", "aud", "iat", "exp", "hwmodel", "swname", "secboot")
+
+
+@dataclass
+class TokenInput:
+    token: str
+    uid: int | None = None
+
+
+@dataclass
+class VerifyResult:
+    uid: int | None
+    valid: bool
+    reason: str | None = None
+    claims: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class BatchSummary:
+    total: int = 0
+    valid: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+
+def read_tokens(stream: TextIO) -> Iterator[TokenInput]:
+    """Read one token per line, either raw or as JSON with `token` and `uid`."""
+    for raw_line in stream:
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            entry = json.loads(line)
+            yield TokenInput(token=entry["token"], uid=entry.get("uid"))
+        else:
+            yield TokenInput(token=line)
+
+
+def read_tokens_from_logs(
+    rpc_url: str,
+    contract_address: str,
+    from_block: int,
+    to_block: int | None = None,
+    chunk_size: int = 1000,
+) -> Iterator[TokenInput]:
+    """Yield the tokens emitted in `OIDCRequestFullfilled` events over a range."""
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    with ABI_FILE.open() as f:
+        contract = w3.eth.contract(
+            address=w3.to_checksum_address(contract_address), abi=json.load(f)
+        )
+    if to_block is None:
+        to_block = w3.eth.block_number
+
+    for start in range(from_block, to_block + 1, chunk_size):
+        end = min(start + chunk_size - 1, to_block)
+        logs = contract.events.OIDCRequestFullfilled().get_logs(  # pyright: ignore [reportAttributeAccessIssue]
+            from_block=start, to_block=end
+        )
+        logger.info("Found %i tokens in blocks %i-%i", len(logs), start, end)
+        for log in logs:
+            yield TokenInput(token=log["args"]["data"], uid=log["args"]["uid"])
+
+
+def verify_token(
+    token_input: TokenInput,
+    expected_issuer: str,
+    well_known_path: str,
+    jwks_cache: JWKSCache,
+) -> VerifyResult:
+    """Verify one token, reporting failures instead of raising them."""
+    try:
+        claims = decode_and_validate_token(
+            token_input.token, expected_issuer, well_known_path, jwks_cache
+        )
+        is_valid(claims)
+    except Exception as e:  # noqa: BLE001
+        return VerifyResult(uid=token_input.uid, valid=False, reason=str(e))
+    return VerifyResult(
+        uid=token_input.uid,
+        valid=True,
+        claims={k: claims[k] for k in REPORT_CLAIMS if k in claims},
+    )
+
+
+def verify_batch(  # noqa: PLR0913
+    tokens: Iterable[TokenInput],
+    expected_issuer: str,
+    well_known_path: str,
+    jwks_cache: JWKSCache,
+    report: TextIO,
+    concurrency: int = 16,
+) -> BatchSummary:
+    """Verify tokens concurrently, writing one JSON result per line in input order."""
+    summary = BatchSummary()
+    started_at = time.perf_counter()
+    # Bound the number of queued tokens so huge inputs are streamed, not buffered
+    pending: deque[Future[VerifyResult]] = deque()
+
+    def write(result: VerifyResult) -> None:
+        summary.total += 1
+        summary.valid += result.valid
+        report.write(json.dumps(asdict(result)) + "\n")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for token_input in tokens:
+            pending.append(
+                executor.submit(
+                    verify_token,
+                    token_input,
+                    expected_issuer,
+                    well_known_path,
+                    jwks_cache,
+                )
+            )
+            if len(pending) >= 4 * concurrency:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+    report.flush()
+    summary.elapsed = time.perf_counter() - started_at
+    return summary
@@ -1,34 +1,80 @@
 import argparse
-import base64
 import logging
 from dataclasses import dataclass
+from functools import cache
 
 import jwt
-import requests
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+from verification.jwks_cache import JWKSCache
 
 logger = logging.getLogger(__name__)
 
 
 @dataclass
 class VerifyArgs:
-    token: str
+    token: str | None
+    tokens_file: str | None
+    from_block: int | None
+    to_block: int | None
+    rpc_url: str | None
+    contract_address: str | None
+    report: str
+    concurrency: int
     expected_issuer: str
     well_known_path: str
+    jwks_cache: str | None
     verbose: bool
 
 
 def parse_verify_args() -> VerifyArgs:
     """Parse command line arguments for verification."""
     parser = argparse.ArgumentParser()
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--token",
         type=str,
-        required=True,
         help="OIDC token",
     )
+    source.add_argument(
+        "--tokens-file",
+        type=str,
+        help="file with one token or JSON object per line, `-` for stdin",
+    )
+    source.add_argument(
+        "--from-block",
+        type=int,
+        help="verify tokens from OIDCRequestFullfilled events from this block",
+    )
+    parser.add_argument(
+        "--to-block",
+        type=int,
+        default=None,
+        help="last block to read events from (default: latest)",
+    )
+    parser.add_argument(
+        "--rpc-url",
+        type=str,
+        default=None,
+        help="RPC to read events from, required with --from-block",
+    )
+    parser.add_argument(
+        "--contract-address",
+        type=str,
+        default=None,
+        help="address of the endpoint contract, required with --from-block",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="-",
+        help="file to write per token results to as JSON lines (default: stdout)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="number of tokens verified in parallel (default: 16)",
+    )
     parser.add_argument(
         "--expected-issuer",
         type=str,
@@ -41,64 +87,106 @@ def parse_verify_args() -> VerifyArgs:
         default="/.well-known/openid-configuration",
         help="well known path (default: /.well-known/openid-configuration)",
     )
+    parser.add_argument(
+        "--jwks-cache",
+        type=str,
+        default=None,
+        help="file to cache the issuer's keys in between runs (default: no cache)",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
         help="increase output verbosity",
         action="store_true",
     )
-    return VerifyArgs(**vars(parser.parse_args()))
+    args = parser.parse_args()
+    if args.from_block is not None and not (args.rpc_url and args.contract_address):
+        parser.error("--from-block requires --rpc-url and --contract-address")
+    return VerifyArgs(**vars(args))
 
 
-def get_well_known_file(expected_issuer: str, well_known_path: str) -> dict:
-    """Fetch JWKS URL from well known file."""
-    response = requests.get(expected_issuer + well_known_path, timeout=10)
-    valid_status_code = 200
-    if response.status_code == valid_status_code:
-        return response.json()
-    msg = f"Failed to fetch JWKS URI: {response.status_code}"
-    raise requests.exceptions.HTTPError(msg)
+@dataclass
+class ServerArgs:
+    host: str
+    port: int
+    expected_issuer: str
+    well_known_path: str
+    jwks_cache: str | None
+    result_cache_size: int
+    verbose: bool
 
 
-def fetch_jwks(uri: str) -> dict:
-    """Fetch the JWKS data from a remote endpoint."""
-    response = requests.get(uri, timeout=10)
-    valid_status_code = 200
-    if response.status_code == valid_status_code:
-        return response.json()
-    msg = f"Failed to fetch JWKS: {response.status_code}"
-    raise requests.exceptions.HTTPError(msg)
+def parse_server_args() -> ServerArgs:
+    """Parse command line arguments for the verification server."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="port to listen on (default: 8080)",
+    )
+    parser.add_argument(
+        "--expected-issuer",
+        type=str,
+        default="https://confidentialcomputing.googleapis.com",
+        help="expected issuer of token (default: https://confidentialcomputing.googleapis.com)",
+    )
+    parser.add_argument(
+        "--well-known-path",
+        type=str,
+        default="/.well-known/openid-configuration",
+        help="well known path (default: /.well-known/openid-configuration)",
+    )
+    parser.add_argument(
+        "--jwks-cache",
+        type=str,
+        default=None,
+        help="file to cache the issuer's keys in between runs (default: no cache)",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=10000,
+        help="number of valid results remembered until their token expires, "
+        "0 to disable (default: 10000)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="increase output verbosity",
+        action="store_true",
+    )
+    return ServerArgs(**vars(parser.parse_args()))
 
 
-def jwk_to_rsa_key(jwk: dict) -> RSAPublicKey:
-    """Convert a JWK key (from JWKS) into an RSA public key object."""
-    n = int.from_bytes(base64.urlsafe_b64decode(jwk["n"] + "=="), "big")
-    e = int.from_bytes(base64.urlsafe_b64decode(jwk["e"] + "=="), "big")
-    return rsa.RSAPublicNumbers(e, n).public_key(backend=default_backend())
+@cache
+def get_jwks_cache(
+    expected_issuer: str, well_known_path: str, cache_path: str | None = None
+) -> JWKSCache:
+    """Return the shared JWKS cache for an issuer."""
+    return JWKSCache(expected_issuer, well_known_path, cache_path)
 
 
 def decode_and_validate_token(
-    token: str, expected_issuer: str, well_known_path: str
+    token: str,
+    expected_issuer: str,
+    well_known_path: str,
+    jwks_cache: JWKSCache | None = None,
 ) -> dict:
     """Decode and validate the JWT token using the JWKS RSA public key."""
-    wk = get_well_known_file(expected_issuer, well_known_path)
-    jwks_uri = wk["jwks_uri"]
+    if jwks_cache is None:
+        jwks_cache = get_jwks_cache(expected_issuer, well_known_path)
 
-    jwks = fetch_jwks(jwks_uri)
     unverified_header = jwt.get_unverified_header(token)
     logger.info("Token Header: %s", unverified_header)
-    rsa_key = None
-
     # Find the correct key based on the key ID (kid)
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            logger.info("Found matching kid: %s", key["kid"])
-            rsa_key = jwk_to_rsa_key(key)
-            break
-
-    if rsa_key is None:
-        msg = "Unable to find appropriate key"
-        raise ValueError(msg)
+    rsa_key = jwks_cache.get_key(unverified_header["kid"])
 
     # Verify and decode the token using the public RSA key
     try:
@@ -111,3 +199,43 @@ def decode_and_validate_token(
     except jwt.InvalidTokenError as e:
         msg = f"Invalid token: {e!s}"
         raise ValueError(msg) from e
+
+
+def is_valid(claims: dict) -> bool:
+    """Check the validity of the claims."""
+    audience = claims.get("aud")
+    if not audience:
+        msg = "Missing 'aud' claim"
+        raise ValueError(msg)
+
+    subject = claims.get("sub")
+    if not subject:
+        msg = "Missing 'sub' claim"
+        raise ValueError(msg)
+
+    issued_at = claims.get("iat")
+    if not issued_at:
+        msg = "Missing 'iat' claim"
+        raise ValueError(msg)
+
+    expires_at = claims.get("exp")
+    if not expires_at:
+        msg = "Missing 'exp' claim"
+        raise ValueError(msg)
+
+    hw_model = claims.get("hwmodel")
+    if hw_model != "GCP_AMD_SEV":
+        msg = "Invalid or missing 'hwmodel' claim"
+        raise ValueError(msg)
+
+    sw_name = claims.get("swname")
+    if sw_name != "GCE":
+        msg = "Invalid or missing 'swname' claim"
+        raise ValueError(msg)
+
+    secure_boot = claims.get("secboot")
+    if not secure_boot:
+        msg = "Invalid or missing 'secboot' claim"
+        raise ValueError(msg)
+
+    return True
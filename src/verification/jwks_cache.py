@@ -0,0 +1,171 @@
+import base64
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+logger = logging.getLogger(__name__)
+
+HTTP_OK = 200
+HTTP_NOT_MODIFIED = 304
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+def jwk_to_rsa_key(jwk: dict[str, Any]) -> RSAPublicKey:
+    """Convert a JWK key (from JWKS) into an RSA public key object."""
+    n = int.from_bytes(base64.urlsafe_b64decode(jwk["n"] + "=="), "big")
+    e = int.from_bytes(base64.urlsafe_b64decode(jwk["e"] + "=="), "big")
+    return rsa.RSAPublicNumbers(e, n).public_key(backend=default_backend())
+
+
+@dataclass
+class CachedDocument:
+    body: dict[str, Any]
+    etag: str | None
+    expires_at: float
+
+
+class JWKSCache:
+    """Discovery document and JWKS of an issuer, cached as parsed RSA keys.
+
+    Documents are kept for as long as their `Cache-Control` allows and
+    revalidated with their `ETag`. A token signed with an unknown `kid` forces
+    a refetch, at most once per `min_refetch_interval`, so key rotations are
+    picked up without letting bogus tokens hammer the issuer.
+    """
+
+    def __init__(
+        self,
+        expected_issuer: str,
+        well_known_path: str,
+        cache_path: str | None = None,
+        default_max_age: float = 300,
+        min_refetch_interval: float = 60,
+    ) -> None:
+        self.well_known_url = expected_issuer + well_known_path
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.default_max_age = default_max_age
+        self.min_refetch_interval = min_refetch_interval
+        self._documents: dict[str, CachedDocument] = {}
+        self._keys: dict[str, RSAPublicKey] = {}
+        self._keys_expire_at = 0.0
+        self._refetched_at = -min_refetch_interval
+        self._lock = threading.Lock()
+        self._load()
+
+    def get_key(self, kid: str) -> RSAPublicKey:
+        """Return the public key for `kid`, fetching the JWKS only when needed."""
+        key = self._keys.get(kid)
+        if key is not None and time.time() < self._keys_expire_at:
+            return key
+
+        with self._lock:
+            now = time.time()
+            if now >= self._keys_expire_at:
+                self._refresh(force=False)
+            elif kid not in self._keys and (
+                now - self._refetched_at >= self.min_refetch_interval
+            ):
+                logger.info("Unknown kid %s, refetching JWKS", kid)
+                self._refetched_at = now
+                self._refresh(force=True)
+
+        key = self._keys.get(kid)
+        if key is None:
+            msg = "Unable to find appropriate key"
+            raise ValueError(msg)
+        return key
+
+    def warm(self, margin: float = 0) -> None:
+        """Fetch the keys now if they expire within `margin` seconds."""
+        with self._lock:
+            if time.time() + margin >= self._keys_expire_at:
+                self._refresh(force=False)
+
+    def _refresh(self, *, force: bool) -> None:
+        well_known = self._get_document(self.well_known_url, force=False)
+        jwks_uri = well_known.body["jwks_uri"]
+        jwks = self._get_document(jwks_uri, force=force)
+        self._keys = {
+            key["kid"]: jwk_to_rsa_key(key)
+            for key in jwks.body["keys"]
+            if key.get("kty") == "RSA"
+        }
+        self._keys_expire_at = min(well_known.expires_at, jwks.expires_at)
+        self._save()
+
+    def _get_document(self, url: str, *, force: bool) -> CachedDocument:
+        cached = self._documents.get(url)
+        if cached and not force and time.time() < cached.expires_at:
+            return cached
+
+        headers = {"If-None-Match": cached.etag} if cached and cached.etag else {}
+        response = requests.get(url, headers=headers, timeout=10)
+        if response.status_code == HTTP_NOT_MODIFIED and cached:
+            logger.info("%s not modified", url)
+            cached.expires_at = self._expires_at(response)
+            return cached
+        if response.status_code != HTTP_OK:
+            msg = f"Failed to fetch {url}: {response.status_code}"
+            raise requests.exceptions.HTTPError(msg)
+
+        logger.info("Fetched %s", url)
+        document = CachedDocument(
+            body=response.json(),
+            etag=response.headers.get("ETag"),
+            expires_at=self._expires_at(response),
+        )
+        self._documents[url] = document
+        return document
+
+    def _expires_at(self, response: requests.Response) -> float:
+        cache_control = response.headers.get("Cache-Control", "")
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return time.time()
+        match = MAX_AGE_PATTERN.search(cache_control)
+        max_age = int(match.group(1)) if match else self.default_max_age
+        return time.time() + max_age
+
+    def _load(self) -> None:
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+        try:
+            documents = json.loads(self.cache_path.read_text())
+            self._documents = {
+                url: CachedDocument(**document) for url, document in documents.items()
+            }
+        except (OSError, ValueError, TypeError):
+            logger.warning("Ignoring unreadable JWKS cache `%s`", self.cache_path)
+            return
+
+        well_known = self._documents.get(self.well_known_url)
+        jwks = well_known and self._documents.get(well_known.body.get("jwks_uri", ""))
+        if well_known and jwks:
+            self._keys = {
+                key["kid"]: jwk_to_rsa_key(key)
+                for key in jwks.body.get("keys", [])
+                if key.get("kty") == "RSA"
+            }
+            self._keys_expire_at = min(well_known.expires_at, jwks.expires_at)
+
+    def _save(self) -> None:
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            tmp_path.write_text(
+                json.dumps({url: asdict(d) for url, d in self._documents.items()})
+            )
+            tmp_path.replace(self.cache_path)
+        except OSError:
+            logger.warning("Could not write JWKS cache `%s`", self.cache_path)
@@ -1,57 +1,37 @@
 import logging
+import sys
+from contextlib import ExitStack
+from pathlib import Path
 
-from verification.helper import decode_and_validate_token, parse_verify_args
+from verification.batch import (
+    read_tokens,
+    read_tokens_from_logs,
+    verify_batch,
+)
+from verification.helper import (
+    VerifyArgs,
+    decode_and_validate_token,
+    get_jwks_cache,
+    is_valid,
+    parse_verify_args,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def is_valid(claims: dict) -> bool:
-    """Check the validity of the claims."""
-    audience = claims.get("aud")
-    if not audience:
-        msg = "Missing 'aud' claim"
-        raise ValueError(msg)
-
-    subject = claims.get("sub")
-    if not subject:
-        msg = "Missing 'sub' claim"
-        raise ValueError(msg)
-
-    issued_at = claims.get("iat")
-    if not issued_at:
-        msg = "Missing 'iat' claim"
-        raise ValueError(msg)
-
-    expires_at = claims.get("exp")
-    if not expires_at:
-        msg = "Missing 'exp' claim"
-        raise ValueError(msg)
-
-    hw_model = claims.get("hwmodel")
-    if hw_model != "GCP_AMD_SEV":
-        msg = "Invalid or missing 'hwmodel' claim"
-        raise ValueError(msg)
-
-    sw_name = claims.get("swname")
-    if sw_name != "GCE":
-        msg = "Invalid or missing 'swname' claim"
-        raise ValueError(msg)
-
-    secure_boot = claims.get("secboot")
-    if not secure_boot:
-        msg = "Invalid or missing 'secboot' claim"
-        raise ValueError(msg)
-
-    return True
-
-
 def start() -> bool:
     args = parse_verify_args()
     logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
     logger.info("Expected issuer: %s", args.expected_issuer)
 
+    if args.token is None:
+        return start_batch(args)
+
+    jwks_cache = get_jwks_cache(
+        args.expected_issuer, args.well_known_path, args.jwks_cache
+    )
     decoded_token = decode_and_validate_token(
-        args.token, args.expected_issuer, args.well_known_path
+        args.token, args.expected_issuer, args.well_known_path, jwks_cache
     )
     logger.info("Successfully verified signature against issuer")
     validity = is_valid(decoded_token)
@@ -60,3 +40,42 @@ def start() -> bool:
         "Result: Token signature and payload was successfully verified against issuer"
     )
     return validity
+
+
+def start_batch(args: VerifyArgs) -> bool:
+    """Verify many tokens from a file, stdin or onchain events."""
+    jwks_cache = get_jwks_cache(
+        args.expected_issuer, args.well_known_path, args.jwks_cache
+    )
+    with ExitStack() as stack:
+        if args.tokens_file == "-":
+            tokens = read_tokens(sys.stdin)
+        elif args.tokens_file:
+            tokens = read_tokens(stack.enter_context(Path(args.tokens_file).open()))
+        else:
+            tokens = read_tokens_from_logs(
+                args.rpc_url or "",
+                args.contract_address or "",
+                args.from_block or 0,
+                args.to_block,
+            )
+        report = (
+            sys.stdout
+            if args.report == "-"
+            else stack.enter_context(Path(args.report).open("w"))
+        )
+        summary = verify_batch(
+            tokens,
+            args.expected_issuer,
+            args.well_known_path,
+            jwks_cache,
+            report,
+            args.concurrency,
+        )
+
+    sys.stderr.write(
+        f"Verified {summary.total} tokens in {summary.elapsed:.2f}s "
+        f"({summary.tokens_per_second:.0f} tokens/s): {summary.valid} valid, "
+        f"{summary.total - summary.valid} invalid\n"
+    )
+    return summary.valid == summary.total
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import AsyncIterator
+from dataclasses import asdict
+
+from aiohttp import web
+
+from verification.batch import TokenInput
+from verification.helper import get_jwks_cache, parse_server_args
+from verification.verifier import AsyncVerifier
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 1000
+VERIFIER_KEY = web.AppKey("verifier", AsyncVerifier)
+
+
+def _to_token_input(entry: object) -> TokenInput:
+    if isinstance(entry, str):
+        return TokenInput(token=entry)
+    if isinstance(entry, dict) and isinstance(entry.get("token"), str):
+        uid = entry.get("uid")
+        return TokenInput(
+            token=entry["token"], uid=uid if isinstance(uid, int) else None
+        )
+    msg = "Expected a token string or an object with `token`"
+    raise web.HTTPBadRequest(text=msg)
+
+
+async def handle_verify(request: web.Request) -> web.Response:
+    """Verify `{"token": ...}`, or `{"tokens": [...]}` as a batch."""
+    verifier = request.app[VERIFIER_KEY]
+    try:
+        body = await request.json()
+    except ValueError as e:
+        raise web.HTTPBadRequest(text="Body must be JSON") from e
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Body must be a JSON object")
+
+    if "tokens" not in body:
+        token_input = _to_token_input(body)
+        result = await verifier.verify(token_input.token, token_input.uid)
+        return web.json_response(asdict(result))
+
+    entries = body["tokens"]
+    if not isinstance(entries, list):
+        raise web.HTTPBadRequest(text="`tokens` must be a list")
+    if len(entries) > MAX_BATCH_SIZE:
+        msg = f"At most {MAX_BATCH_SIZE} tokens per request"
+        raise web.HTTPRequestEntityTooLarge(
+            max_size=MAX_BATCH_SIZE, actual_size=len(entries), text=msg
+        )
+    results = await verifier.verify_many([_to_token_input(e) for e in entries])
+    return web.json_response({"results": [asdict(result) for result in results]})
+
+
+async def handle_health(_: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+def create_app(verifier: AsyncVerifier) -> web.Application:
+    """Build the HTTP app serving `POST /verify` with the given verifier."""
+    app = web.Application()
+    app[VERIFIER_KEY] = verifier
+    app.router.add_post("/verify", handle_verify)
+    app.router.add_get("/health", handle_health)
+
+    async def keep_warm(app: web.Application) -> AsyncIterator[None]:
+        task = asyncio.create_task(app[VERIFIER_KEY].keep_warm())
+        yield
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    app.cleanup_ctx.append(keep_warm)
+    return app
+
+
+def start() -> None:
+    args = parse_server_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logger.info("Expected issuer: %s", args.expected_issuer)
+
+    verifier = AsyncVerifier(
+        args.expected_issuer,
+        args.well_known_path,
+        get_jwks_cache(args.expected_issuer, args.well_known_path, args.jwks_cache),
+        args.result_cache_size,
+    )
+    web.run_app(create_app(verifier), host=args.host, port=args.port)
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from verification.batch import TokenInput, VerifyResult, verify_token
+from verification.helper import get_jwks_cache
+from verification.jwks_cache import JWKSCache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncVerifier:
+    """Verify attestation tokens from asyncio code, keeping the issuer's keys warm.
+
+    With `result_cache_size` set, valid results are remembered by token hash
+    until the token expires, so repeated checks of one token skip the RSA work.
+    """
+
+    def __init__(
+        self,
+        expected_issuer: str,
+        well_known_path: str,
+        jwks_cache: JWKSCache | None = None,
+        result_cache_size: int = 0,
+    ) -> None:
+        self.expected_issuer = expected_issuer
+        self.well_known_path = well_known_path
+        self.jwks_cache = jwks_cache or get_jwks_cache(expected_issuer, well_known_path)
+        self.result_cache_size = result_cache_size
+        self._results: OrderedDict[str, tuple[float, VerifyResult]] = OrderedDict()
+
+    async def warm(self, margin: float = 0) -> None:
+        """Fetch the issuer's keys unless they stay valid for `margin` seconds."""
+        await asyncio.to_thread(self.jwks_cache.warm, margin)
+
+    async def keep_warm(self, interval: float = 10, margin: float = 30) -> None:
+        """Refresh the keys ahead of expiry, so no verification waits on a fetch."""
+        while True:
+            try:
+                await self.warm(margin)
+            except Exception:
+                logger.exception("Failed to refresh keys from issuer")
+            await asyncio.sleep(interval)
+
+    async def verify(self, token: str, uid: int | None = None) -> VerifyResult:
+        """Verify the signature and claims of one token."""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        cached = self._get_result(key)
+        if cached:
+            return VerifyResult(
+                uid=uid, valid=cached.valid, reason=cached.reason, claims=cached.claims
+            )
+
+        result = await asyncio.to_thread(
+            verify_token,
+            TokenInput(token=token, uid=uid),
+            self.expected_issuer,
+            self.well_known_path,
+            self.jwks_cache,
+        )
+        if result.valid:
+            self._put_result(key, result)
+        return result
+
+    async def verify_many(self, tokens: Sequence[TokenInput]) -> list[VerifyResult]:
+        """Verify tokens concurrently, returning results in input order."""
+        return await asyncio.gather(
+            *(self.verify(token.token, token.uid) for token in tokens)
+        )
+
+    def _get_result(self, key: str) -> VerifyResult | None:
+        if key not in self._results:
+            return None
+        expires_at, result = self._results[key]
+        if expires_at <= time.time():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return result
+
+    def _put_result(self, key: str, result: VerifyResult) -> None:
+        expires_at = result.claims.get("exp")
+        if not self.result_cache_size or not isinstance(expires_at, int | float):
+            return
+        self._results[key] = (expires_at, result)
+        while len(self._results) > self.result_cache_size:
+            self._results.popitem(last=False)
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from tee_gemini.batcher import BatchConfig, Batcher
+
+
+class Recorder:
+    def __init__(self, error: Exception | None = None) -> None:
+        self.batches: list[list[str]] = []
+        self.error = error
+
+    async def flush(self, items: list[str]) -> None:
+        self.batches.append(items)
+        if self.error:
+            raise self.error
+
+
+async def test_flushes_once_max_size_items_are_queued() -> None:
+    recorder = Recorder()
+    batcher = Batcher(recorder.flush, len, BatchConfig(max_size=3, max_delay=60))
+
+    await asyncio.gather(*(batcher.add(item) for item in ("a", "b", "c")))
+
+    assert recorder.batches == [["a", "b", "c"]]
+
+
+async def test_flushes_before_an_item_would_go_over_max_bytes() -> None:
+    recorder = Recorder()
+    config = BatchConfig(max_size=10, max_bytes=10, max_delay=0.01)
+    batcher = Batcher(recorder.flush, len, config)
+
+    await asyncio.gather(*(batcher.add(item) for item in ("aaaa", "bbbb", "cccc")))
+
+    assert recorder.batches == [["aaaa", "bbbb"], ["cccc"]]
+
+
+async def test_flushes_an_item_at_max_bytes_right_away() -> None:
+    recorder = Recorder()
+    batcher = Batcher(recorder.flush, len, BatchConfig(max_size=10, max_bytes=4))
+
+    await asyncio.wait_for(batcher.add("aaaa"), timeout=1)
+
+    assert recorder.batches == [["aaaa"]]
+
+
+async def test_flushes_a_partial_batch_after_max_delay() -> None:
+    recorder = Recorder()
+    batcher = Batcher(recorder.flush, len, BatchConfig(max_size=10, max_delay=0.05))
+
+    started_at = time.monotonic()
+    await asyncio.gather(batcher.add("a"), batcher.add("b"))
+
+    assert recorder.batches == [["a", "b"]]
+    assert time.monotonic() - started_at >= 0.05
+
+
+async def test_flush_errors_reach_every_item_of_the_batch() -> None:
+    recorder = Recorder(RuntimeError("reverted"))
+    batcher = Batcher(recorder.flush, len, BatchConfig(max_size=2))
+
+    results = await asyncio.gather(
+        batcher.add("a"), batcher.add("b"), return_exceptions=True
+    )
+
+    assert [str(result) for result in results] == ["reverted", "reverted"]
+
+
+async def test_items_wait_for_their_batch() -> None:
+    recorder = Recorder()
+    batcher = Batcher(recorder.flush, len, BatchConfig(max_size=2, max_delay=60))
+
+    first = asyncio.create_task(batcher.add("a"))
+    await asyncio.sleep(0.01)
+    assert not first.done()
+
+    await batcher.add("b")
+    await first
+    assert recorder.batches == [["a", "b"]]
+
+
+@pytest.mark.parametrize(("max_size", "enabled"), [(1, False), (2, True)])
+def test_batching_is_enabled_above_one_item(max_size: int, *, enabled: bool) -> None:
+    assert BatchConfig(max_size=max_size).enabled is enabled
@@ -0,0 +1,47 @@
+import pytest
+
+from tee_gemini.encoding import (
+    MAX_DECODED_SIZE,
+    EncodingVersion,
+    decode_response,
+    encode_response,
+)
+
+
+def test_short_response_is_kept_raw() -> None:
+    data = encode_response("Yes.")
+    assert data[0] == EncodingVersion.RAW
+    assert decode_response(data) == "Yes."
+
+
+def test_long_response_is_deflated() -> None:
+    text = "The quick brown fox jumps over the lazy dog. " * 100
+    data = encode_response(text)
+    assert data[0] == EncodingVersion.DEFLATE
+    assert len(data) < len(text)
+    assert decode_response(data) == text
+
+
+def test_decode_accepts_up_to_the_limit() -> None:
+    text = "a" * MAX_DECODED_SIZE
+    assert decode_response(encode_response(text)) == text
+
+
+def test_decode_rejects_responses_inflating_past_the_limit() -> None:
+    data = encode_response("a" * (MAX_DECODED_SIZE + 1))
+    # A few hundred bytes that would inflate to over 1 MiB
+    assert len(data) < 2000
+    with pytest.raises(ValueError, match="inflates to more than"):
+        decode_response(data)
+
+
+def test_decode_applies_a_given_limit() -> None:
+    data = encode_response("b" * 1000)
+    with pytest.raises(ValueError, match="inflates to more than 100 bytes"):
+        decode_response(data, max_size=100)
+
+
+@pytest.mark.parametrize("data", [b"", b"\x07abc"])
+def test_decode_rejects_invalid_encodings(data: bytes) -> None:
+    with pytest.raises(ValueError, match="encoding"):
+        decode_response(data)
@@ -0,0 +1,80 @@
+import json
+from typing import Any
+
+import pytest
+from hexbytes import HexBytes
+from web3.types import TxParams, TxReceipt
+
+from tee_gemini.config import ROOT_FOLDER
+from tee_gemini.gemini_endpoint import (
+    GeminiEndpoint,
+    GeminiResponse,
+    OIDCResponse,
+    TransactionRevertedError,
+)
+
+TX_HASH = HexBytes("0x" + "ab" * 32)
+
+
+def receipt(status: int) -> TxReceipt:
+    return TxReceipt({"transactionHash": TX_HASH, "status": status})  # pyright: ignore [reportArgumentType]
+
+
+@pytest.fixture
+def endpoint() -> GeminiEndpoint:
+    abi = json.loads(
+        (ROOT_FOLDER / "contracts" / "output" / "Interactor.abi").read_text()
+    )
+    return GeminiEndpoint(
+        "http://127.0.0.1:8545",
+        "0x000000000000000000000000000000000000dEaD",
+        abi,
+        "0x000000000000000000000000000000000000bEEF",
+        "0x" + "01" * 32,
+    )
+
+
+def mine(
+    monkeypatch: pytest.MonkeyPatch, endpoint: GeminiEndpoint, status: int
+) -> None:
+    """Have sent txs get a receipt with `status`, without a node."""
+
+    async def send_transaction(tx: TxParams) -> HexBytes:
+        assert tx
+        return TX_HASH
+
+    async def wait_for_receipt(tx_hash: HexBytes, **_: Any) -> TxReceipt:  # noqa: ANN401
+        assert tx_hash == TX_HASH
+        return receipt(status)
+
+    monkeypatch.setattr(endpoint, "send_transaction", send_transaction)
+    monkeypatch.setattr(endpoint, "wait_for_receipt", wait_for_receipt)
+
+
+async def test_returns_the_receipt_of_a_successful_tx(
+    monkeypatch: pytest.MonkeyPatch, endpoint: GeminiEndpoint
+) -> None:
+    mine(monkeypatch, endpoint, status=1)
+
+    tx_receipt = await endpoint.sign_and_send_transaction(TxParams({"gas": 1}))
+
+    assert tx_receipt["status"] == 1
+    assert endpoint.in_flight_txs == 0
+
+
+async def test_raises_when_the_tx_reverted(
+    monkeypatch: pytest.MonkeyPatch, endpoint: GeminiEndpoint
+) -> None:
+    mine(monkeypatch, endpoint, status=0)
+    sent: list[tuple[GeminiResponse | OIDCResponse, HexBytes]] = []
+    endpoint.tx_sent_listeners.append(lambda r, h: sent.append((r, h)))
+    response = OIDCResponse(uid=1, token="token")  # noqa: S106
+
+    with pytest.raises(TransactionRevertedError) as error:
+        await endpoint.sign_and_send_transaction(TxParams({"gas": 1}), [response])
+
+    assert error.value.receipt["status"] == 0
+    assert TX_HASH.to_0x_hex() in str(error.value)
+    # Listeners still learn the hash, so a restart checks the receipt
+    assert sent == [(response, TX_HASH)]
+    assert endpoint.in_flight_txs == 0
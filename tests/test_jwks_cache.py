@@ -0,0 +1,123 @@
+import base64
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from verification import jwks_cache
+from verification.jwks_cache import JWKSCache
+
+ISSUER = "https://issuer.test"
+WELL_KNOWN_PATH = "/.well-known/openid-configuration"
+JWKS_URI = f"{ISSUER}/jwks"
+
+
+def to_jwk(kid: str) -> dict[str, str]:
+    numbers = rsa.generate_private_key(65537, 2048).public_key().public_numbers()
+
+    def encode(value: int) -> str:
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+    return {"kty": "RSA", "kid": kid, "n": encode(numbers.n), "e": encode(numbers.e)}
+
+
+@dataclass
+class FakeResponse:
+    status_code: int
+    body: dict[str, Any]
+    headers: dict[str, str]
+
+    def json(self) -> dict[str, Any]:
+        return self.body
+
+
+@dataclass
+class FakeIssuer:
+    """Serves the discovery document and the JWKS, recording each request."""
+
+    keys: list[dict[str, str]]
+    cache_control: str = "max-age=300"
+    etag: str = '"v1"'
+    requests: list[tuple[str, dict[str, str]]] = field(default_factory=list)
+
+    def get(self, url: str, headers: dict[str, str], timeout: float) -> FakeResponse:
+        assert timeout > 0
+        self.requests.append((url, headers))
+        response_headers = {"Cache-Control": self.cache_control, "ETag": self.etag}
+        if headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304, {}, response_headers)
+        if url == ISSUER + WELL_KNOWN_PATH:
+            return FakeResponse(200, {"jwks_uri": JWKS_URI}, response_headers)
+        return FakeResponse(200, {"keys": self.keys}, response_headers)
+
+    def urls(self) -> list[str]:
+        return [url for url, _ in self.requests]
+
+
+@pytest.fixture
+def issuer(monkeypatch: pytest.MonkeyPatch) -> FakeIssuer:
+    issuer = FakeIssuer([to_jwk("k1")])
+    monkeypatch.setattr(jwks_cache.requests, "get", issuer.get)
+    return issuer
+
+
+def test_keys_are_served_from_cache_within_max_age(issuer: FakeIssuer) -> None:
+    cache = JWKSCache(ISSUER, WELL_KNOWN_PATH)
+
+    first = cache.get_key("k1")
+    assert cache.get_key("k1") is first
+
+    assert issuer.urls() == [ISSUER + WELL_KNOWN_PATH, JWKS_URI]
+
+
+def test_expired_documents_are_revalidated_with_their_etag(
+    issuer: FakeIssuer,
+) -> None:
+    issuer.cache_control = "max-age=0"
+    cache = JWKSCache(ISSUER, WELL_KNOWN_PATH)
+    first = cache.get_key("k1")
+    issuer.requests.clear()
+
+    assert cache.get_key("k1").public_numbers() == first.public_numbers()
+
+    assert issuer.requests == [
+        (ISSUER + WELL_KNOWN_PATH, {"If-None-Match": '"v1"'}),
+        (JWKS_URI, {"If-None-Match": '"v1"'}),
+    ]
+
+
+def test_unknown_kid_refetches_the_jwks_at_most_once_per_interval(
+    issuer: FakeIssuer,
+) -> None:
+    cache = JWKSCache(ISSUER, WELL_KNOWN_PATH, min_refetch_interval=0.1)
+    cache.get_key("k1")
+    issuer.requests.clear()
+
+    # A bogus kid refetches once, then is rejected from the cache
+    for _ in range(5):
+        with pytest.raises(ValueError, match="Unable to find appropriate key"):
+            cache.get_key("bogus")
+    assert issuer.urls() == [JWKS_URI]
+
+    # A rotated key is picked up once the interval has passed
+    issuer.keys = [to_jwk("k2")]
+    issuer.etag = '"v2"'
+    time.sleep(0.1)
+    cache.get_key("k2")
+    assert issuer.urls() == [JWKS_URI, JWKS_URI]
+
+
+def test_keys_survive_a_restart_through_the_cache_file(
+    issuer: FakeIssuer, tmp_path: Path
+) -> None:
+    cache_path = str(tmp_path / "jwks.json")
+    JWKSCache(ISSUER, WELL_KNOWN_PATH, cache_path=cache_path).get_key("k1")
+    issuer.requests.clear()
+
+    JWKSCache(ISSUER, WELL_KNOWN_PATH, cache_path=cache_path).get_key("k1")
+
+    assert issuer.requests == []
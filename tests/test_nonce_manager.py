@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from web3 import AsyncWeb3
+
+from tee_gemini.nonce_manager import NonceManager, is_nonce_error
+
+ADDRESS = AsyncWeb3.to_checksum_address("0x000000000000000000000000000000000000dead")
+
+
+class FakeEth:
+    def __init__(self, pending_nonce: int) -> None:
+        self.pending_nonce = pending_nonce
+        self.calls = 0
+
+    async def get_transaction_count(self, address: str, block: str) -> int:
+        assert (address, block) == (ADDRESS, "pending")
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.pending_nonce
+
+
+class FakeWeb3:
+    def __init__(self, pending_nonce: int) -> None:
+        self.eth = FakeEth(pending_nonce)
+
+
+def nonce_manager(pending_nonce: int) -> tuple[NonceManager, FakeEth]:
+    w3 = FakeWeb3(pending_nonce)
+    manager = NonceManager(w3, ADDRESS)  # pyright: ignore [reportArgumentType]
+    return manager, w3.eth
+
+
+async def test_nonces_are_allocated_locally_after_seeding() -> None:
+    manager, eth = nonce_manager(5)
+
+    assert [await manager.next_nonce() for _ in range(3)] == [5, 6, 7]
+    assert eth.calls == 1
+
+
+async def test_concurrent_txs_get_distinct_nonces() -> None:
+    manager, eth = nonce_manager(0)
+
+    nonces = await asyncio.gather(*(manager.next_nonce() for _ in range(20)))
+
+    assert sorted(nonces) == list(range(20))
+    assert eth.calls == 1
+
+
+async def test_resync_restarts_from_the_chain() -> None:
+    manager, eth = nonce_manager(5)
+    for _ in range(3):
+        await manager.next_nonce()
+
+    # Nonces 6 and 7 were dropped by the node
+    eth.pending_nonce = 6
+    await manager.resync()
+
+    assert await manager.next_nonce() == 6
+    assert eth.calls == 2
+
+
+@pytest.mark.parametrize(
+    ("message", "expected"),
+    [
+        ("nonce too low: next nonce 7, tx nonce 5", True),
+        ("Invalid nonce", True),
+        ("replacement transaction underpriced", True),
+        ("insufficient funds for gas", False),
+    ],
+)
+def test_is_nonce_error(message: str, *, expected: bool) -> None:
+    assert is_nonce_error(ValueError(message)) is expected
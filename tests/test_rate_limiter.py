@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+
+from tee_gemini.rate_limiter import (
+    AdaptiveConcurrency,
+    QuotaLimiter,
+    RateLimitConfig,
+    TokenBucket,
+)
+
+
+def tokens_left(bucket: TokenBucket) -> float:
+    return (
+        bucket.capacity - bucket.wait_time(bucket.capacity) * bucket.refill_per_second
+    )
+
+
+def test_overload_halves_the_limit_once_per_cooldown() -> None:
+    concurrency = AdaptiveConcurrency(max_limit=16, cooldown=60)
+
+    concurrency.on_overload()
+    assert concurrency.limit == 8
+    # Calls in flight fail together, only the first failure counts
+    concurrency.on_overload()
+    assert concurrency.limit == 8
+
+
+def test_overload_keeps_at_least_one_call() -> None:
+    concurrency = AdaptiveConcurrency(max_limit=2, cooldown=0)
+    for _ in range(5):
+        concurrency.on_overload()
+    assert concurrency.limit == 1
+
+
+def test_success_grows_the_limit_additively_up_to_the_max() -> None:
+    concurrency = AdaptiveConcurrency(max_limit=16, cooldown=60)
+    concurrency.on_overload()
+
+    # About one more call per `limit` successes
+    for _ in range(8):
+        concurrency.on_success()
+    assert 8.9 < concurrency.limit < 9.1
+
+    for _ in range(1000):
+        concurrency.on_success()
+    assert concurrency.limit == 16
+
+
+async def test_limits_calls_in_flight() -> None:
+    concurrency = AdaptiveConcurrency(max_limit=4)
+    concurrency.on_overload()
+    running = 0
+    peak = 0
+
+    async def call() -> None:
+        nonlocal running, peak
+        async with concurrency:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(call() for _ in range(10)))
+
+    assert peak == 2
+
+
+class FlakyCall:
+    def __init__(self, errors: list[Exception]) -> None:
+        self.errors = errors
+        self.calls = 0
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 100
+
+
+def limiter(max_retries: int = 3) -> QuotaLimiter:
+    return QuotaLimiter(
+        RateLimitConfig(
+            tokens_per_minute=1000, max_retries=max_retries, base_delay=0, max_delay=0
+        )
+    )
+
+
+async def test_run_settles_the_estimate_with_real_usage() -> None:
+    quota = limiter()
+    call = FlakyCall([])
+
+    assert await quota.run(call, estimated_tokens=300, tokens_used=lambda n: n) == 100
+
+    assert tokens_left(quota.tokens) == pytest.approx(900, abs=1)
+
+
+async def test_run_refunds_the_estimate_of_failed_attempts() -> None:
+    quota = limiter()
+    call = FlakyCall([ServiceUnavailable("down"), ServiceUnavailable("down")])
+
+    await quota.run(call, estimated_tokens=300, tokens_used=lambda n: n)
+
+    assert call.calls == 3
+    # Only the call that went through is charged
+    assert tokens_left(quota.tokens) == pytest.approx(900, abs=1)
+
+
+async def test_run_gives_up_after_max_retries() -> None:
+    quota = limiter(max_retries=2)
+    call = FlakyCall([ServiceUnavailable("down")] * 3)
+
+    with pytest.raises(ServiceUnavailable):
+        await quota.run(call, estimated_tokens=300, tokens_used=lambda n: n)
+
+    assert call.calls == 3
+    assert tokens_left(quota.tokens) == pytest.approx(1000, abs=1)
+
+
+async def test_run_backs_off_concurrency_when_rate_limited() -> None:
+    quota = limiter()
+    call = FlakyCall([TooManyRequests("slow down")])
+
+    await quota.run(call, estimated_tokens=1, tokens_used=lambda n: n)
+
+    assert quota.concurrency.limit < quota.config.max_concurrency
+
+
+async def test_token_bucket_waits_for_refill() -> None:
+    bucket = TokenBucket(capacity=10, refill_per_second=100)
+    await bucket.acquire(10)
+    assert bucket.wait_time(5) == pytest.approx(0.05, abs=0.01)
+
+    started_at = asyncio.get_running_loop().time()
+    await bucket.acquire(5)
+    assert asyncio.get_running_loop().time() - started_at >= 0.04
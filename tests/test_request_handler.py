@@ -0,0 +1,151 @@
+import json
+from dataclasses import asdict
+from pathlib import Path
+
+import pytest
+from hexbytes import HexBytes
+from web3.exceptions import ContractLogicError
+from web3.types import TxReceipt
+
+from tee_gemini.gemini_endpoint import (
+    GeminiResponse,
+    TransactionRevertedError,
+    TxSentListener,
+)
+from tee_gemini.request_handler import RequestHandler
+from tee_gemini.state_store import RequestKind, RequestState, StateStore
+
+
+def receipt(tx_hash: HexBytes, status: int) -> TxReceipt:
+    return TxReceipt({"transactionHash": tx_hash, "status": status})  # pyright: ignore [reportArgumentType]
+
+
+class FakeGeminiAPI:
+    def __init__(self) -> None:
+        self.queries = 0
+
+    async def make_query(self, uid: int, data: str) -> GeminiResponse:
+        self.queries += 1
+        return GeminiResponse(uid, f"Answer to {data}", 1, 2, 3)
+
+
+class FakeEndpoint:
+    """Mines each fulfillment tx with the next of `statuses`."""
+
+    def __init__(self, statuses: list[int | Exception]) -> None:
+        self.statuses = statuses
+        self.tx_sent_listeners: list[TxSentListener] = []
+        self.receipts: dict[HexBytes, TxReceipt] = {}
+
+    async def fulfill_gemini_request(self, response: GeminiResponse) -> None:
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        tx_hash = HexBytes(len(self.receipts).to_bytes(32, "big"))
+        self.receipts[tx_hash] = receipt(tx_hash, status)
+        for listener in self.tx_sent_listeners:
+            listener(response, tx_hash)
+        if status != 1:
+            raise TransactionRevertedError(self.receipts[tx_hash])
+
+    async def wait_for_receipt(self, tx_hash: HexBytes) -> TxReceipt:
+        return self.receipts[tx_hash]
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> StateStore:
+    store = StateStore(str(tmp_path / "state.sqlite3"), 1, "0xdead")
+    store.mark_seen(RequestKind.PROMPT, 1, data="hi")
+    return store
+
+
+def handler(
+    store: StateStore, statuses: list[int | Exception]
+) -> tuple[RequestHandler, FakeGeminiAPI, FakeEndpoint]:
+    gemini_api = FakeGeminiAPI()
+    endpoint = FakeEndpoint(statuses)
+    request_handler = RequestHandler(
+        gemini_api,  # pyright: ignore [reportArgumentType]
+        endpoint,  # pyright: ignore [reportArgumentType]
+        None,  # pyright: ignore [reportArgumentType]
+        store,
+    )
+    return request_handler, gemini_api, endpoint
+
+
+async def test_fulfilled_request_is_confirmed(store: StateStore) -> None:
+    request_handler, _, _ = handler(store, [1])
+
+    await request_handler.handle_prompt_request(1, "hi")
+
+    record = store.get(RequestKind.PROMPT, 1)
+    assert record
+    assert record.state == RequestState.CONFIRMED
+
+
+async def test_reverted_fulfillment_is_not_confirmed(store: StateStore) -> None:
+    request_handler, _, _ = handler(store, [0])
+
+    await request_handler.handle_prompt_request(1, "hi")
+
+    record = store.get(RequestKind.PROMPT, 1)
+    assert record
+    assert record.state == RequestState.TX_SENT
+    assert [r.uid for r in store.pending()] == [1]
+
+
+async def test_resume_resends_a_reverted_tx_without_querying_again(
+    store: StateStore,
+) -> None:
+    request_handler, gemini_api, endpoint = handler(store, [0, 1])
+    await request_handler.handle_prompt_request(1, "hi")
+
+    (record,) = store.pending()
+    await request_handler.resume(record)
+
+    assert gemini_api.queries == 1
+    assert len(endpoint.receipts) == 2
+    record = store.get(RequestKind.PROMPT, 1)
+    assert record
+    assert record.state == RequestState.CONFIRMED
+
+
+async def test_resume_confirms_a_tx_that_landed_before_a_restart(
+    store: StateStore,
+) -> None:
+    request_handler, gemini_api, endpoint = handler(store, [])
+    tx_hash = HexBytes(b"\x01" * 32)
+    endpoint.receipts[tx_hash] = receipt(tx_hash, 1)
+    response = GeminiResponse(1, "Answer to hi", 1, 2, 3)
+    store.mark_queried(RequestKind.PROMPT, 1, json.dumps(asdict(response)))
+    store.mark_tx_sent(RequestKind.PROMPT, 1, tx_hash.to_0x_hex())
+
+    (record,) = store.pending()
+    await request_handler.resume(record)
+
+    assert gemini_api.queries == 0
+    assert store.pending() == []
+
+
+async def test_request_fulfilled_by_another_instance_is_confirmed(
+    store: StateStore,
+) -> None:
+    error = ContractLogicError("execution reverted: Response already exists")
+    request_handler, _, _ = handler(store, [error])
+
+    await request_handler.handle_prompt_request(1, "hi")
+
+    record = store.get(RequestKind.PROMPT, 1)
+    assert record
+    assert record.state == RequestState.CONFIRMED
+
+
+async def test_other_contract_errors_leave_the_request_pending(
+    store: StateStore,
+) -> None:
+    error = ContractLogicError("execution reverted: Not an owner")
+    request_handler, _, _ = handler(store, [error])
+
+    await request_handler.handle_prompt_request(1, "hi")
+
+    assert [r.uid for r in store.pending()] == [1]
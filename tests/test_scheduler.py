@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from tee_gemini.scheduler import FairScheduler, Job, SchedulerConfig
+from tee_gemini.state_store import RequestKind
+
+UNLIMITED = SchedulerConfig(sender_queue_size=0, sender_concurrency=0)
+
+
+async def noop() -> None:
+    pass
+
+
+def job(
+    name: str,
+    sender: str = "",
+    kind: RequestKind = RequestKind.PROMPT,
+    tokens: int = 0,
+) -> Job:
+    return Job(name=name, run=noop, kind=kind, sender=sender, tokens=tokens)
+
+
+async def drain(queue: FairScheduler, count: int) -> list[Job]:
+    jobs = []
+    for _ in range(count):
+        jobs.append(await queue.get())
+        queue.task_done(jobs[-1])
+    return jobs
+
+
+async def test_flooding_sender_only_delays_itself() -> None:
+    queue = FairScheduler(UNLIMITED)
+    for i in range(10):
+        await queue.put(job(f"a{i}", sender="a"))
+    await queue.put(job("b0", sender="b"))
+    await queue.put(job("b1", sender="b"))
+
+    jobs = await drain(queue, 4)
+
+    assert [j.name for j in jobs] == ["a0", "b0", "a1", "b1"]
+
+
+async def test_senders_share_by_estimated_tokens() -> None:
+    queue = FairScheduler(UNLIMITED)
+    for i in range(3):
+        await queue.put(job(f"big{i}", sender="big", tokens=1000))
+    for i in range(3):
+        await queue.put(job(f"small{i}", sender="small", tokens=100))
+
+    jobs = await drain(queue, 4)
+
+    # After one large prompt, the small ones of the other sender go first
+    assert [j.name for j in jobs] == ["big0", "small0", "small1", "small2"]
+
+
+async def test_kinds_are_started_in_the_ratio_of_their_weights() -> None:
+    queue = FairScheduler(SchedulerConfig(oidc_weight=4, prompt_weight=1))
+    for i in range(20):
+        await queue.put(job(f"oidc{i}", kind=RequestKind.OIDC))
+        await queue.put(job(f"prompt{i}"))
+
+    jobs = await drain(queue, 10)
+
+    assert sum(j.kind == RequestKind.OIDC for j in jobs) == 8
+    assert sum(j.kind == RequestKind.PROMPT for j in jobs) == 2
+
+
+async def test_try_put_enforces_the_per_sender_queue_size() -> None:
+    queue = FairScheduler(SchedulerConfig(sender_queue_size=2))
+
+    assert queue.try_put(job("a0", sender="a"))
+    assert queue.try_put(job("a1", sender="a"))
+    assert not queue.try_put(job("a2", sender="a"))
+    assert queue.try_put(job("b0", sender="b"))
+
+    # Room frees up once a job of the sender is started
+    assert (await queue.get()).name == "a0"
+    assert queue.try_put(job("a2", sender="a"))
+
+
+def test_try_put_does_not_limit_unknown_senders() -> None:
+    queue = FairScheduler(SchedulerConfig(sender_queue_size=2))
+
+    # Stored before senders were recorded
+    assert all(queue.try_put(job(f"x{i}")) for i in range(3))
+
+
+async def test_try_put_enforces_the_queue_size() -> None:
+    queue = FairScheduler(UNLIMITED, maxsize=2)
+
+    assert queue.try_put(job("a0", sender="a"))
+    assert queue.try_put(job("b0", sender="b"))
+    assert queue.full()
+    assert not queue.try_put(job("c0", sender="c"))
+
+
+async def test_put_waits_for_room() -> None:
+    queue = FairScheduler(UNLIMITED, maxsize=1)
+    await queue.put(job("a0"))
+
+    put = asyncio.create_task(queue.put(job("a1")))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+
+    await queue.get()
+    await asyncio.wait_for(put, timeout=1)
+    assert queue.qsize() == 1
+
+
+async def test_sender_concurrency_holds_back_its_next_job() -> None:
+    queue = FairScheduler(SchedulerConfig(sender_concurrency=1))
+    await queue.put(job("a0", sender="a"))
+    await queue.put(job("a1", sender="a"))
+    await queue.put(job("b0", sender="b"))
+
+    first = await queue.get()
+    second = await queue.get()
+    assert [first.name, second.name] == ["a0", "b0"]
+
+    # a1 waits for a0 to finish, even though a worker is free
+    with pytest.raises(TimeoutError):
+        await asyncio.wait_for(queue.get(), timeout=0.05)
+
+    queue.task_done(first)
+    third = await asyncio.wait_for(queue.get(), timeout=1)
+    assert third.name == "a1"
+
+
+async def test_sender_token_budget_holds_back_its_next_job() -> None:
+    # 600 tokens a minute refill 10 a second
+    queue = FairScheduler(
+        SchedulerConfig(sender_concurrency=0, sender_tokens_per_minute=600)
+    )
+    await queue.put(job("a0", sender="a", tokens=600))
+    await queue.put(job("a1", sender="a", tokens=1))
+    await queue.put(job("b0", sender="b", tokens=600))
+
+    jobs = await drain(queue, 2)
+    assert [j.name for j in jobs] == ["a0", "b0"]
+
+    # a1 needs 1 token, so after about 0.1s
+    started_at = asyncio.get_running_loop().time()
+    (third,) = await asyncio.wait_for(drain(queue, 1), timeout=1)
+    assert third.name == "a1"
+    assert asyncio.get_running_loop().time() - started_at >= 0.05
+
+
+async def test_join_waits_for_task_done() -> None:
+    queue = FairScheduler(UNLIMITED)
+    await queue.put(job("a0"))
+    started = await queue.get()
+
+    join = asyncio.create_task(queue.join())
+    await asyncio.sleep(0.01)
+    assert not join.done()
+
+    queue.task_done(started)
+    await asyncio.wait_for(join, timeout=1)
+
+
+def test_weights_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="positive"):
+        SchedulerConfig(oidc_weight=0)
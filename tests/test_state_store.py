@@ -0,0 +1,126 @@
+from pathlib import Path
+
+import pytest
+
+from tee_gemini.state_store import RequestKind, RequestState, StateStore
+
+CHAIN_ID = 1
+CONTRACT = "0x000000000000000000000000000000000000dEaD"
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    return str(tmp_path / "state.sqlite3")
+
+
+def test_resumes_checkpoint_and_requests_after_a_restart(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    store.mark_seen(RequestKind.PROMPT, 1, data="hi", sender="0xa", block=10)
+    store.mark_seen(RequestKind.PROMPT, 2, data="yo", sender="0xb", block=11)
+    store.mark_seen(RequestKind.OIDC, 1, sender="0xa", block=11)
+    store.mark_queried(RequestKind.PROMPT, 1, '{"text": "hello"}')
+    store.mark_tx_sent(RequestKind.PROMPT, 1, "0x01")
+    store.mark_confirmed(RequestKind.OIDC, 1)
+    store.set_checkpoint(12)
+    store.close()
+
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+
+    assert store.get_checkpoint() == 12
+    pending = {(r.kind, r.uid): r for r in store.pending()}
+    assert set(pending) == {(RequestKind.PROMPT, 1), (RequestKind.PROMPT, 2)}
+    sent = pending[RequestKind.PROMPT, 1]
+    assert sent.state == RequestState.TX_SENT
+    assert sent.response == '{"text": "hello"}'
+    assert sent.tx_hash == "0x01"
+    assert sent.sender == "0xa"
+    assert pending[RequestKind.PROMPT, 2].data == "yo"
+
+
+def test_mark_seen_reports_known_requests(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+
+    assert store.mark_seen(RequestKind.PROMPT, 1)
+    assert not store.mark_seen(RequestKind.PROMPT, 1)
+    assert store.mark_seen(RequestKind.OIDC, 1)
+
+
+@pytest.mark.parametrize(
+    ("chain_id", "contract"),
+    [(CHAIN_ID, "0x000000000000000000000000000000000000bEEF"), (5, CONTRACT)],
+)
+def test_clears_state_of_another_deployment(
+    path: str, chain_id: int, contract: str
+) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    store.mark_seen(RequestKind.PROMPT, 1)
+    store.set_checkpoint(100)
+    store.close()
+
+    store = StateStore(path, chain_id, contract)
+
+    # Block 100 and uid 1 of the old contract mean nothing for this one
+    assert store.get_checkpoint() is None
+    assert store.get(RequestKind.PROMPT, 1) is None
+    store.set_checkpoint(7)
+    store.close()
+
+    # The store now belongs to the new deployment and resumes it
+    store = StateStore(path, chain_id, contract)
+    assert store.get_checkpoint() == 7
+
+
+def test_keeps_stores_from_before_deployments_were_recorded(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    store.mark_seen(RequestKind.PROMPT, 1)
+    store.set_checkpoint(100)
+    store.conn.execute("DROP TABLE deployment")
+    store.close()
+
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+
+    assert store.get_checkpoint() == 100
+    assert store.get(RequestKind.PROMPT, 1) is not None
+
+
+def test_pending_leaves_out_finished_and_deferred_requests(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    for uid in range(1, 6):
+        store.mark_seen(RequestKind.PROMPT, uid)
+    store.mark_seen(RequestKind.PROMPT, 6, state=RequestState.DEFERRED)
+    store.mark_queried(RequestKind.PROMPT, 2, "{}")
+    store.mark_tx_sent(RequestKind.PROMPT, 3, "0x03")
+    store.mark_confirmed(RequestKind.PROMPT, 4)
+    store.mark_rejected(RequestKind.PROMPT, 5)
+
+    assert [r.uid for r in store.pending()] == [1, 2, 3]
+    assert [r.uid for r in store.deferred(before=float("inf"))] == [6]
+
+
+def test_pending_returns_the_oldest_per_sender(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    for uid in range(1, 5):
+        store.mark_seen(RequestKind.PROMPT, uid, sender="0xa")
+    store.mark_seen(RequestKind.PROMPT, 5, sender="0xb")
+
+    assert [r.uid for r in store.pending(per_sender=2)] == [1, 2, 5]
+    assert len(store.pending()) == 5
+
+
+def test_prune_deletes_finished_requests_before_the_block(path: str) -> None:
+    store = StateStore(path, CHAIN_ID, CONTRACT)
+    store.mark_seen(RequestKind.PROMPT, 1, block=10)
+    store.mark_seen(RequestKind.PROMPT, 2, block=10)
+    store.mark_seen(RequestKind.PROMPT, 3, block=10)
+    store.mark_seen(RequestKind.PROMPT, 4, block=20)
+    store.mark_confirmed(RequestKind.PROMPT, 1)
+    store.mark_rejected(RequestKind.PROMPT, 2)
+    store.mark_confirmed(RequestKind.PROMPT, 4)
+
+    assert store.prune(before_block=15) == 2
+
+    assert store.get(RequestKind.PROMPT, 1) is None
+    assert store.get(RequestKind.PROMPT, 2) is None
+    # Still pending, or submitted in a block that may be ingested again
+    assert store.get(RequestKind.PROMPT, 3) is not None
+    assert store.get(RequestKind.PROMPT, 4) is not None
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from tee_gemini.scheduler import Job, SchedulerConfig
+from tee_gemini.state_store import RequestKind
+from tee_gemini.worker_pool import WorkerPool
+
+
+async def noop() -> None:
+    pass
+
+
+def job(uid: int, run: asyncio.Future[None] | None = None, sender: str = "") -> Job:
+    async def wait() -> None:
+        if run is not None:
+            await run
+
+    return Job(name=f"uid={uid}", run=wait, uid=uid, sender=sender)
+
+
+async def test_try_submit_tracks_the_request_until_retry_after() -> None:
+    pool = WorkerPool(num_workers=1, queue_size=10, retry_after=0.05)
+    release = asyncio.get_running_loop().create_future()
+
+    assert pool.try_submit(job(1, release))
+    assert pool.has_job(RequestKind.PROMPT, 1)
+    assert not pool.has_job(RequestKind.OIDC, 1)
+    assert not pool.has_job(RequestKind.PROMPT, 2)
+
+    pool.start()
+    release.set_result(None)
+    await pool.join()
+    # Ended recently, so a poll seeing it again does not queue it twice
+    assert pool.has_job(RequestKind.PROMPT, 1)
+
+    await asyncio.sleep(0.06)
+    assert not pool.has_job(RequestKind.PROMPT, 1)
+    await pool.stop()
+
+
+async def test_try_submit_leaves_requests_it_has_no_room_for() -> None:
+    pool = WorkerPool(num_workers=1, queue_size=1)
+
+    assert pool.try_submit(job(1))
+    assert not pool.try_submit(job(2))
+    assert not pool.has_job(RequestKind.PROMPT, 2)
+
+
+async def test_try_submit_respects_the_per_sender_queue_size() -> None:
+    pool = WorkerPool(
+        num_workers=1,
+        queue_size=10,
+        scheduler_config=SchedulerConfig(sender_queue_size=1),
+    )
+
+    assert pool.try_submit(job(1, sender="a"))
+    assert not pool.try_submit(job(2, sender="a"))
+    assert pool.try_submit(job(3, sender="b"))
+
+
+async def test_failing_job_does_not_stall_the_others() -> None:
+    pool = WorkerPool(num_workers=1, queue_size=10)
+    done: list[int] = []
+
+    async def fail() -> None:
+        msg = "boom"
+        raise RuntimeError(msg)
+
+    def record(uid: int) -> Job:
+        async def run() -> None:
+            done.append(uid)
+
+        return Job(name=f"uid={uid}", run=run, uid=uid)
+
+    await pool.submit(Job(name="uid=1", run=fail, uid=1))
+    await pool.submit(record(2))
+    await pool.submit(record(3))
+    pool.start()
+    await asyncio.wait_for(pool.join(), timeout=1)
+
+    assert done == [2, 3]
+    await pool.stop()
+
+
+async def test_runs_at_most_num_workers_jobs_at_once() -> None:
+    pool = WorkerPool(num_workers=3, queue_size=20)
+    running = 0
+    peak = 0
+
+    async def run() -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for uid in range(1, 11):
+        await pool.submit(Job(name=f"uid={uid}", run=run, uid=uid))
+    pool.start()
+    await asyncio.wait_for(pool.join(), timeout=1)
+
+    assert peak == 3
+    await pool.stop()
+
+
+def test_needs_a_worker() -> None:
+    with pytest.raises(ValueError, match="positive"):
+        WorkerPool(num_workers=0, queue_size=1)